@@ -0,0 +1,198 @@
+# DistUpgradeArchives.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt
+import apt_inst
+import apt_pkg
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from .DistUpgradePackageCache import archive_name
+
+
+def mirror_of(uri):
+    """ the mirror an archive uri is downloaded from (up to pool/) """
+    if "/pool/" in uri:
+        return uri[:uri.index("/pool/") + 1]
+    (scheme, netloc) = urlsplit(uri)[:2]
+    return "%s://%s/" % (scheme, netloc)
+
+
+def verify_archive(path, sha256, size):
+    """
+    check the size and SHA256 sum of the .deb at path and that its
+    control member can be read, returns None if it is fine and the
+    problem otherwise
+    """
+    try:
+        if os.path.getsize(path) != size:
+            return "size mismatch"
+        with open(path, "rb") as f:
+            hashes = apt_pkg.Hashes(f).hashes
+            if hashes.find("SHA256").hashvalue != sha256:
+                return "hash sum mismatch"
+        apt_inst.DebFile(path).control.extractdata("control")
+    except (OSError, SystemError, LookupError) as e:
+        return str(e)
+    return None
+
+
+def verify_archives(versions, archivedir, workers=None):
+    """
+    verify the .debs of versions in archivedir with a pool of processes
+    (as many as there are cpus if workers is not given), returns the
+    (version, problem) pairs of the bad ones
+    """
+    jobs = [(version, os.path.join(archivedir, archive_name(version)))
+            for version in versions if version.sha256]
+    jobs = [(version, path) for (version, path) in jobs
+            if os.path.exists(path)]
+    if not jobs:
+        return []
+    with ProcessPoolExecutor(max_workers=workers or None) as pool:
+        results = pool.map(verify_archive,
+                           [path for (version, path) in jobs],
+                           [version.sha256 for (version, path) in jobs],
+                           [version.size for (version, path) in jobs],
+                           chunksize=16)
+        return [(version, problem)
+                for ((version, path), problem) in zip(jobs, results)
+                if problem is not None]
+
+
+class FetchEngine():
+    """
+    Download the archives needed to commit a cache
+
+    The first round queues all archives like apt.Cache.commit() does,
+    after that only the items that failed are queued again until they
+    are downloaded or out of retries. Every item and every mirror has
+    its own retry budget, the items of a mirror that used up its budget
+    are fetched from another mirror of the package (if there is one).
+    """
+
+    def __init__(self, cache, progress, item_retries=3, mirror_retries=6):
+        self.cache = cache
+        self.progress = progress
+        self.item_retries = item_retries
+        self.mirror_retries = mirror_retries
+        # the fetcher of the first round, it has all archives
+        self.fetcher = None
+        self._item_failures = {}
+        self._mirror_failures = {}
+        self._versions = None
+
+    def run(self):
+        """
+        download the archives, raises apt.cache.FetchCancelledException
+        if the user cancelled and apt.cache.FetchFailedException if
+        items could still not be downloaded after their retries
+        """
+        pm = apt_pkg.PackageManager(self.cache._depcache)
+        self.fetcher = apt_pkg.Acquire(self.progress)
+        try:
+            self.cache._fetch_archives(self.fetcher, pm)
+            return True
+        except apt.cache.FetchFailedException as e:
+            failed = self._failed(self.fetcher.items)
+            if not failed:
+                raise
+            # other errors (e.g. hash sum mismatch) are not retried here
+            if len(failed) != len([item for item in self.fetcher.items
+                                   if item.status != item.STAT_DONE]):
+                raise
+            logging.warning("fetch: %s of %s items failed: %s" % (
+                len(failed), len(self.fetcher.items), e))
+        while failed:
+            failed = self._retry(failed)
+        return True
+
+    def _failed(self, items):
+        """ the items that failed with an error that may go away """
+        status = [apt_pkg.AcquireItem.STAT_ERROR]
+        if hasattr(apt_pkg.AcquireItem, "STAT_TRANSIENT_NETWORK_ERROR"):
+            status.append(apt_pkg.AcquireItem.STAT_TRANSIENT_NETWORK_ERROR)
+        return [(item.desc_uri, item.destfile, item.error_text)
+                for item in items if item.status in status]
+
+    def _version(self, uri):
+        """ the package version the archive at uri belongs to """
+        if self._versions is None:
+            self._versions = {}
+            for pkg in self.cache.get_changes():
+                if pkg.marked_delete or pkg.candidate is None:
+                    continue
+                for version_uri in pkg.candidate.uris:
+                    self._versions[version_uri] = pkg.candidate
+        return self._versions.get(uri)
+
+    def _pick_uri(self, uri, uris):
+        """
+        the uri to retry an item from, uri unless its mirror used up its
+        budget and another one of uris did not
+        """
+        if self._mirror_failures.get(mirror_of(uri), 0) < self.mirror_retries:
+            return uri
+        for other in uris:
+            failures = self._mirror_failures.get(mirror_of(other), 0)
+            if failures < self.mirror_retries:
+                return other
+        return uri
+
+    def _retry(self, failed):
+        """
+        queue the failed (uri, destfile, error) items in a new fetcher
+        and run it, returns the items that failed again
+        """
+        fetcher = apt_pkg.Acquire(self.progress)
+        # the items are removed from the fetcher when they are freed
+        queued = []
+        for (uri, destfile, error) in failed:
+            failures = self._item_failures.get(destfile, 0) + 1
+            self._item_failures[destfile] = failures
+            mirror = mirror_of(uri)
+            self._mirror_failures[mirror] = (
+                self._mirror_failures.get(mirror, 0) + 1)
+            version = self._version(uri)
+            if (failures > self.item_retries or version is None or
+                    not version.sha256):
+                raise apt.cache.FetchFailedException(
+                    "Failed to fetch %s %s\n" % (uri, error))
+            new_uri = self._pick_uri(uri, version.uris)
+            logging.info("fetch: retry %s of '%s' from '%s' (%s)" % (
+                failures, os.path.basename(destfile), mirror_of(new_uri),
+                error))
+            queued.append(apt_pkg.AcquireFile(
+                fetcher, new_uri, "SHA256:%s" % version.sha256, version.size,
+                version.package.name, destfile=destfile))
+        res = fetcher.run()
+        if res == fetcher.RESULT_CANCELLED:
+            raise apt.cache.FetchCancelledException()
+        again = self._failed(fetcher.items)
+        for item in fetcher.items:
+            if (item.status != item.STAT_DONE and
+                    item.desc_uri not in [uri for (uri, d, e) in again]):
+                raise apt.cache.FetchFailedException(
+                    "Failed to fetch %s %s\n" % (item.desc_uri,
+                                                 item.error_text))
+        return again
@@ -0,0 +1,198 @@
+# DistUpgradeBundle.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import glob
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from .DistUpgradePackageCache import PackageStore, archive_name
+from .DistUpgradePrefetch import adopt_lists
+
+MANIFEST = "manifest.json"
+
+
+def trusted_keyrings():
+    """ the keyrings apt trusts (the binary ones gpgv can read) """
+    keyrings = ["/usr/share/keyrings/ubuntu-archive-keyring.gpg",
+                "/etc/apt/trusted.gpg"]
+    keyrings += sorted(glob.glob("/etc/apt/trusted.gpg.d/*.gpg"))
+    return [k for k in keyrings if os.path.exists(k)]
+
+
+def verify_release(path, keyrings=None):
+    """
+    check the signature of an InRelease file (or of a Release file
+    with its Release.gpg next to it) against the trusted keyrings
+    """
+    if keyrings is None:
+        keyrings = trusted_keyrings()
+    cmd = ["gpgv"]
+    for keyring in keyrings:
+        cmd += ["--keyring", keyring]
+    if path.endswith("InRelease"):
+        cmd.append(path)
+    else:
+        cmd += [path + ".gpg", path]
+    try:
+        res = subprocess.call(cmd, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    except OSError as e:
+        logging.error("running gpgv failed: %s" % e)
+        return False
+    return res == 0
+
+
+def check_release(path, prefix, now=None):
+    """
+    check that the (In)Release file path is for the distribution of the
+    list files starting with prefix and that it did not expire, returns
+    None if it is fine and the problem otherwise
+    """
+    fd = apt_pkg.open_maybe_clear_signed_file(path)
+    with os.fdopen(fd) as f:
+        tagfile = apt_pkg.TagFile(f)
+        if not tagfile.step():
+            return "no Release fields"
+        section = tagfile.section
+        fields = dict((key, section.get(key))
+                      for key in ("Codename", "Suite", "Valid-Until"))
+    if "_dists_" in prefix:
+        # like apt, "jammy/updates" also matches the Codename "jammy"
+        dist = prefix[prefix.rindex("_dists_") + len("_dists_"):-1]
+        names = [fields[key].replace("/", "_")
+                 for key in ("Codename", "Suite") if fields[key]]
+        if dist not in names and dist.split("_")[0] not in names:
+            return "it is for '%s', not for '%s'" % (
+                "/".join(names), dist)
+    if (fields["Valid-Until"] and
+            apt_pkg.config.find_b("Acquire::Check-Valid-Until", True)):
+        valid_until = apt_pkg.str_to_time(fields["Valid-Until"])
+        if not valid_until:
+            return "invalid Valid-Until '%s'" % fields["Valid-Until"]
+        if valid_until < (now or time.time()):
+            return "it expired on %s" % fields["Valid-Until"]
+    return None
+
+
+def export_bundle(bundledir, list_files, versions, archivedir, datadir,
+                  from_dist, to_dist):
+    """
+    write the upgrade to bundledir: the indexes (list_files), the .debs
+    of versions (from archivedir), the upgrader tarball and signature
+    (from datadir) and a manifest, returns the manifest
+    """
+    listdir = os.path.join(bundledir, "lists")
+    debdir = os.path.join(bundledir, "debs")
+    os.makedirs(listdir, exist_ok=True)
+    os.makedirs(debdir, exist_ok=True)
+    for path in sorted(set(list_files)):
+        shutil.copy2(path, listdir)
+    PackageStore(debdir).publish(versions, archivedir)
+    tarballs = []
+    for path in sorted(glob.glob(os.path.join(datadir, "*.tar.gz")) +
+                       glob.glob(os.path.join(datadir, "*.tar.gz.gpg"))):
+        shutil.copy(path, bundledir)
+        tarballs.append(os.path.basename(path))
+    manifest = {
+        "From": from_dist,
+        "To": to_dist,
+        "Architecture": apt_pkg.config.find("APT::Architecture"),
+        "Created": int(time.time()),
+        "Upgrader": tarballs,
+        "Lists": sorted(os.listdir(listdir)),
+        "Packages": [{"Package": v.package.shortname,
+                      "Version": v.version,
+                      "Architecture": v.architecture,
+                      "SHA256": v.sha256,
+                      "Size": v.size,
+                      "File": archive_name(v)} for v in versions],
+    }
+    with open(os.path.join(bundledir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    logging.info("wrote upgrade bundle with %s indexes and %s packages to "
+                 "'%s'" % (len(manifest["Lists"]), len(versions), bundledir))
+    return manifest
+
+
+def make_squashfs(bundledir, path):
+    """ pack bundledir into the squashfs image path """
+    subprocess.check_call(["mksquashfs", bundledir, path, "-noappend"],
+                          stdout=subprocess.DEVNULL)
+
+
+class Bundle():
+    """
+    An upgrade bundle written by export_bundle() (e.g. on a mounted
+    squashfs image)
+
+    The indexes are only used if the signature of their Release file
+    can be verified, it is for their distribution and did not expire
+    and their SHA256 sum matches it, the packages only if their SHA256
+    sum matches the (verified) index.
+
+    The indexes are named after the mirrors of the machine that wrote
+    the bundle, so they are only used for the entries of the
+    sources.list that use the same mirrors. apt downloads the indexes
+    of the other mirrors (the packages of the bundle are used anyway).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+    def adopt_lists(self, listdir, prefixes=None):
+        """
+        copy the verified indexes to listdir, with prefixes only the
+        ones whose file names start with one of them (the ones of the
+        sources.list)
+        """
+        unused = []
+
+        def verify(release, prefix):
+            if prefixes is not None and prefix not in prefixes:
+                unused.append(prefix)
+                return False
+            problem = check_release(release, prefix)
+            if problem is not None:
+                logging.warning("'%s' of the bundle is not valid: %s" % (
+                    os.path.basename(release), problem))
+                return False
+            return verify_release(release)
+        adopted = adopt_lists(os.path.join(self.path, "lists"), listdir,
+                              verify=verify)
+        if unused:
+            logging.warning("the sources.list does not use the mirrors of "
+                            "%s indexes of the bundle (it was written on a "
+                            "machine with other mirrors?), they are "
+                            "downloaded instead: %s" % (
+                                len(unused), ", ".join(unused)))
+        logging.info("adopted %s of indexes from the bundle '%s'" % (
+            apt_pkg.size_to_str(adopted), self.path))
+        return adopted
+
+    def package_store(self):
+        """ the PackageStore of the packages in the bundle """
+        return PackageStore(os.path.join(self.path, "debs"))
@@ -26,16 +26,21 @@ import locale
 import os
 import re
 import logging
+import sys
 import time
 import datetime
 import threading
 import configparser
+from contextlib import contextmanager
 from subprocess import Popen, PIPE
 
 from .DistUpgradeGettext import gettext as _
 from .DistUpgradeGettext import ngettext
 
 from .utils import inside_chroot
+from .DistUpgradeChanges import ChangeTracker, MarkSnapshot
+from .DistUpgradePackageIndex import PackageIndex
+from .DistUpgradeRemoval import group_by_closure
 
 class CacheException(Exception):
     pass
@@ -116,14 +121,21 @@ class MyCache(apt.Cache):
 
     # init
     def __init__(self, config, view, quirks, progress=None, lock=True):
-        self.to_install = []
-        self.to_remove = []
+        self._snapshot = None
+        # the ids of the packages marked for purge (apt can not tell)
+        self._purged = set()
         self.view = view
         self.quirks = quirks
         self.lock = False
         self.partialUpgrade = False
         self.config = config
         self.metapkgs = self.config.getlist("Distro", "MetaPkgs")
+        self._package_index = None
+        self._change_tracker = ChangeTracker(self)
+        # the saved stdout/stderr while the apt output goes to apt.log
+        self.old_stdout = None
+        self.old_stderr = None
+        self._resolverLogDepth = 0
         # acquire lock
         self._listsLock = -1
         if lock:
@@ -163,17 +175,28 @@ class MyCache(apt.Cache):
                 # upgrade() will take care of this
                 pkg.mark_install(auto_inst=False, auto_fix=False)
 
+    @property
+    def package_index(self):
+        " the PackageIndex of the cache, built again when it was reopened "
+        if (self._package_index is None or
+            self._package_index.cache is not self._cache):
+            self._package_index = PackageIndex(self._cache, self._depcache)
+        return self._package_index
+
+    def get_changes(self):
+        " the marked changes, from the change tracker "
+        return [self._rawpkg_to_pkg(pkg)
+                for pkg in self._change_tracker.changes()]
+
+    def cache_post_change(self):
+        # a mark the change tracker did not see
+        self._change_tracker.invalidate()
+        apt.Cache.cache_post_change(self)
+
     @property
     def req_reinstall_pkgs(self):
         " return the packages not downloadable packages in reqreinst state "
-        reqreinst = set()
-        for pkg in self:
-            if ((not pkg.candidate or not pkg.candidate.downloadable)
-                and
-                (pkg._pkg.inst_state == self.ReInstReq or
-                 pkg._pkg.inst_state == self.HoldReInstReq)):
-                reqreinst.add(pkg.name)
-        return reqreinst
+        return set(self.package_index.reqreinst)
 
     def fix_req_reinst(self, view):
         " check for reqreinst state and offer to fix it "
@@ -221,28 +244,61 @@ class MyCache(apt.Cache):
         apt_pkg.config.set("Debug::pkgDepCache::Marker", "true")
         apt_pkg.config.set("Debug::pkgDepCache::AutoInstall", "true")
     def _startAptResolverLog(self):
-        if hasattr(self, "old_stdout"):
-            os.close(self.old_stdout)
-            os.close(self.old_stderr)
+        if self.old_stdout is not None:
+            # already redirected
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
         self.old_stdout = os.dup(1)
         self.old_stderr = os.dup(2)
         os.dup2(self.logfd, 1)
         os.dup2(self.logfd, 2)
-    def _stopAptResolverLog(self):
-        os.fsync(1)
-        os.fsync(2)
+    def _stopAptResolverLog(self, sync=True):
+        if self.old_stdout is None:
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if sync:
+            # the only sync of the log, not one per call in the phase
+            os.fsync(self.logfd)
         os.dup2(self.old_stdout, 1)
         os.dup2(self.old_stderr, 2)
+        os.close(self.old_stdout)
+        os.close(self.old_stderr)
+        self.old_stdout = None
+        self.old_stderr = None
+    @contextmanager
+    def resolverLog(self):
+        """ send the apt output to apt.log for the whole block, nested
+            blocks (and withResolverLog calls) keep the same redirect """
+        if self._resolverLogDepth == 0:
+            self._startAptResolverLog()
+        self._resolverLogDepth += 1
+        try:
+            yield
+        finally:
+            self._resolverLogDepth -= 1
+            if self._resolverLogDepth == 0:
+                self._stopAptResolverLog()
+    @contextmanager
+    def _outsideResolverLog(self):
+        " the output of the block (e.g. a progress) goes to the terminal "
+        redirected = self.old_stdout is not None
+        if redirected:
+            self._stopAptResolverLog(sync=False)
+        try:
+            yield
+        finally:
+            if redirected:
+                self._startAptResolverLog()
     # use this decorator instead of the _start/_stop stuff directly
     # FIXME: this should probably be a decorator class where all
     #        logging is moved into?
     def withResolverLog(f):
         " decorator to ensure that the apt output is logged "
         def wrapper(*args, **kwargs):
-            args[0]._startAptResolverLog()
-            res = f(*args, **kwargs)
-            args[0]._stopAptResolverLog()
-            return res
+            with args[0].resolverLog():
+                return f(*args, **kwargs)
         return wrapper
 
     # properties
@@ -287,13 +343,14 @@ class MyCache(apt.Cache):
         if self._listsLock > 0:
             os.close(self._listsLock)
             self._listsLock = -1
-    def update(self, fprogress=None):
+    def update(self, fprogress=None, sources_list=None):
         """
         our own update implementation is required because we keep the lists
-        dir lock
+        dir lock, with sources_list only the entries of that file are
+        updated
         """
         self.unlock_lists_dir()
-        res = apt.Cache.update(self, fprogress)
+        res = apt.Cache.update(self, fprogress, sources_list=sources_list)
         self.lock_lists_dir()
         if fprogress and fprogress.release_file_download_error:
             # FIXME: not ideal error message, but we just reuse a
@@ -343,34 +400,29 @@ class MyCache(apt.Cache):
     def fix_broken(self):
         """ try to fix broken dependencies on the system, may throw
             SystemError when it can't"""
+        self._change_tracker.invalidate()
         return self._depcache.fix_broken()
 
     def create_snapshot(self):
         """ create a snapshot of the current changes """
-        self.to_install = []
-        self.to_remove = []
-        for pkg in self.get_changes():
-            if pkg.marked_install or pkg.marked_upgrade:
-                self.to_install.append(pkg.name)
-            if pkg.marked_delete:
-                self.to_remove.append(pkg.name)
+        self._snapshot = MarkSnapshot(self._change_tracker, self._purged)
+        return self._snapshot
 
     def clear(self):
         self._depcache.init()
+        self._change_tracker.cleared()
+        self._purged = set()
 
-    def restore_snapshot(self):
-        """ restore a snapshot """
-        actiongroup = apt_pkg.ActionGroup(self._depcache)
-        # just make pyflakes shut up, later we need to use
-        # with self.actiongroup():
-        actiongroup
-        self.clear()
-        for name in self.to_remove:
-            pkg = self[name]
-            pkg.mark_delete()
-        for name in self.to_install:
-            pkg = self[name]
-            pkg.mark_install(auto_fix=False, auto_inst=False)
+    def restore_snapshot(self, snapshot=None):
+        """
+        restore a snapshot (the last one by default), returns False if
+        that did not work
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        res = snapshot.restore(self._change_tracker, self._purged)
+        self._purged = set(snapshot.purged)
+        return res
 
     def need_server_mode(self):
         """
@@ -447,7 +499,10 @@ class MyCache(apt.Cache):
     def mark_purge(self, pkg, reason=""):
         logging.debug("Purging '%s' (%s)" % (pkg, reason))
         if pkg in self:
-            self._depcache.mark_delete(self[pkg]._pkg, True)
+            with self._change_tracker.marking(self[pkg]._pkg, delete=True,
+                                              deps=False):
+                self._depcache.mark_delete(self[pkg]._pkg, True)
+            self._purged.add(self[pkg]._pkg.id)
 
     def _keep_installed(self, pkgname, reason):
         if (pkgname in self
@@ -474,20 +529,20 @@ class MyCache(apt.Cache):
             logging.debug("Running KeepInstalledSection rules")
             # now the KeepInstalledSection code
             for section in self.config.getlist("Distro", "KeepInstalledSection"):
-                for pkg in self:
-                    if (pkg.candidate and pkg.candidate.downloadable
-                        and pkg.marked_delete
-                        and pkg.candidate.section == section):
-                        self._keep_installed(pkg.name, "Distro KeepInstalledSection rule: %s" % section)
+                for name in self._markedDeleteInSection(section):
+                    self._keep_installed(name, "Distro KeepInstalledSection rule: %s" % section)
             for key in self.metapkgs:
                 if key in self and (self[key].is_installed or
                                     self[key].marked_install):
                     for section in self.config.getlist(key, "KeepInstalledSection"):
-                        for pkg in self:
-                            if (pkg.candidate and pkg.candidate.downloadable
-                                and pkg.marked_delete and
-                                pkg.candidate.section == section):
-                                self._keep_installed(pkg.name, "%s KeepInstalledSection rule: %s" % (key, section))
+                        for name in self._markedDeleteInSection(section):
+                            self._keep_installed(name, "%s KeepInstalledSection rule: %s" % (key, section))
+
+    def _markedDeleteInSection(self, section):
+        " the packages marked for removal whose candidate is in section "
+        names = self.package_index.section.get(section, ())
+        return [name for name in sorted(names)
+                if self._depcache.marked_delete(self._cache[name])]
 
 
     def pre_upgrade_rule(self):
@@ -557,11 +612,7 @@ class MyCache(apt.Cache):
 
 
     def _has_kernel_headers_installed(self):
-        for pkg in self:
-            if (pkg.name.startswith("linux-headers-") and
-                pkg.is_installed):
-                return True
-        return False
+        return len(self.package_index.headers_installed) > 0
 
     def checkForKernel(self):
         """ check for the running kernel and try to ensure that we have
@@ -585,19 +636,20 @@ class MyCache(apt.Cache):
         # stuff that its ok not to have
         removeEssentialOk = self.config.getlist("Distro", "RemoveEssentialOk")
         # check now
-        for pkg in self:
-            # WORKAROUND bug on the CD/python-apt #253255
-            ver = pkg._pcache._depcache.get_candidate_ver(pkg._pkg)
-            if ver and ver.priority == 0:
-                logging.error("Package %s has no priority set" % pkg.name)
-                continue
-            if (pkg.candidate and pkg.candidate.downloadable and
-                not (pkg.is_installed or pkg.marked_install) and
-                not pkg.name in removeEssentialOk and
-                # ignore multiarch priority required packages
-                not ":" in pkg.name and
-                pkg.candidate.priority in need):
-                self.mark_install(pkg.name, "priority in required set '%s' but not scheduled for install" % need)
+        index = self.package_index
+        # WORKAROUND bug on the CD/python-apt #253255
+        for name in sorted(index.no_priority):
+            logging.error("Package %s has no priority set" % name)
+        for priority in need:
+            for name in sorted(index.priority.get(priority, ())):
+                if (name in index.installed or
+                    name in index.no_priority or
+                    name in removeEssentialOk or
+                    # ignore multiarch priority required packages
+                    ":" in name or
+                    self._depcache.marked_install(self._cache[name])):
+                    continue
+                self.mark_install(name, "priority in required set '%s' but not scheduled for install" % need)
 
     # FIXME: make this a decorator (just like the withResolverLog())
     def updateGUI(self, view, lock):
@@ -939,9 +991,10 @@ class MyCache(apt.Cache):
                 return True
         return False
 
-    @withResolverLog
-    def tryMarkObsoleteForRemoval(self, pkgname, remove_candidates, forced_obsoletes, foreign_pkgs):
-        #logging.debug("tryMarkObsoleteForRemoval(): %s" % pkgname)
+    def _obsoleteRemovalAllowed(self, pkgname):
+        """ the checks of tryMarkObsoleteForRemoval() that do not depend on
+            the marks: False if pkgname must be kept, True if it is not in
+            the cache anyway and None if it needs to be marked """
         # coherence check, first see if it looks like a running kernel pkg
         if pkgname.endswith(self.uname):
             logging.debug("skipping running kernel pkg '%s'" % pkgname)
@@ -963,11 +1016,36 @@ class MyCache(apt.Cache):
         if pkgname not in self:
             #logging.debug("package '%s' not in cache" % pkgname)
             return True
-        # check if we want to purge
+        return None
+
+    def _purgeObsoletes(self):
+        " check if we want to purge "
         try:
-            purge = self.config.getboolean("Distro", "PurgeObsoletes")
+            return self.config.getboolean("Distro", "PurgeObsoletes")
         except configparser.NoOptionError:
-            purge = False
+            return False
+
+    def _unwantedRemoval(self, remove_candidates, foreign_pkgs):
+        " the first change an obsolete removal must not produce (or None) "
+        for pkg in self.get_changes():
+            if (pkg.name not in remove_candidates or
+                  pkg.name in foreign_pkgs or
+                  self._inRemovalDenylist(pkg.name) or
+                  pkg.name == self.linux_metapackage):
+                return pkg.name
+        return None
+
+    @withResolverLog
+    def tryMarkObsoleteForRemoval(self, pkgname, remove_candidates, forced_obsoletes, foreign_pkgs):
+        return self._tryMarkObsoleteForRemoval(pkgname, remove_candidates,
+                                               forced_obsoletes, foreign_pkgs)
+
+    def _tryMarkObsoleteForRemoval(self, pkgname, remove_candidates, forced_obsoletes, foreign_pkgs):
+        #logging.debug("tryMarkObsoleteForRemoval(): %s" % pkgname)
+        allowed = self._obsoleteRemovalAllowed(pkgname)
+        if allowed is not None:
+            return allowed
+        purge = self._purgeObsoletes()
 
         # if this package has not been forced obsolete, only
         # delete it if it doesn't remove other dependents
@@ -976,39 +1054,127 @@ class MyCache(apt.Cache):
         # just make pyflakes shut up, later we should use
         # with self.actiongroup():
         actiongroup
-        self.create_snapshot()
+        snapshot = self.create_snapshot()
         try:
-            self[pkgname].mark_delete(purge=purge)
+            with self._change_tracker.marking(self[pkgname]._pkg,
+                                              delete=True):
+                self[pkgname].mark_delete(purge=purge)
+            if purge:
+                self._purged.add(self[pkgname]._pkg.id)
             self.view.processEvents()
             if pkgname in forced_obsoletes:
                 return True
             #logging.debug("marking '%s' for removal" % pkgname)
-            for pkg in self.get_changes():
-                if (pkg.name not in remove_candidates or
-                      pkg.name in foreign_pkgs or
-                      self._inRemovalDenylist(pkg.name) or
-                      pkg.name == self.linux_metapackage):
-                    logging.debug("package '%s' produces an unwanted removal '%s', skipping" % (pkgname, pkg.name))
-                    self.restore_snapshot()
-                    return False
+            unwanted = self._unwantedRemoval(remove_candidates, foreign_pkgs)
+            if unwanted is not None:
+                logging.debug("package '%s' produces an unwanted removal '%s', skipping" % (pkgname, unwanted))
+                self.restore_snapshot(snapshot)
+                return False
         except (SystemError, KeyError) as e:
             logging.warning("_tryMarkObsoleteForRemoval failed for '%s' (%s: %s)" % (pkgname, repr(e), e))
-            self.restore_snapshot()
+            self.restore_snapshot(snapshot)
             return False
         return True
 
+    def _markObsoleteGroup(self, group, remove_candidates, foreign_pkgs):
+        """ mark the packages of group for removal in one pass, returns
+            False (with the marks restored) if that is not the same as
+            tryMarkObsoleteForRemoval() accepting each of them """
+        purge = self._purgeObsoletes()
+        actiongroup = apt_pkg.ActionGroup(self._depcache)
+        # just make pyflakes shut up, later we should use
+        # with self.actiongroup():
+        actiongroup
+        snapshot = self.create_snapshot()
+        marked = set(pkg.id for pkg in snapshot.packages)
+        try:
+            for pkgname in group:
+                with self._change_tracker.marking(self[pkgname]._pkg,
+                                                  delete=True):
+                    self[pkgname].mark_delete(purge=purge)
+                if purge:
+                    self._purged.add(self[pkgname]._pkg.id)
+                self.view.processEvents()
+                changes = set(pkg.id for pkg in self._change_tracker.changes())
+                if not marked <= changes:
+                    # a removal was undone again, the changes of the steps
+                    # before can not be checked at the end
+                    logging.debug("marking '%s' for removal undoes other changes" % pkgname)
+                    break
+                marked = changes
+            else:
+                unwanted = self._unwantedRemoval(remove_candidates, foreign_pkgs)
+                if unwanted is None:
+                    return True
+                logging.debug("the obsoletes '%s' produce an unwanted removal '%s', checking them one by one" % (" ".join(group), unwanted))
+        except (SystemError, KeyError) as e:
+            logging.debug("marking the obsoletes '%s' failed (%s)" % (" ".join(group), e))
+        self.restore_snapshot(snapshot)
+        return False
+
+    @withResolverLog
+    def markObsoletesForRemoval(self, pkgnames, remove_candidates, forced_obsoletes, foreign_pkgs, progress=None):
+        """ mark the obsolete packages pkgnames for removal with the same
+            result as tryMarkObsoleteForRemoval() for each of them (in
+            this order), returns the ones that were not marked
+
+            The packages are marked in groups that do not share reverse
+            dependencies (see group_by_closure()) and only checked one by
+            one when marking the whole group is not safe.
+        """
+        skipped = []
+        todo = []
+        for pkgname in pkgnames:
+            allowed = self._obsoleteRemovalAllowed(pkgname)
+            if allowed is None:
+                todo.append(pkgname)
+            elif not allowed:
+                skipped.append(pkgname)
+        initial = self.create_snapshot()
+        groups = group_by_closure(self._cache, todo)
+        logging.debug("checking %s obsoletes in %s groups" % (len(todo), len(groups)))
+        # with an unwanted removal in the changes the result depends on
+        # the order of the obsoletes
+        ordered = self._unwantedRemoval(remove_candidates, foreign_pkgs) is not None
+        rejected = []
+        done = 0
+        for group in groups:
+            if ordered:
+                break
+            if not self._markObsoleteGroup(group, remove_candidates, foreign_pkgs):
+                rejected += [pkgname for pkgname in group
+                             if not self._tryMarkObsoleteForRemoval(
+                                 pkgname, remove_candidates,
+                                 forced_obsoletes, foreign_pkgs)]
+                if self._unwantedRemoval(remove_candidates, foreign_pkgs) is not None:
+                    # a forced obsolete took other packages with it
+                    logging.debug("forced obsolete removal produced an unwanted removal, checking all obsoletes one by one")
+                    self.restore_snapshot(initial)
+                    ordered = True
+            done += len(group)
+            if progress is not None:
+                with self._outsideResolverLog():
+                    progress.update(done * 100.0 / len(todo))
+        if not ordered:
+            return skipped + rejected
+        rejected = []
+        for (i, pkgname) in enumerate(todo):
+            if progress is not None:
+                with self._outsideResolverLog():
+                    progress.update(i * 100.0 / len(todo))
+            self.view.processEvents()
+            if not self._tryMarkObsoleteForRemoval(pkgname, remove_candidates,
+                                                   forced_obsoletes,
+                                                   foreign_pkgs):
+                rejected.append(pkgname)
+        return skipped + rejected
+
     def _getObsoletesPkgs(self):
         " get all package names that are not downloadable "
-        obsolete_pkgs = set()
-        for pkg in self:
-            if pkg.is_installed:
-                # check if any version is downloadable. we need to check
-                # for older ones too, because there might be
-                # cases where e.g. firefox in gutsy-updates is newer
-                # than hardy
-                if not self.anyVersionDownloadable(pkg):
-                    obsolete_pkgs.add(pkg.name)
-        return obsolete_pkgs
+        # no version is downloadable. we need to check for older ones
+        # too, because there might be cases where e.g. firefox in
+        # gutsy-updates is newer than hardy
+        return set(self.package_index.obsolete)
 
     def anyVersionDownloadable(self, pkg):
         " helper that checks if any of the version of pkg is downloadable "
@@ -1019,11 +1185,7 @@ class MyCache(apt.Cache):
 
     def _getUnusedDependencies(self):
         " get all package names that are not downloadable "
-        unused_dependencies = set()
-        for pkg in self:
-            if pkg.is_installed and self._depcache.is_garbage(pkg._pkg):
-                unused_dependencies.add(pkg.name)
-        return unused_dependencies
+        return self.package_index.garbage(self._depcache)
 
     def get_installed_demoted_packages(self):
         """ return list of installed and demoted packages
@@ -1053,25 +1215,8 @@ class MyCache(apt.Cache):
         """ get all packages that are installed from a foreign repo
             (and are actually downloadable)
         """
-        foreign_pkgs = set()
-        for pkg in self:
-            if pkg.is_installed and self.downloadable(pkg):
-                if not pkg.candidate:
-                    continue
-                # assume it is foreign and see if it is from the
-                # official archive
-                foreign = True
-                for origin in pkg.candidate.origins:
-                    # FIXME: use some better metric here
-                    if fromDist in origin.archive and \
-                           origin.origin == allowed_origin:
-                        foreign = False
-                    if toDist in origin.archive and \
-                           origin.origin == allowed_origin:
-                        foreign = False
-                if foreign:
-                    foreign_pkgs.add(pkg.name)
-        return foreign_pkgs
+        # FIXME: use some better metric here
+        return self.package_index.foreign(allowed_origin, fromDist, toDist)
 
     def checkFreeSpace(self, snapshots_in_use=False):
         """
@@ -1150,15 +1295,16 @@ class MyCache(apt.Cache):
         # we do this by checking how many linux-image-$ver packages
         # are installed or going to be installed
         kernel_count = 0
-        for pkg in self:
-            # we match against everything that looks like a kernel
-            # and add space check to filter out metapackages
-            if re.match("^linux-(image|image-debug)-[0-9.]*-.*", pkg.name):
-                # upgrade because early in the release cycle the major version
-                # may be the same or they might be -lts- kernels
-                if pkg.marked_install or pkg.marked_upgrade:
-                    logging.debug("%s (new-install) added with %s to boot space" % (pkg.name, KERNEL_SIZE))
-                    kernel_count += 1
+        # we match against everything that looks like a kernel
+        # and add space check to filter out metapackages
+        for name in sorted(self.package_index.kernels):
+            # upgrade because early in the release cycle the major version
+            # may be the same or they might be -lts- kernels
+            pkg = self._cache[name]
+            if (self._depcache.marked_install(pkg) or
+                self._depcache.marked_upgrade(pkg)):
+                logging.debug("%s (new-install) added with %s to boot space" % (name, KERNEL_SIZE))
+                kernel_count += 1
         # space calculated per LP: #1646222
         space_in_boot = (kernel_count * KERNEL_SIZE
                          + (kernel_count + 1) * INITRD_SIZE)
@@ -1169,23 +1315,23 @@ class MyCache(apt.Cache):
         #      but as good as we can do currently + safety buffer
         # /     has a small safety buffer as well
         required_for_aufs = 0.0
-        if (hasattr(self, "config") and
-            self.config.getWithDefault("Aufs", "Enabled", False)):
+        required_for_snapshots = 0.0
+        aufs = (hasattr(self, "config") and
+                self.config.getWithDefault("Aufs", "Enabled", False))
+        if aufs:
             logging.debug("taking aufs overlay into space calculation")
             aufs_rw_dir = self.config.get("Aufs", "RWDir")
-            # if we use the aufs rw overlay all the space is consumed
-            # the overlay dir
-            for pkg in self:
-                if pkg.marked_upgrade or pkg.marked_install:
+        if aufs or snapshots_in_use:
+            for pkg in self.get_changes():
+                # if we use the aufs rw overlay all the space is consumed
+                # the overlay dir
+                if aufs and (pkg.marked_upgrade or pkg.marked_install):
                     required_for_aufs += pkg.candidate.installed_size
-
-        # add old size of the package if we use snapshots
-        required_for_snapshots = 0.0
-        if snapshots_in_use:
-            for pkg in self:
-                if (pkg.is_installed and
+                # add old size of the package if we use snapshots
+                if (snapshots_in_use and pkg.is_installed and
                     (pkg.marked_upgrade or pkg.marked_delete)):
                     required_for_snapshots += pkg.installed.installed_size
+        if snapshots_in_use:
             logging.debug("additional space for the snapshots: %s" % required_for_snapshots)
 
         # sum up space requirements
@@ -1235,7 +1381,6 @@ class MyCache(apt.Cache):
 
 
 if __name__ == "__main__":
-    import sys
     from .DistUpgradeConfigParser import DistUpgradeConfig
     from .DistUpgradeView import DistUpgradeView
     print("foo")
@@ -0,0 +1,272 @@
+# DistUpgradeChanges.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import logging
+
+from contextlib import contextmanager
+
+# the dependencies an install pulls in or removes
+INSTALL_DEPS = ("PreDepends", "Depends", "Recommends", "Conflicts",
+                "Breaks")
+
+# the marks of a MarkSnapshot, AUTO is added to INSTALL for automatically
+# installed packages
+KEEP = 0
+INSTALL = 1
+DELETE = 2
+PURGE = 3
+AUTO = 4
+
+
+class ChangeTracker():
+    """
+    Keep the packages with changes (not marked keep) of a cache between
+    marks instead of scanning the whole cache for every get_changes()
+
+    Marks done inside marking() only make the tracker look at the
+    previous changes and the packages the mark can reach (the reverse
+    dependencies of a removal, the dependencies of an install). The
+    result is checked against the install and delete counters of the
+    depcache, if they do not match (or the mark reaches more than limit
+    packages) the cache is scanned. Any other change of the cache must
+    call invalidate().
+    """
+
+    def __init__(self, cache, limit=5000):
+        self._pcache = cache
+        self.limit = limit
+        self._depcache = None
+        self._changes = None
+        self._touched = []
+        self._marking = 0
+        # statistics for the log
+        self.scans = 0
+        self.updates = 0
+
+    def invalidate(self):
+        """ the cache changed in an unknown way """
+        if self._marking:
+            return
+        self._changes = None
+        self._touched = []
+
+    def cleared(self, packages=()):
+        """ all marks were reset (except the ones of packages) """
+        self._depcache = self._pcache._depcache
+        self._changes = dict((pkg.id, pkg) for pkg in packages)
+        self._touched = []
+
+    @contextmanager
+    def marking(self, pkg, delete=False, deps=True):
+        """
+        the marks in this block start at the apt_pkg.Package pkg (a
+        removal if delete is True), with deps False they only change pkg
+        (no auto_inst or auto_fix)
+        """
+        self._marking += 1
+        try:
+            yield
+        finally:
+            self._marking -= 1
+            if self._changes is not None:
+                self._touched.append((pkg, delete, deps))
+
+    def _related(self, pkg, delete):
+        """ the packages a mark of pkg may change directly """
+        cache = self._pcache._cache
+        related = []
+        if delete:
+            related += [dep.parent_pkg for dep in pkg.rev_depends_list]
+            ver = pkg.current_ver
+            if ver is not None:
+                for (name, provver, provides) in ver.provides_list:
+                    try:
+                        virtual = cache[name]
+                    except KeyError:
+                        continue
+                    related += [dep.parent_pkg
+                                for dep in virtual.rev_depends_list]
+            return related
+        ver = self._pcache._depcache.get_candidate_ver(pkg)
+        if ver is None:
+            return related
+        for deptype in INSTALL_DEPS:
+            for group in ver.depends_list.get(deptype, []):
+                for dep in group:
+                    related.append(dep.target_pkg)
+                    related += [target.parent_pkg
+                                for target in dep.all_targets()]
+        return related
+
+    def _candidates(self):
+        """
+        the packages that may have changed since the last changes(), None
+        if there are more than limit
+        """
+        seen = dict(self._changes)
+        todo = []
+        for (pkg, delete, deps) in self._touched:
+            seen[pkg.id] = pkg
+            if deps:
+                todo.append((pkg, delete))
+        while todo:
+            (pkg, delete) = todo.pop()
+            for other in self._related(pkg, delete):
+                if other.id in seen:
+                    continue
+                seen[other.id] = other
+                if len(seen) > self.limit:
+                    return None
+                todo.append((other, delete))
+        return seen
+
+    def _counts_match(self, changes):
+        """ check changes against the counters of the depcache """
+        depcache = self._pcache._depcache
+        # everything that is not kept is either deleted or installed
+        deletes = sum(1 for pkg in changes.values()
+                      if depcache.marked_delete(pkg))
+        return (deletes == depcache.del_count and
+                len(changes) - deletes == depcache.inst_count)
+
+    def _scan(self):
+        self.scans += 1
+        marked_keep = self._pcache._depcache.marked_keep
+        return dict((pkg.id, pkg) for pkg in self._pcache._cache.packages
+                    if not marked_keep(pkg))
+
+    def changes(self):
+        """
+        the apt_pkg.Package objects that are not marked keep, in the order
+        of their id
+        """
+        depcache = self._pcache._depcache
+        if depcache is not self._depcache:
+            # the cache was opened again
+            self._depcache = depcache
+            self._changes = None
+        if self._changes is not None and self._touched:
+            candidates = self._candidates()
+            self._touched = []
+            if candidates is None:
+                self._changes = None
+            else:
+                self.updates += 1
+                marked_keep = depcache.marked_keep
+                self._changes = dict(
+                    (pkg_id, pkg) for (pkg_id, pkg) in candidates.items()
+                    if not marked_keep(pkg))
+        if self._changes is not None and not self._counts_match(
+                self._changes):
+            logging.debug("change tracker: counters do not match, "
+                          "scanning the cache")
+            self._changes = None
+        if self._changes is None:
+            self._changes = self._scan()
+            self._touched = []
+        return [self._changes[pkg_id] for pkg_id in sorted(self._changes)]
+
+
+def _mark(depcache, pkg, purged):
+    """ the mark of the changed apt_pkg.Package pkg """
+    if depcache.marked_delete(pkg):
+        return PURGE if pkg.id in purged else DELETE
+    if depcache.is_auto_installed(pkg):
+        return INSTALL | AUTO
+    return INSTALL
+
+
+class MarkSnapshot():
+    """
+    The marks of a depcache as one byte per package id (see KEEP,
+    INSTALL, DELETE, PURGE and AUTO)
+
+    apt can not tell if a removal is a purge, purged is the set of the
+    ids of the packages that were marked for purge. Taking a snapshot
+    only looks at the changes of the ChangeTracker and restoring it only
+    marks the packages whose mark is different now, so snapshots can be
+    nested cheaply.
+    """
+
+    def __init__(self, tracker, purged=()):
+        self.depcache = tracker._pcache._depcache
+        self.marks = bytearray(tracker._pcache._cache.package_count)
+        # the packages that are not marked keep
+        self.packages = tracker.changes()
+        for pkg in self.packages:
+            self.marks[pkg.id] = _mark(self.depcache, pkg, purged)
+        self.purged = set(pkg.id for pkg in self.packages
+                          if self.marks[pkg.id] == PURGE)
+        self._counts = self._counters()
+
+    def __getitem__(self, pkg):
+        return self.marks[pkg.id]
+
+    def _counters(self):
+        return (self.depcache.inst_count, self.depcache.del_count,
+                self.depcache.broken_count)
+
+    def _apply(self, pkg):
+        mark = self.marks[pkg.id]
+        if mark in (DELETE, PURGE):
+            self.depcache.mark_delete(pkg, mark == PURGE)
+        elif mark & INSTALL:
+            self.depcache.mark_install(pkg, False, not mark & AUTO)
+            self.depcache.mark_auto(pkg, bool(mark & AUTO))
+        else:
+            self.depcache.mark_keep(pkg)
+
+    def _matches(self, purged):
+        if self._counters() != self._counts:
+            return False
+        return all(not self.depcache.marked_keep(pkg) and
+                   _mark(self.depcache, pkg, purged) == self.marks[pkg.id]
+                   for pkg in self.packages)
+
+    def restore(self, tracker, purged=()):
+        """
+        mark the packages like they were when the snapshot was taken,
+        purged are the ids of the packages that are marked for purge now,
+        returns False if that did not work
+        """
+        if tracker._pcache._depcache is not self.depcache:
+            raise ValueError("the snapshot is from another cache")
+        with apt_pkg.ActionGroup(self.depcache):
+            for pkg in tracker.changes():
+                if not self.marks[pkg.id]:
+                    self.depcache.mark_keep(pkg)
+            for pkg in self.packages:
+                if (self.depcache.marked_keep(pkg) or
+                        _mark(self.depcache, pkg, purged) !=
+                        self.marks[pkg.id]):
+                    self._apply(pkg)
+            if not self._matches(self.purged):
+                logging.debug("restoring the changed marks did not work, "
+                              "restoring all of them")
+                self.depcache.init()
+                for pkg in self.packages:
+                    self._apply(pkg)
+        if not self._matches(self.purged):
+            logging.error("restoring the marks of the snapshot failed")
+            tracker.invalidate()
+            return False
+        tracker.cleared(self.packages)
+        return True
@@ -31,11 +31,18 @@ import locale
 import logging
 import shutil
 import glob
+import tempfile
 import time
 import copy
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 from configparser import NoOptionError
 from configparser import ConfigParser as SafeConfigParser
 from .telemetry import get as get_telemetry
+from .DistUpgradeProbe import get as get_probe_cache
+from .DistUpgradeProbe import benchmark_mirrors
+from .DistUpgradeProbe import measure_throughput
+from .DistUpgradeProbe import get_client as get_probe_client
 from .utils import (country_mirror,
                     url_downloadable,
                     check_and_fix_xbit,
@@ -52,6 +59,14 @@ from .DistUpgradeView import Step
 from .DistUpgradeCache import MyCache
 from .DistUpgradeConfigParser import DistUpgradeConfig
 from .DistUpgradeQuirks import DistUpgradeQuirks
+from .DistUpgradeMirrors import MirrorIndex
+from .DistUpgradeSources import get as get_sources_model
+from .DistUpgradePrefetch import IndexPrefetcher
+from .DistUpgradeArchives import FetchEngine, verify_archives
+from .DistUpgradeNetwork import apply_network_config, count_hosts
+from .DistUpgradePackageCache import ArchiveStore, PackageStore, archive_name
+from .DistUpgradeBundle import Bundle, export_bundle, make_squashfs
+from .DistUpgradePipeline import PipelinedFetcher, install_deps, order_batches
 
 # workaround broken relative import in python-apt (LP: #871007), we
 # want the local version of distinfo.py from oneiric, but because of
@@ -61,7 +76,6 @@ from aptsources import distinfo
 from aptsources import sourceslist
 sourceslist.DistInfo = distinfo.DistInfo
 
-from aptsources.sourceslist import SourcesList, is_mirror
 from .distro import get_distro, NoDistroTemplateException
 
 from .DistUpgradeGettext import gettext as _
@@ -119,6 +133,13 @@ class DistUpgradeController(object):
         else:
             self.useNetwork = self.options.withNetwork
 
+        # an upgrade bundle replaces the network
+        self._bundle = None
+        bundle = getattr(self.options, "bundle", None)
+        if isinstance(bundle, str) and bundle:
+            self._bundle = Bundle(bundle)
+            self.useNetwork = False
+
         # the configuration
         self.config = DistUpgradeConfig(datadir)
         self.sources_backup_ext = "."+self.config.get("Files","BackupExt")
@@ -184,6 +205,33 @@ class DistUpgradeController(object):
         if self.config.has_section('ThirdPartyMirrors'):
             self.valid_3p_mirrors = [pair[1] for pair in
                                      self.config.items('ThirdPartyMirrors')]
+        # how long results of the Release file checks are cached
+        get_probe_cache().set_ttls(
+            self.config.getWithDefault("Network", "ProbeCacheTTL",
+                                       6 * 60 * 60),
+            self.config.getWithDefault("Network", "ProbeCacheNegativeTTL",
+                                       30 * 60))
+        # parallel Release file checks that may go to a single mirror
+        get_probe_client().set_max_per_host(
+            self.config.getWithDefault("Network", "MaxProbesPerHost", 4))
+        # indexes to look up mirrors without looping over the lists
+        self._mirror_index = MirrorIndex(self.valid_mirrors,
+                                         match_suffix=True)
+        self._3p_mirror_index = MirrorIndex(self.valid_3p_mirrors)
+        get_sources_model().forget("mirror")
+        get_sources_model().forget("3p-mirror")
+        # the index targets of the last successful update
+        self._updated_targets = None
+        # indexes of the new release fetched in the background
+        self._prefetcher = None
+        # the StartUpgrade quirks ran for a batch of a pipelined upgrade
+        self._upgradeStarted = False
+        # the archives downloaded by the pipelined upgrade
+        self._pipelinedArchives = []
+        # the archives that passed _verifyArchives()
+        self._verifiedArchives = set()
+        # the download started while the user is asked to confirm
+        self._speculativeFetcher = None
         # debugging
         #apt_pkg.config.set("DPkg::Options::","--debug=0077")
 
@@ -468,7 +516,122 @@ class DistUpgradeController(object):
             return True
         # check if the entry points to something we can download
         uri = "%s/dists/%s/Release" % (entry.uri, entry.dist)
-        return url_downloadable(uri, logging.debug)
+        # only successful checks are kept, failures are checked again
+        return bool(get_sources_model().derived(
+            "downloadable", uri,
+            lambda uri: get_probe_cache().url_downloadable(
+                uri, logging.debug, url_downloadable) or None))
+
+    def _collectProbeTargets(self, fromDists, mirror_check, old_releases_uris,
+                             probe_third_party=False):
+        """
+        collect the (entry, uri, dist) tuples that rewriteSourcesList()
+        will need to check for a Release file, every uri/dist is only
+        listed once
+        """
+        targets = []
+        seen = set()
+        for entry in self.sources.list:
+            if (entry.invalid or entry.disabled or
+                entry.uri.startswith("cdrom:")):
+                continue
+            dist = self.toDist
+            if "old-releases.ubuntu.com/" in entry.uri:
+                uris = old_releases_uris
+            elif (entry.dist in fromDists and
+                  (not mirror_check or probe_third_party or
+                   self.isMirror(entry.uri) or
+                   self.isThirdPartyMirror(entry.uri))):
+                uris = [entry.uri]
+            elif (probe_third_party and not entry.dist.endswith("/") and
+                  not self.isMirror(entry.uri) and
+                  not self.isThirdPartyMirror(entry.uri)):
+                # third-party repositories that are not release specific
+                uris = [entry.uri]
+                dist = entry.dist
+            else:
+                continue
+            for uri in uris:
+                if (uri, dist) in seen:
+                    continue
+                seen.add((uri, dist))
+                targets.append((entry, uri, dist))
+        return targets
+
+    def _probeSourcesListEntries(self, targets):
+        """
+        check the given (entry, uri, dist) tuples for a Release file
+        concurrently and return a dict that maps (uri, dist) to the
+        result of _sourcesListEntryDownloadable()
+        """
+        results = {}
+        if not targets or not self.useNetwork:
+            return results
+        workers = self.config.getWithDefault("Network", "ProbeWorkers", 8)
+        workers = max(1, min(workers, len(targets)))
+
+        def probe(target):
+            (entry, uri, dist) = target
+            test_entry = copy.copy(entry)
+            test_entry.uri = uri
+            test_entry.dist = dist
+            return self._sourcesListEntryDownloadable(test_entry)
+
+        logging.debug("probing %s sources.list uris with %s workers" % (
+            len(targets), workers))
+        start = time.time()
+        if workers == 1:
+            downloadable = [probe(target) for target in targets]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                downloadable = list(executor.map(probe, targets))
+        for ((entry, uri, dist), res) in zip(targets, downloadable):
+            results[(uri, dist)] = res
+        logging.debug("probing sources.list uris took %.2fs" % (
+            time.time() - start))
+        get_probe_cache().save()
+        return results
+
+    def _probedEntryDownloadable(self, probe_results, entry, uri, dist=None):
+        """
+        return the probe result for uri with dist (the new dist by
+        default), checks entries that were not probed upfront (e.g.
+        because the uri got rewritten) on demand
+        """
+        if dist is None:
+            dist = self.toDist
+        key = (uri, dist)
+        if key not in probe_results:
+            test_entry = copy.copy(entry)
+            test_entry.uri = uri
+            test_entry.dist = dist
+            probe_results[key] = self._sourcesListEntryDownloadable(test_entry)
+        return probe_results[key]
+
+    def _keepThirdPartyEntry(self, entry, fromDists, toDists,
+                             entry_uri_test_results, probe_results):
+        """
+        check if a third-party entry has a Release file for the new
+        dist, if so the entry is moved to the new dist and True is
+        returned
+        """
+        if entry.dist in fromDists:
+            if entry_uri_test_results[entry.uri] == 'unknown':
+                if self._probedEntryDownloadable(probe_results, entry,
+                                                 entry.uri):
+                    entry_uri_test_results[entry.uri] = 'passed'
+                else:
+                    entry_uri_test_results[entry.uri] = 'failed'
+            if entry_uri_test_results[entry.uri] == 'failed':
+                return False
+            entry.dist = toDists[fromDists.index(entry.dist)]
+            return True
+        # flat repositories have no dists/ directory to check
+        if entry.dist.endswith("/"):
+            return False
+        # not release specific (e.g. "stable"), keep it if it is there
+        return self._probedEntryDownloadable(probe_results, entry,
+                                             entry.uri, entry.dist)
 
     def rewriteSourcesList(self, mirror_check=True):
         if mirror_check:
@@ -565,6 +728,20 @@ class DistUpgradeController(object):
             new_list.append(entry)
         self.sources.list = new_list
 
+        # check all the Release files we may need at once, a serial
+        # check is slow with many entries or unresponsive mirrors
+        old_releases_uris = [
+            "http://%sarchive.ubuntu.com/ubuntu" % country_mirror(),
+            "http://archive.ubuntu.com/ubuntu"]
+        probe_third_party = (
+            mirror_check and
+            self.config.getWithDefault("Sources", "ProbeThirdParty", False))
+        self.third_party_kept = 0
+        self.third_party_disabled = 0
+        probe_results = self._probeSourcesListEntries(
+            self._collectProbeTargets(fromDists, mirror_check,
+                                      old_releases_uris, probe_third_party))
+
         # look over the stuff we have
         foundToDist = False
         # collect information on what components (main,universe) are enabled for what distro (sub)version
@@ -636,12 +813,9 @@ class DistUpgradeController(object):
                 "old-releases.ubuntu.com/" in entry.uri):
                 logging.debug("upgrade from old-releases.ubuntu.com detected")
                 # test country mirror first, then archive.u.c
-                for uri in ["http://%sarchive.ubuntu.com/ubuntu" % country_mirror(),
-                            "http://archive.ubuntu.com/ubuntu"]:
-                    test_entry = copy.copy(entry)
-                    test_entry.uri = uri
-                    test_entry.dist = self.toDist
-                    if self._sourcesListEntryDownloadable(test_entry):
+                for uri in old_releases_uris:
+                    if self._probedEntryDownloadable(probe_results,
+                                                     entry, uri):
                         logging.info("transition from old-release.u.c to %s" % uri)
                         entry.uri = uri
                         if entry.uri not in entry_uri_test_results:
@@ -674,9 +848,9 @@ class DistUpgradeController(object):
                     if entry_uri_test_results[entry.uri] == 'unknown':
                         foundToDist |= validTo
                         # check to see whether the archive provides the new dist
-                        test_entry = copy.copy(entry)
-                        test_entry.dist = self.toDist
-                        if not self._sourcesListEntryDownloadable(test_entry):
+                        if not self._probedEntryDownloadable(probe_results,
+                                                             entry,
+                                                             entry.uri):
                             entry_uri_test_results[entry.uri] = 'failed'
                         else:
                             entry_uri_test_results[entry.uri] = 'passed'
@@ -723,6 +897,17 @@ class DistUpgradeController(object):
                             self.found_components[d].add(comp)
 
             else:
+                # keep third party entries that are available for the
+                # new release (if enabled)
+                if (probe_third_party and
+                    self._keepThirdPartyEntry(entry, fromDists, toDists,
+                                              entry_uri_test_results,
+                                              probe_results)):
+                    self.third_party_kept += 1
+                    logging.debug("third party entry '%s' kept (Release file found)" % get_string_with_no_auth_from_source_entry(entry))
+                    continue
+                if probe_third_party:
+                    self.third_party_disabled += 1
                 # disable anything that is not from a official mirror or an
                 # allowed third party
                 if entry.dist == self.fromDist:
@@ -781,7 +966,7 @@ class DistUpgradeController(object):
 
     def updateSourcesList(self):
         logging.debug("updateSourcesList()")
-        self.sources = SourcesList(matcherPath=self.datadir)
+        self.sources = get_sources_model().sources(matcherPath=self.datadir)
         # backup first!
         self.sources.backup(self.sources_backup_ext)
 
@@ -812,7 +997,7 @@ class DistUpgradeController(object):
                                ) % (self.fromDist, self.toDist))
             if res:
                 # re-init the sources and try again
-                self.sources = SourcesList(matcherPath=self.datadir)
+                self.sources = get_sources_model().sources(matcherPath=self.datadir)
                 # its ok if rewriteSourcesList fails here if
                 # we do not use a network, the sources.list may be empty
                 if (not self.rewriteSourcesList(mirror_check=False)
@@ -839,6 +1024,11 @@ class DistUpgradeController(object):
                                      self.toDist+"-security", comps)
             else:
                 self.abort()
+        # the entries that were only checked during the rewrite
+        get_probe_cache().save()
+
+        # use the fastest official mirror (if enabled)
+        self._useFastestMirror()
 
         # now write
         self.sources.save()
@@ -848,10 +1038,7 @@ class DistUpgradeController(object):
         # TODO: check if some main packages are still available or if we
         #       accidentally shot them, if not, maybe offer to write a standard
         #       sources.list?
-        try:
-            sourceslist = apt_pkg.SourceList()
-            sourceslist.read_main_list()
-        except SystemError:
+        if not get_sources_model().apt_valid():
             logging.error("Repository information invalid after updating (we broke it!)")
             if os.path.exists("/usr/bin/apport-bug"):
                 self._view.error(_("Repository information invalid"),
@@ -878,8 +1065,77 @@ class DistUpgradeController(object):
                                "your package manager."
                                ))
         get_telemetry().set_using_third_party_sources(self.sources_disabled)
+        if self.config.getWithDefault("Sources", "ProbeThirdParty", False):
+            get_telemetry().set_third_party_probe(self.third_party_kept,
+                                                  self.third_party_disabled)
         return True
 
+    def _benchmarkCandidates(self):
+        """
+        the official mirrors that may be used for the upgrade: the
+        country mirror, the main archive and the mirrors.cfg entries
+        that belong to the same country
+        """
+        cc = country_mirror().rstrip(".")
+        candidates = ["http://archive.ubuntu.com/ubuntu/"]
+        if not cc:
+            return candidates
+        candidates.insert(0, "http://%s.archive.ubuntu.com/ubuntu/" % cc)
+        for mirror in self.valid_mirrors:
+            parts = urlsplit(mirror)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                continue
+            # security, ports and friends are not archive mirrors
+            if ("ports" in parts.path or
+                parts.hostname.endswith((".ubuntu.com", ".canonical.com",
+                                         ".launchpad.net"))):
+                continue
+            labels = parts.hostname.split(".")
+            if cc in (labels[0], labels[-1]) and mirror not in candidates:
+                candidates.append(mirror)
+        return candidates
+
+    def _useFastestMirror(self):
+        """
+        benchmark the download rate of the official mirrors and rewrite
+        the sources.list entries of the main archive to the fastest one
+        """
+        if not self.config.getWithDefault("Network", "BenchmarkMirrors",
+                                          False):
+            return
+        if not self.useNetwork:
+            logging.debug("skipping mirror benchmark (no network)")
+            return
+        if self.arch not in ("amd64", "i386"):
+            logging.debug("skipping mirror benchmark (%s)" % self.arch)
+            return
+        max_mirrors = self.config.getWithDefault("Network",
+                                                 "BenchmarkMaxMirrors", 8)
+        candidates = self._benchmarkCandidates()[:max_mirrors]
+        path = "dists/%s/main/binary-%s/Packages.gz" % (self.toDist,
+                                                       self.arch)
+        nbytes = self.config.getWithDefault("Network", "BenchmarkBytes",
+                                            512 * 1024)
+        ranked = benchmark_mirrors(
+            candidates, path, nbytes,
+            self.config.getWithDefault("Network", "ProbeWorkers", 8))
+        if not ranked:
+            logging.warning("no mirror could be benchmarked")
+            return
+        (fastest, rate) = ranked[0]
+        logging.info("fastest mirror is '%s' (%.0f kB/s)" % (
+            fastest, rate / 1024))
+        archive = MirrorIndex(["http://archive.ubuntu.com/ubuntu/"] +
+                              candidates)
+        for entry in self.sources.list:
+            if entry.invalid or entry.disabled:
+                continue
+            if not archive.is_mirror(entry.uri) or entry.uri == fastest:
+                continue
+            logging.debug("using '%s' for '%s'" % (
+                fastest, get_string_with_no_auth_from_source_entry(entry)))
+            entry.uri = fastest
+
     def _logChanges(self):
         # debugging output
         logging.debug("About to apply the following changes")
@@ -951,7 +1207,150 @@ class DistUpgradeController(object):
         logging.debug("Obsolete: %s" % " ".join(sorted(self.obsolete_pkgs)))
         return True
 
-    def doUpdate(self, showErrors=True, forceRetries=None):
+    def _indexTargets(self):
+        """
+        return a dict of the enabled sources.list entries keyed by the
+        index target they describe (type, uri, dist, comps, architectures)
+        """
+        targets = {}
+        for entry in get_sources_model().sources(withMatcher=False).list:
+            if (entry.invalid or entry.disabled or
+                entry.uri.startswith("cdrom:")):
+                continue
+            key = (entry.type, entry.uri.rstrip("/"), entry.dist,
+                   tuple(sorted(entry.comps)),
+                   tuple(sorted(entry.architectures)))
+            targets[key] = entry
+        return targets
+
+    def _indexPrefix(self, uri, dist):
+        """ the start of the names of the list files of uri/dist """
+        if dist.endswith("/"):
+            # flat repository
+            return apt_pkg.uri_to_filename("%s/%s" % (uri, dist))
+        return apt_pkg.uri_to_filename("%s/dists/%s/" % (uri, dist))
+
+    def _indexFiles(self, uri, dist):
+        """ the files in the apt lists dir that were fetched for uri/dist """
+        listdir = apt_pkg.config.find_dir("Dir::State::lists")
+        prefix = self._indexPrefix(uri, dist)
+        return glob.glob(os.path.join(listdir, glob.escape(prefix) + "*"))
+
+    def _changedSourcesList(self):
+        """
+        write the index targets that changed since the last successful
+        update to a temporary sources.list and return its name, returns
+        "" if nothing changed and None if everything needs an update
+        """
+        if (self._updated_targets is None or
+            not self.config.getWithDefault("Network", "UpdateOnlyChanged",
+                                           True)):
+            return None
+        targets = self._indexTargets()
+        changed = []
+        saved = 0
+        for (key, entry) in targets.items():
+            (type, uri, dist) = key[:3]
+            files = self._indexFiles(uri, dist)
+            names = [os.path.basename(f) for f in files]
+            if (key not in self._updated_targets or
+                not [n for n in names if n.endswith(("_InRelease",
+                                                     "_Release"))]):
+                changed.append(entry)
+                continue
+            saved += sum(os.path.getsize(f) for f in files)
+        logging.info("update: %s of %s index targets unchanged, not "
+                     "fetching them again saves ~%s" % (
+                         len(targets) - len(changed), len(targets),
+                         apt_pkg.size_to_str(saved)))
+        if not changed:
+            return ""
+        if len(changed) == len(targets):
+            return None
+        return self._writeSourcesList(changed, "sources-changed-")
+
+    def _writeSourcesList(self, entries, prefix):
+        """ write entries to a temporary sources.list, returns its name """
+        (fd, name) = tempfile.mkstemp(prefix=prefix, suffix=".list")
+        with os.fdopen(fd, "w") as f:
+            for entry in entries:
+                logging.debug("update: fetching '%s'" % str(entry))
+                f.write("%s\n" % str(entry))
+        return name
+
+    def _failedSourcesList(self, failed_items):
+        """
+        write the index targets the failed items (uris) belong to to a
+        temporary sources.list and return its name, returns None if
+        not all of them belong to a sources.list entry
+        """
+        bases = []
+        for (key, entry) in self._indexTargets().items():
+            uri = get_sources_model().sanitized_uri(entry.uri)
+            if entry.dist.endswith("/"):
+                base = "%s/%s" % (uri, entry.dist)
+            else:
+                base = "%s/dists/%s/" % (uri, entry.dist)
+            bases.append((base, entry))
+        failed = []
+        for item_uri in failed_items:
+            item_uri = get_sources_model().sanitized_uri(item_uri)
+            entries = [entry for (base, entry) in bases
+                       if item_uri.startswith(base)]
+            if not entries:
+                logging.debug("update: '%s' does not belong to a "
+                              "sources.list entry" % item_uri)
+                return None
+            failed.extend(e for e in entries if e not in failed)
+        if not failed:
+            return None
+        return self._writeSourcesList(failed, "sources-failed-")
+
+    def _startIndexPrefetch(self):
+        """
+        download the indexes of the new release for the official
+        mirrors in the background (while the user answers questions),
+        they are adopted by _adoptPrefetchedIndexes()
+        """
+        if (not self.useNetwork or
+            not self.config.getWithDefault("Network", "PrefetchIndexes",
+                                           False)):
+            return
+        pockets = self.config.getlist("Sources","Pockets")
+        fromDists = [self.fromDist] + ["%s-%s" % (self.fromDist, x)
+                                       for x in pockets]
+        toDists = [self.toDist] + ["%s-%s" % (self.toDist,x)
+                                   for x in pockets]
+        lines = []
+        for entry in get_sources_model().sources(withMatcher=False).list:
+            if (entry.invalid or entry.disabled or
+                entry.dist not in fromDists or
+                not self.isMirror(entry.uri)):
+                continue
+            entry.dist = toDists[fromDists.index(entry.dist)]
+            entry.comment = ""
+            line = str(entry)
+            if line not in lines:
+                lines.append(line)
+        if not lines:
+            return
+        self._prefetcher = IndexPrefetcher(lines)
+        if not self._prefetcher.start():
+            self._prefetcher = None
+
+    def _adoptPrefetchedIndexes(self):
+        """ move the indexes of _startIndexPrefetch() to the lists dir """
+        if self._prefetcher is None:
+            return
+        listdir = apt_pkg.config.find_dir("Dir::State::lists")
+        try:
+            self._prefetcher.adopt(listdir)
+        except (OSError, SystemError) as e:
+            logging.warning("adopting the prefetched indexes failed: %s" % e)
+            self._prefetcher.cancel()
+        self._prefetcher = None
+
+    def doUpdate(self, showErrors=True, forceRetries=None, onlyChanged=False):
         logging.debug("running doUpdate() (showErrors=%s)" % showErrors)
         if not self.useNetwork:
             logging.debug("doUpdate() will not use the network because self.useNetwork==false")
@@ -964,18 +1363,71 @@ class DistUpgradeController(object):
             maxRetries=forceRetries
         else:
             maxRetries = self.config.getint("Network","MaxRetries")
+        # only fetch the index targets that changed since the last update
+        # (e.g. the new release after the sources.list rewrite)
+        sources_list = None
+        if onlyChanged:
+            sources_list = self._changedSourcesList()
+        if sources_list == "":
+            self._updated_targets = set(self._indexTargets())
+            return True
+        progress.rate_limit = apply_network_config(
+            self.config, count_hosts(
+                entry.uri for entry in self._indexTargets().values()))
         # LP: #1321959
         error_msg = ""
-        while currentRetry < maxRetries:
-            try:
-                self.cache.update(progress)
-            except (SystemError, IOError) as e:
-                error_msg = str(e)
-                logging.error("IOError/SystemError in cache.update(): '%s'. Retrying (currentRetry: %s)" % (e,currentRetry))
-                currentRetry += 1
-                continue
-            # no exception, so all was fine, we are done
-            return True
+        # retries and time spent per item
+        retries = {}
+        item_times = {}
+        backoff = self.config.getWithDefault("Network", "RetryBackoff", 2)
+        try:
+            while currentRetry < maxRetries:
+                try:
+                    self.cache.update(progress, sources_list=sources_list)
+                except (SystemError, IOError) as e:
+                    if progress.rate_changed:
+                        # stopped for the new scheduled limit, not a failure
+                        progress.rate_limit.apply()
+                        continue
+                    error_msg = str(e)
+                    logging.error("IOError/SystemError in cache.update(): '%s'. Retrying (currentRetry: %s)" % (e,currentRetry))
+                    failed_items = getattr(progress, "failed_items", {})
+                    for (uri, secs) in getattr(progress, "item_times",
+                                               {}).items():
+                        item_times[uri] = item_times.get(uri, 0) + secs
+                    if sources_list is not None:
+                        os.unlink(sources_list)
+                    # only fetch the targets of the failed items again
+                    sources_list = None
+                    if failed_items:
+                        sources_list = self._failedSourcesList(failed_items)
+                    if sources_list is None:
+                        logging.warning("update: retrying all index targets")
+                    for (uri, error) in failed_items.items():
+                        retries[uri] = retries.get(uri, 0) + 1
+                        logging.info("update: retry %s of '%s' (%.1fs so "
+                                     "far): %s" % (retries[uri], uri,
+                                                   item_times.get(uri, 0),
+                                                   error))
+                    currentRetry += 1
+                    if currentRetry < maxRetries and backoff > 0:
+                        delay = backoff * 2 ** (currentRetry - 1)
+                        logging.debug("update: waiting %ss" % delay)
+                        time.sleep(delay)
+                    continue
+                # no exception, so all was fine, we are done
+                for uri in retries:
+                    secs = item_times.get(uri, 0) + getattr(
+                        progress, "item_times", {}).get(uri, 0)
+                    logging.info("update: '%s' fetched after %s retries "
+                                 "(%.1fs)" % (uri, retries[uri], secs))
+                self._updated_targets = set(self._indexTargets())
+                return True
+        finally:
+            # the progress is shared with downloads that are not limited
+            progress.rate_limit = None
+            if sources_list is not None:
+                os.unlink(sources_list)
 
         logging.error("doUpdate() failed completely")
         if showErrors:
@@ -1130,12 +1582,52 @@ class DistUpgradeController(object):
         self._view.processEvents()
         return changes
 
+    def _measureDownloadSpeed(self, changes):
+        """
+        download the start of the biggest package of the upgrade to
+        estimate the download time before the real download starts
+        """
+        if (not self.useNetwork or
+            not self.config.getWithDefault("Network", "MeasureSpeed", True)):
+            return 0
+        candidates = [pkg.candidate for pkg in changes
+                      if not pkg.marked_delete and pkg.candidate]
+        candidates.sort(key=lambda version: version.size, reverse=True)
+        for version in candidates[:10]:
+            uri = version.uri
+            if uri and uri.startswith(("http://", "https://")):
+                break
+        else:
+            return 0
+        try:
+            rate = measure_throughput(
+                uri, self.config.getWithDefault("Network", "MeasureBytes",
+                                                1024 * 1024),
+                max_time=self.config.getWithDefault("Network",
+                                                    "MeasureSeconds", 5))
+        except (OSError, http.client.HTTPException) as e:
+            logging.debug("measuring the download speed failed: %s" % e)
+            return 0
+        logging.info("measured download speed from '%s': %sB/s" % (
+            uri, apt_pkg.size_to_str(int(rate))))
+        if rate > 0:
+            progress = self._view.getAcquireProgress()
+            progress.est_speed = rate
+            logging.info("estimated download time for %sB: %is" % (
+                apt_pkg.size_to_str(self.cache.required_download),
+                self.cache.required_download / rate))
+        return rate
+
     def askDistUpgrade(self):
         changes = self.calcDistUpgrade()
 
         if not changes:
             return False
 
+        if self.cache.required_download > 0:
+            self._measureDownloadSpeed(changes)
+            self._startSpeculativeFetch()
+
         # ask the user
         res = self._view.confirmChanges(_("Do you want to start the upgrade?"),
                                         changes,
@@ -1143,6 +1635,35 @@ class DistUpgradeController(object):
                                         self.cache.required_download)
         return res
 
+    def _startSpeculativeFetch(self):
+        """
+        start downloading the archives at a low priority while the user
+        reads the changes, the real download continues from there (and
+        the archives are kept if the user declines)
+        """
+        if (not self.useNetwork or
+            not self.config.getWithDefault("Network", "SpeculativeFetch",
+                                           False)):
+            return
+        archivedir = apt_pkg.config.find_dir("Dir::Cache::archives")
+        self._seedArchives(self._archiveVersions(), archivedir)
+        apply_network_config(
+            self.config, count_hosts(v.uri for v in self._archiveVersions()))
+        self._speculativeFetcher = PipelinedFetcher(
+            [self._archiveVersions()], archivedir,
+            nice=self.config.getWithDefault("Network", "SpeculativeNice",
+                                            10))
+        self._speculativeFetcher.start()
+        logging.debug("started the speculative download")
+
+    def _stopSpeculativeFetch(self):
+        """ stop the speculative download, keeping what it fetched """
+        if self._speculativeFetcher is None:
+            return
+        self._speculativeFetcher.cancel()
+        self._speculativeFetcher = None
+        logging.debug("stopped the speculative download")
+
     def _isLivepatchEnabled(self):
         di = distro_info.UbuntuDistroInfo()
         return di.is_lts(self.fromDist) and os.path.isfile('/var/snap/canonical-livepatch/common/machine-token')
@@ -1171,12 +1692,136 @@ class DistUpgradeController(object):
             logging.debug("enabling apt cron job")
             os.chmod("/etc/cron.daily/apt", self._aptCronJobPerms)
 
+    def _archiveVersions(self):
+        """ the package versions that need to be downloaded """
+        return [pkg.candidate for pkg in self.cache.get_changes()
+                if not pkg.marked_delete and pkg.candidate]
+
+    def _verifyArchives(self, archivedir):
+        """
+        check the downloaded archives before anything is installed and
+        remove the bad ones so that they are downloaded again, returns
+        the number of bad archives
+        """
+        if not self.config.getWithDefault("Network", "VerifyArchives",
+                                          True):
+            return 0
+        versions = [v for v in self._archiveVersions()
+                    if (v.package.name, v.version)
+                    not in self._verifiedArchives]
+        start = time.time()
+        bad = verify_archives(
+            versions, archivedir,
+            self.config.getWithDefault("Network", "VerifyWorkers", 0))
+        logging.debug("verified %s archives in %.1fs" % (
+            len(versions), time.time() - start))
+        bad_versions = set()
+        for (version, problem) in bad:
+            logging.error("archive of %s %s is bad (%s), removing it" % (
+                version.package.name, version.version, problem))
+            bad_versions.add((version.package.name, version.version))
+            try:
+                os.unlink(os.path.join(archivedir, archive_name(version)))
+            except OSError as e:
+                logging.warning("can not remove the archive: %s" % e)
+        self._verifiedArchives.update(
+            (v.package.name, v.version) for v in versions
+            if (v.package.name, v.version) not in bad_versions)
+        return len(bad)
+
+    def _packageStore(self):
+        """ the PackageStore of --bundle or --package-cache (or None) """
+        if self._bundle is not None:
+            return self._bundle.package_store()
+        location = getattr(self.options, "package_cache", None)
+        if not location:
+            return None
+        return PackageStore(location)
+
+    def _archiveStore(self):
+        """ the ArchiveStore of [Files] ArchiveStore (or None) """
+        location = self.config.getWithDefault("Files", "ArchiveStore", "")
+        if not location:
+            return None
+        max_size = self.config.getWithDefault("Files", "ArchiveStoreMaxSize",
+                                              4096)
+        return ArchiveStore(location, max_size * 1024 * 1024)
+
+    def _seedArchives(self, versions, archivedir):
+        """
+        put the archives of versions that were kept from earlier runs
+        or are in the --bundle or --package-cache into archivedir
+        """
+        for store in (self._archiveStore(), self._packageStore()):
+            if store is not None:
+                store.seed(versions, archivedir)
+
+    def _exportBundle(self, path):
+        """
+        write the indexes and packages of the upgrade to path (a
+        directory or a .squashfs image) and exit without upgrading
+        """
+        list_files = []
+        for key in self._indexTargets():
+            list_files += self._indexFiles(key[1], key[2])
+        bundledir = path
+        if path.endswith(".squashfs"):
+            bundledir = tempfile.mkdtemp(prefix="upgrade-bundle-")
+        try:
+            export_bundle(bundledir, list_files, self._archiveVersions(),
+                          apt_pkg.config.find_dir("Dir::Cache::archives"),
+                          self.datadir, self.fromDist, self.toDist)
+            if bundledir != path:
+                make_squashfs(bundledir, path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.exception("writing the bundle failed")
+            self._view.error(_("Could not write the upgrade bundle"),
+                             "%s" % e)
+            self.abort()
+        finally:
+            if bundledir != path:
+                shutil.rmtree(bundledir, ignore_errors=True)
+        self._view.information(_("Upgrade bundle written"),
+                               _("The upgrade was written to '%s', "
+                                 "this system was not changed.") % path)
+        # restore the original state, but this is no failure
+        self.sources.restore_backup(self.sources_backup_ext)
+        self._enableAptCronJob()
+        self.openCache()
+        sys.exit(0)
+
+    def _adoptBundleIndexes(self):
+        """ use the (verified) indexes of the --bundle """
+        if self._bundle is None:
+            return
+        if self._bundle.manifest.get("To") != self.toDist:
+            logging.error("bundle is for '%s', not for '%s'" % (
+                self._bundle.manifest.get("To"), self.toDist))
+            self._view.error(_("Invalid upgrade bundle"),
+                             _("The upgrade bundle is not for %s.") %
+                             self.toDist)
+            self.abort()
+        # the indexes are named after the mirrors of the machine that
+        # wrote the bundle, only the ones of our mirrors are used
+        prefixes = set(self._indexPrefix(key[1], key[2])
+                       for key in self._indexTargets())
+        self._bundle.adopt_lists(
+            apt_pkg.config.find_dir("Dir::State::lists"), prefixes)
+
     def doDistUpgradeFetching(self):
         # ensure that no apt cleanup is run during the download/install
         self._disableAptCronJob()
+        # apt resumes what the speculative download fetched so far
+        self._stopSpeculativeFetch()
         # get the upgrade
         currentRetry = 0
         fprogress = self._view.getAcquireProgress()
+        fprogress.rate_limit = apply_network_config(
+            self.config, count_hosts(v.uri for v in self._archiveVersions()))
+        # take what earlier runs or other machines already downloaded
+        archivedir = apt_pkg.config.find_dir("Dir::Cache::archives")
+        self._seedArchives(self._archiveVersions(), archivedir)
+        store = self._packageStore()
         #iprogress = self._view.getInstallProgress(self.cache)
         # start slideshow
         url = self.config.getWithDefault("Distro","SlideshowUrl",None)
@@ -1209,11 +1854,22 @@ class DistUpgradeController(object):
         # the while loop.
         exception = None
         while currentRetry < maxRetries:
+            # retries only the failed items, only if that does not help
+            # everything is queued again
+            engine = FetchEngine(
+                self.cache, fprogress,
+                item_retries=self.config.getWithDefault(
+                    "Network", "ItemRetries", 3),
+                mirror_retries=self.config.getWithDefault(
+                    "Network", "MirrorRetries", 6))
             try:
-                pm = apt_pkg.PackageManager(self.cache._depcache)
-                self.fetcher = apt_pkg.Acquire(fprogress)
-                self.cache._fetch_archives(self.fetcher, pm)
+                engine.run()
             except apt.cache.FetchCancelledException as e:
+                if fprogress.rate_changed:
+                    # stopped for the new scheduled limit, apt resumes
+                    # the partial downloads
+                    fprogress.rate_limit.apply()
+                    continue
                 logging.info("user canceled")
                 user_canceled = True
                 exception = e
@@ -1224,8 +1880,23 @@ class DistUpgradeController(object):
                 currentRetry += 1
                 exception = e
                 continue
+            finally:
+                self.fetcher = engine.fetcher
+            # find corrupt archives before dpkg reaches them
+            bad = self._verifyArchives(archivedir)
+            if bad:
+                currentRetry += 1
+                exception = IOError("%s downloaded packages are corrupt" %
+                                    bad)
+                continue
+            if (store is not None and
+                getattr(self.options, "publish_package_cache", False)):
+                store.publish(self._archiveVersions(), archivedir)
+            fprogress.rate_limit = None
             return True
 
+        # the progress is shared with downloads that are not limited
+        fprogress.rate_limit = None
         # maximum fetch-retries reached without a successful commit
         if user_canceled:
             self._view.information(_("Upgrade canceled"),
@@ -1245,6 +1916,130 @@ class DistUpgradeController(object):
         self._enableAptCronJob()
         self.abort()
 
+    def _markBatch(self, names, versions, auto):
+        """
+        mark only the packages names for install (with the version
+        strings of versions), returns False if that leaves the cache
+        broken
+        """
+        self.cache.clear()
+        with self.cache.actiongroup():
+            for name in names:
+                pkg = self.cache[name]
+                version = pkg.versions.get(versions[name].version)
+                if version is None:
+                    return False
+                if pkg.candidate != version:
+                    pkg.candidate = version
+                pkg.mark_install(auto_fix=False, auto_inst=False,
+                                 from_user=not auto[name])
+        return self.cache._depcache.broken_count == 0
+
+    def doPipelinedUpgrade(self):
+        """
+        install the upgrade in dependency closed batches while the
+        archives of the later batches are still downloaded, returns
+        True if batches were installed (the rest of the upgrade is then
+        done by the normal doDistUpgrade())
+        """
+        if (self._partialUpgrade or not self.useNetwork or
+            getattr(self.options, "export_bundle", None) or
+            not self.config.getWithDefault("Network", "PipelinedInstall",
+                                           False)):
+            return False
+        # libc6 goes first, like without PipelinedInstall
+        batches = order_batches(
+            install_deps(self.cache),
+            self.config.getWithDefault("Network", "PipelineBatchSize", 100),
+            first=["libc6"])
+        if len(batches) < 2:
+            return False
+        self._stopSpeculativeFetch()
+        # the install order of the whole upgrade must work before
+        # anything is installed
+        if not self.doDistUpgradeSimulation(fetch=False):
+            logging.warning("simulating the upgrade failed, not using "
+                            "the pipelined install")
+            return False
+        # the batches change the marks, the rest of fullUpgrade() needs
+        # the ones of the whole upgrade if nothing was installed
+        snapshot = self.cache.create_snapshot()
+        versions = {}
+        auto = {}
+        for pkg in self.cache.get_changes():
+            if not pkg.marked_delete and pkg.candidate:
+                versions[pkg.name] = pkg.candidate
+                auto[pkg.name] = pkg.is_auto_installed
+        logging.info("pipelined upgrade of %s packages in %s batches" % (
+            len(versions), len(batches)))
+        self._pipelinedArchives = [archive_name(v)
+                                   for v in versions.values()]
+        self._disableAptCronJob()
+        limit = apply_network_config(
+            self.config, count_hosts(v.uri for v in versions.values()))
+        archivedir = apt_pkg.config.find_dir("Dir::Cache::archives")
+        self._seedArchives(list(versions.values()), archivedir)
+        fetcher = PipelinedFetcher(
+            [[versions[name] for name in batch] for batch in batches],
+            archivedir)
+        fetcher.start()
+        installed = 0
+        pending = []
+        try:
+            for (i, batch) in enumerate(batches[:-1]):
+                if not fetcher.wait(i):
+                    break
+                pending += batch
+                if not self._markBatch(pending, versions, auto):
+                    logging.debug("batch %s needs the next one" % (i + 1))
+                    continue
+                # the simulation changes the apt configuration and the
+                # verification forks, see PipelinedFetcher
+                fetcher.pause()
+                try:
+                    self._verifyArchives(archivedir)
+                    simulated = self.doDistUpgradeSimulation()
+                    # the later batches start with the scheduled limit
+                    if limit.changed():
+                        limit.apply()
+                finally:
+                    fetcher.resume()
+                if not simulated:
+                    logging.warning("simulating batch %s failed" % (i + 1))
+                    break
+                logging.info("installing batch %s/%s (%s packages)" % (
+                    i + 1, len(batches), len(pending)))
+                if not self.doDistUpgrade():
+                    # don't abort here, because it would restore the
+                    # sources.list
+                    self._view.information(
+                        _("Upgrade incomplete"),
+                        _("The upgrade has partially completed but there "
+                          "were errors during the upgrade process."))
+                    sys.exit(1)
+                self._upgradeStarted = True
+                self._disableAptCronJob()
+                fetcher.pause()
+                try:
+                    self.openCache(restore_sources_list_on_fail=True)
+                finally:
+                    fetcher.resume()
+                installed += len(pending)
+                pending = []
+            # the rest is installed with everything that is left
+            fetcher.join()
+        finally:
+            fetcher.cancel()
+        logging.info("pipelined upgrade installed %s packages before the "
+                     "download finished" % installed)
+        if installed == 0 and not self.cache.restore_snapshot(snapshot):
+            logging.error("restoring the marks of the upgrade failed, "
+                          "calculating them again")
+            self.cache.clear()
+            if not self.calcDistUpgrade():
+                self.abort()
+        return installed > 0
+
     def _is_apt_btrfs_snapshot_supported(self):
         """ check if apt-btrfs-snapshot is usable """
         try:
@@ -1270,7 +2065,30 @@ class DistUpgradeController(object):
         res = apt_btrfs.create_btrfs_root_snapshot(prefix)
         logging.info("creating snapshot '%s' (success=%s)" % (prefix, res))
 
-    def doDistUpgradeSimulation(self):
+    def _simulateInstall(self):
+        """
+        run the package manager for the marked changes without
+        downloading the archives (their names are enough for the install
+        order), dpkg is not really run in doDistUpgradeSimulation()
+        """
+        pm = apt_pkg.PackageManager(self.cache._depcache)
+        # the fetcher is never run
+        fetcher = apt_pkg.Acquire()
+        pm.get_archives(fetcher, self.cache._list, self.cache._records)
+        try:
+            res = self.cache.install_archives(
+                pm, self._view.getInstallProgress(self.cache))
+        except SystemError as e:
+            logging.error("SystemError from install_archives(): %s" % e)
+            return False
+        logging.debug("install_archives() returned %s" % res)
+        return res == pm.RESULT_COMPLETED
+
+    def doDistUpgradeSimulation(self, fetch=True):
+        """
+        run the upgrade with a dpkg that does nothing, without fetch the
+        archives are not downloaded first
+        """
         backups = {}
         backups["dir::bin::dpkg"] = [apt_pkg.config["dir::bin::dpkg"]]
         apt_pkg.config["dir::bin::dpkg"] = "/bin/true"
@@ -1280,6 +2098,8 @@ class DistUpgradeController(object):
             apt_pkg.config.clear(lst)
 
         try:
+            if not fetch:
+                return self._simulateInstall()
             return self.doDistUpgrade()
         finally:
             for lst in backups:
@@ -1298,7 +2118,7 @@ class DistUpgradeController(object):
         iprogress = self._view.getInstallProgress(self.cache)
         # retry the fetching in case of errors
         maxRetries = self.config.getint("Network","MaxRetries")
-        if not self._partialUpgrade:
+        if not self._partialUpgrade and not self._upgradeStarted:
             self.quirks.run("StartUpgrade")
             # FIXME: take this into account for diskspace calculation
             self._maybe_create_apt_btrfs_snapshot()
@@ -1390,15 +2210,25 @@ class DistUpgradeController(object):
 
     def doPostUpgrade(self):
         get_telemetry().add_stage('POSTUPGRADE')
-        # clean up downloaded packages
+        # clean up downloaded packages (or keep them in the ArchiveStore)
         archivedir = os.path.dirname(
             apt_pkg.config.find_dir("Dir::Cache::archives"))
-        for item in self.fetcher.items:
-            if os.path.dirname(os.path.abspath(item.destfile)) == archivedir:
+        destfiles = [os.path.join(archivedir, name)
+                     for name in self._pipelinedArchives]
+        if self.fetcher is not None:
+            destfiles += [item.destfile for item in self.fetcher.items]
+        store = self._archiveStore()
+        for destfile in destfiles:
+            if (os.path.dirname(os.path.abspath(destfile)) == archivedir and
+                os.path.exists(destfile)):
+                if store is not None and store.retain(destfile):
+                    continue
                 try:
-                    os.unlink(item.destfile)
+                    os.unlink(destfile)
                 except OSError:
                     pass
+        if store is not None:
+            store.evict()
 
         # reopen cache
         self.openCache()
@@ -1461,12 +2291,12 @@ class DistUpgradeController(object):
         logging.debug("remove_candidates: '%s'" % remove_candidates)
         logging.debug("Start checking for obsolete pkgs")
         progress = self._view.getOpCacheProgress()
-        for (i, pkgname) in enumerate(remove_candidates):
-            progress.update((i/float(len(remove_candidates)))*100.0)
-            if pkgname not in self.foreign_pkgs:
-                self._view.processEvents()
-                if not self.cache.tryMarkObsoleteForRemoval(pkgname, remove_candidates, self.forced_obsoletes, self.foreign_pkgs):
-                    logging.debug("'%s' scheduled for remove but not safe to remove, skipping", pkgname)
+        obsoletes = [pkgname for pkgname in remove_candidates
+                     if pkgname not in self.foreign_pkgs]
+        for pkgname in self.cache.markObsoletesForRemoval(
+                obsoletes, remove_candidates, self.forced_obsoletes,
+                self.foreign_pkgs, progress):
+            logging.debug("'%s' scheduled for remove but not safe to remove, skipping", pkgname)
         logging.debug("Finish checking for obsolete pkgs")
         progress.done()
 
@@ -1529,6 +2359,9 @@ class DistUpgradeController(object):
         logging.debug("abort called")
         if hasattr(self, "sources"):
             self.sources.restore_backup(self.sources_backup_ext)
+        if self._prefetcher is not None:
+            self._prefetcher.cancel()
+        self._stopSpeculativeFetch()
         # generate a new cache
         self._view.updateStatus(_("Restoring original system state"))
         self._view.abort()
@@ -1625,39 +2458,31 @@ class DistUpgradeController(object):
 
     def isMirror(self, uri):
         """ check if uri is a known mirror """
+        return get_sources_model().derived("mirror", uri, self._isMirror)
+
+    def _isMirror(self, uri):
         # deal with username:password in a netloc
-        raw_uri = uri.rstrip("/")
-        scheme, netloc, path, query, fragment = urlsplit(raw_uri)
-        if "@" in netloc:
-            netloc = netloc.split("@")[1]
-        # construct new mirror url without the username/pw
-        uri = "%s://%s%s" % (scheme, netloc, path)
-        for mirror in self.valid_mirrors:
-            mirror = mirror.rstrip("/")
-            if is_mirror(mirror, uri):
-                return True
-            # deal with mirrors like
-            #    deb http://localhost:9977/security.ubuntu.com/ubuntu intrepid-security main restricted
-            # both apt-debtorrent and apt-cacher use this (LP: #365537)
-            mirror_host_part = mirror.split("//")[1]
-            if uri.endswith(mirror_host_part):
-                logging.debug("found apt-cacher/apt-torrent style uri %s" % uri)
-                return True
+        uri = get_sources_model().sanitized_uri(uri)
+        if self._mirror_index.is_mirror(uri):
+            return True
+        # deal with mirrors like
+        #    deb http://localhost:9977/security.ubuntu.com/ubuntu intrepid-security main restricted
+        # both apt-debtorrent and apt-cacher use this (LP: #365537)
+        if self._mirror_index.has_suffix(uri):
+            logging.debug("found apt-cacher/apt-torrent style uri %s" % uri)
+            return True
         return False
 
     def isThirdPartyMirror(self, uri):
         " check if uri is an allowed third-party mirror "
-        uri = uri.rstrip("/")
-        for mirror in self.valid_3p_mirrors:
-            mirror = mirror.rstrip("/")
-            if is_mirror(mirror, uri):
-                return True
-        return False
+        return get_sources_model().derived(
+            "3p-mirror", uri,
+            lambda uri: self._3p_mirror_index.is_mirror(uri.rstrip("/")))
 
     def _getPreReqMirrorLines(self, dumb=False):
         " get sources.list snippet lines for the current mirror "
         lines = ""
-        sources = SourcesList(matcherPath=".")
+        sources = get_sources_model().sources(matcherPath=".")
         for entry in sources.list:
             if entry.invalid or entry.disabled:
                 continue
@@ -1870,6 +2695,11 @@ class DistUpgradeController(object):
         self.doUpdate(showErrors=False, forceRetries=1)
         self.openCache()
 
+        # the network is idle while the user answers the questions
+        # until the sources.list is rewritten (after this update, so
+        # that the two do not share the bandwidth)
+        self._startIndexPrefetch()
+
         # do pre-upgrade stuff (calc list of obsolete pkgs etc)
         if not self.doPostInitialUpdate():
             self.abort()
@@ -1881,8 +2711,11 @@ class DistUpgradeController(object):
             if not self.updateSourcesList():
                 self.abort()
 
-            # then update the package index files
-            if not self.doUpdate():
+            # then update the package index files, the ones that are
+            # still the same were just fetched by the first update
+            self._adoptPrefetchedIndexes()
+            self._adoptBundleIndexes()
+            if not self.doUpdate(onlyChanged=True):
                 self.abort()
 
             # then open the cache (again)
@@ -1941,17 +2774,23 @@ class DistUpgradeController(object):
                 self.abort()
             self._inhibitIdle()
 
-            # fetch the stuff
+            # fetch the stuff, with PipelinedInstall the first batches
+            # are installed while the rest is downloaded
             self._view.setStep(Step.FETCH)
             self._view.updateStatus(_("Fetching"))
-            if not self.doDistUpgradeFetching():
+            pipelined = self.doPipelinedUpgrade()
+            if not pipelined and not self.doDistUpgradeFetching():
                 self._enableAptCronJob()
                 self.abort()
 
+            # only write the upgrade to a bundle (for other machines)
+            if getattr(self.options, "export_bundle", None):
+                self._exportBundle(self.options.export_bundle)
+
             # simulate an upgrade
             self._view.setStep(Step.INSTALL)
             self._view.updateStatus(_("Upgrading"))
-            if not self.doDistUpgradeSimulation():
+            if not pipelined and not self.doDistUpgradeSimulation():
                 self._view.error(_("Upgrade infeasible"),
                                  _("The upgrade could not be completed, there "
                                    "were errors during the upgrade "
@@ -1962,8 +2801,9 @@ class DistUpgradeController(object):
             self.cache.clear()
             libc6_possible = False
             try:
-                self.cache["libc6"].mark_install()
-                libc6_possible = True
+                if not pipelined:
+                    self.cache["libc6"].mark_install()
+                    libc6_possible = True
             except SystemError as e:
                 if "pkgProblemResolver" in str(e):
                     logging.debug("Unable to mark libc6 alone for install.")
@@ -1990,7 +2830,7 @@ class DistUpgradeController(object):
 
         self._view.updateStatus(_("Calculating the changes"))
         if not self.calcDistUpgrade():
-            if libc6_possible:
+            if libc6_possible or pipelined:
                 # don't abort here, because it would restore the sources.list
                 self._view.information(_("Upgrade incomplete"),
                                        _("The upgrade has partially completed but there "
@@ -2001,6 +2841,12 @@ class DistUpgradeController(object):
             else:
                 self.abort()
 
+        # the pipelined install downloaded the rest, check it like
+        # doDistUpgradeFetching() does
+        if pipelined:
+            self._verifyArchives(
+                apt_pkg.config.find_dir("Dir::Cache::archives"))
+
         # now do the upgrade
         self._view.setStep(Step.INSTALL)
         self._view.updateStatus(_("Upgrading"))
@@ -31,11 +31,12 @@ import socket
 import sys
 import subprocess
 from gettext import gettext as _
-from aptsources.sourceslist import SourcesList
 from urllib.request import urlopen
 from urllib.error import HTTPError
 
 from .utils import get_dist, url_downloadable, country_mirror
+from .DistUpgradeProbe import get as get_probe_cache
+from .DistUpgradeSources import get as get_sources_model
 from .DistUpgradeViewText import readline
 
 
@@ -52,6 +53,8 @@ class DistUpgradeFetcherCore(object):
         self._progress = progress
         # options to pass to the release upgrader when it is run
         self.run_options = []
+        # the mirror the upgrader is downloaded from
+        self._mirror = None
 
     def _debug(self, msg):
         " helper to show debug information "
@@ -153,59 +156,76 @@ class DistUpgradeFetcherCore(object):
                                 "ubuntu-release-upgrader-core'."))
         return True
 
-    def mirror_from_sources_list(self, uri, default_uri):
+    def mirror_from_sources_list(self, uri, default_uri, extra=()):
         """
         try to figure what the mirror is from current sources.list
 
         do this by looing for matching DEFAULT_COMPONENT, current dist
-        in sources.list and then doing a http HEAD/ftp size request
-        to see if the uri is available on this server
+        in sources.list and then probing all the candidates (and the
+        uris of extra) at the same time to find the one that answers
+        fastest. The mirror found is remembered so that the following
+        downloads (e.g. tarball and signature) come from the same mirror
         """
         self._debug("mirror_from_sources_list: %s" % self.current_dist_name)
-        sources = SourcesList(withMatcher=False)
-        seen = set()
+        probe_cache = get_probe_cache()
+        if self._mirror is not None:
+            mirror_uri = self._mirror + uri[len(default_uri):]
+            downloadable = probe_cache.url_downloadable(
+                mirror_uri, self._debug, url_downloadable)
+            probe_cache.save()
+            if downloadable:
+                return mirror_uri
+            self._mirror = None
+        sources = get_sources_model().sources(withMatcher=False)
+        candidates = {}
         for e in sources.list:
             if e.disabled or e.invalid or not e.type == "deb":
                 continue
-            # check if we probed this mirror already
-            if e.uri in seen:
+            if (e.dist != self.current_dist_name or
+                    self.DEFAULT_COMPONENT not in e.comps):
                 continue
-            # we are using the main mirror already, so we are fine
-            if (e.uri.startswith(default_uri) and
-                    e.dist == self.current_dist_name and
-                    self.DEFAULT_COMPONENT in e.comps):
-                return uri
-            elif (e.dist == self.current_dist_name and "main" in e.comps):
-                mirror_uri = e.uri + uri[len(default_uri):]
-                if url_downloadable(mirror_uri, self._debug):
-                    return mirror_uri
-                seen.add(e.uri)
-        self._debug("no mirror found")
-        return ""
+            # the main mirror is a candidate too
+            if e.uri.startswith(default_uri):
+                mirror = default_uri
+            else:
+                mirror = e.uri
+            candidates.setdefault(mirror + uri[len(default_uri):], mirror)
+        for other in extra:
+            candidates.setdefault(other, None)
+        ranked = probe_cache.rank(list(candidates), self._debug,
+                                  url_downloadable)
+        if not ranked:
+            self._debug("no mirror found")
+            return ""
+        self._debug("fastest mirror: %s" % ranked[0])
+        self._mirror = candidates[ranked[0]]
+        return ranked[0]
 
     def _expandUri(self, uri):
         """
         expand the uri so that it uses a mirror if the url starts
-        with a well known string (like archive.ubuntu.com)
+        with a well known string (like archive.ubuntu.com), the country
+        mirror is probed together with the mirrors of the sources.list
         """
-        # try to guess the mirror from the sources.list
+        uri_template = Template(uri)
+        main_uri = uri_template.safe_substitute(countrymirror='')
+        # the country mirror first, the ranking keeps the order of
+        # equally fast candidates
+        extra = [uri_template.safe_substitute(countrymirror=country_mirror())]
+        if main_uri not in extra:
+            extra.append(main_uri)
         if uri.startswith(self.DEFAULT_MIRROR):
             self._debug("trying to find suitable mirror")
-            new_uri = self.mirror_from_sources_list(uri, self.DEFAULT_MIRROR)
-            if new_uri:
-                return new_uri
-        # if that fails, use old method
-        uri_template = Template(uri)
-        m = country_mirror()
-        new_uri = uri_template.safe_substitute(countrymirror=m)
-        # be paranoid and check if the given uri is really downloadable
-        try:
-            if not url_downloadable(new_uri, self._debug):
-                raise Exception("failed to download %s" % new_uri)
-        except Exception as e:
-            self._debug("url '%s' could not be downloaded" % e)
-            # else fallback to main server
-            new_uri = uri_template.safe_substitute(countrymirror='')
+            new_uri = self.mirror_from_sources_list(uri, self.DEFAULT_MIRROR,
+                                                    extra)
+        else:
+            ranked = get_probe_cache().rank(extra, self._debug,
+                                            url_downloadable)
+            new_uri = ranked[0] if ranked else ""
+        if not new_uri:
+            # fallback to main server
+            self._debug("no mirror for '%s' can be downloaded" % uri)
+            new_uri = main_uri
         return new_uri
 
     def fetchDistUpgrader(self):
@@ -74,6 +74,27 @@ def do_commandline():
     parser.add_option("--devel-release", action="store_true",
                       dest="devel_release", default=False,
                       help=_("Upgrade to the development release"))
+    parser.add_option("--probe-cache", dest="probe_cache", default="use",
+                      type="choice", choices=["use", "bypass", "flush"],
+                      help=_("Use, bypass or flush the cache of mirror "
+                             "availability checks"))
+    parser.add_option("--package-cache", dest="package_cache",
+                      default=None,
+                      help=_("Take the packages from this directory or url "
+                             "(if they are there) instead of downloading "
+                             "them"))
+    parser.add_option("--publish-package-cache", action="store_true",
+                      dest="publish_package_cache", default=False,
+                      help=_("Copy the downloaded packages to the "
+                             "--package-cache directory"))
+    parser.add_option("--export-bundle", dest="export_bundle",
+                      default=None,
+                      help=_("Write the packages of the upgrade to this "
+                             "directory (or .squashfs image) instead of "
+                             "upgrading"))
+    parser.add_option("--bundle", dest="bundle", default=None,
+                      help=_("Upgrade with the packages of a bundle written "
+                             "by --export-bundle"))
     return parser.parse_args()
 
 def setup_logging(options, config):
@@ -202,6 +223,9 @@ def main():
     config = DistUpgradeConfig(options.datadir)
     logdir = setup_logging(options, config)
 
+    from .DistUpgradeProbe import get as get_probe_cache
+    get_probe_cache().set_mode(options.probe_cache)
+
     from .DistUpgradeVersion import VERSION
     logging.info("release-upgrader version '%s' started" % VERSION)
     # ensure that DistUpgradeView translations are displayed
@@ -0,0 +1,92 @@
+# DistUpgradeMirrors.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+
+def _srv(uri):
+    """ return the part of the uri after the first "//" (like is_mirror) """
+    try:
+        return uri.split("//")[1]
+    except IndexError:
+        return None
+
+
+class MirrorIndex(object):
+    """
+    Index over a list of mirror uris that answers the same questions
+    as looping over the list with aptsources.sourceslist.is_mirror()
+    but without touching every mirror for every lookup.
+
+    The uris are hashed by their full form and by the part after the
+    scheme (to find "<country>.mirror" style mirrors). With
+    match_suffix the host parts also go into a trie of reversed
+    strings to find apt-cacher/apt-debtorrent style uris that end
+    with a mirror host part like
+      http://localhost:9977/security.ubuntu.com/ubuntu
+    """
+
+    def __init__(self, mirrors, match_suffix=False):
+        self._uris = set()
+        self._srvs = set()
+        self._suffixes = {} if match_suffix else None
+        for mirror in mirrors:
+            self.add(mirror)
+
+    def add(self, mirror):
+        """ add a mirror uri to the index """
+        uri = mirror.rstrip("/ ")
+        self._uris.add(uri)
+        srv = _srv(uri)
+        if srv is None:
+            return
+        self._srvs.add(srv)
+        if self._suffixes is not None:
+            node = self._suffixes
+            for c in reversed(_srv(mirror.rstrip("/"))):
+                node = node.setdefault(c, {})
+            node[None] = True
+
+    def is_mirror(self, uri):
+        """
+        check if uri is one of the mirrors or a "<country>." mirror
+        of it, same as is_mirror(mirror, uri) for any of the mirrors
+        """
+        uri = uri.rstrip("/ ")
+        if uri in self._uris:
+            return True
+        srv = _srv(uri)
+        if srv is None or "." not in srv:
+            return False
+        return srv[srv.index(".") + 1:] in self._srvs
+
+    def has_suffix(self, uri):
+        """ check if uri ends with the host part of one of the mirrors """
+        node = self._suffixes
+        if node is None:
+            return False
+        if None in node:
+            return True
+        for c in reversed(uri):
+            node = node.get(c)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
@@ -0,0 +1,151 @@
+# DistUpgradeNetwork.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import logging
+import time
+
+from urllib.parse import urlsplit
+
+
+def parse_schedule(value):
+    """
+    parse a "HH:MM-HH:MM=rate, ..." schedule, returns a list of
+    (start, end, rate) tuples with start and end in minutes since
+    midnight and the rate in KiB/s (0 means no limit)
+    """
+    schedule = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            (span, rate) = part.split("=")
+            (start, end) = span.split("-")
+            minutes = []
+            for t in (start, end):
+                (hours, mins) = t.strip().split(":")
+                minutes.append(int(hours) * 60 + int(mins))
+            schedule.append((minutes[0], minutes[1], int(rate)))
+        except ValueError:
+            logging.warning("ignoring invalid rate schedule '%s'" % part)
+    return schedule
+
+
+def scheduled_rate(schedule, now, default):
+    """ the rate of the schedule entry now falls in (or default) """
+    minute = now.tm_hour * 60 + now.tm_min
+    for (start, end, rate) in schedule:
+        if start <= end and start <= minute < end:
+            return rate
+        # spans midnight
+        if start > end and (minute >= start or minute < end):
+            return rate
+    return default
+
+
+def count_hosts(uris):
+    """
+    the number of hosts apt opens a http(s) connection to for uris,
+    apt uses a single queue (and connection) per host
+    """
+    hosts = set()
+    for uri in uris:
+        parts = urlsplit(uri)
+        if parts.scheme in ("http", "https"):
+            hosts.add((parts.scheme, parts.netloc))
+    return max(1, len(hosts))
+
+
+class RateLimit():
+    """
+    The MaxRate/RateSchedule download limit of the [Network] section
+
+    apt only knows a limit per connection (Acquire::<method>::Dl-Limit),
+    so the limit is split evenly across the hosts of a download to cap
+    the sum of them. A method reads the limit when it starts, a changed
+    limit only applies to downloads that are started after apply().
+    """
+
+    def __init__(self, config, hosts=1):
+        self.max_rate = config.getWithDefault("Network", "MaxRate", 0)
+        self.schedule = parse_schedule(
+            config.getWithDefault("Network", "RateSchedule", ""))
+        self.hosts = max(1, hosts)
+        # the applied limit of all connections together in bytes/s
+        self.limit = 0
+
+    def rate(self, now=None):
+        """ the limit in KiB/s at now (0 for none) """
+        if self.schedule:
+            return max(0, scheduled_rate(self.schedule,
+                                         now or time.localtime(),
+                                         self.max_rate))
+        return max(0, self.max_rate)
+
+    def changed(self, now=None):
+        """ True if the limit at now is not the applied one """
+        return self.rate(now) * 1024 != self.limit
+
+    def apply(self, now=None):
+        """
+        set the Dl-Limit of the http methods to the limit at now, returns
+        the limit of all connections together in bytes/s (0 for none)
+        """
+        rate = self.rate(now)
+        if rate > 0:
+            per_host = max(1, rate // self.hosts)
+            for method in ("http", "https"):
+                option = "Acquire::%s::Dl-Limit" % method
+                _saved_dl_limits.setdefault(option,
+                                            apt_pkg.config.get(option))
+                apt_pkg.config.set(option, str(per_host))
+            logging.info("download rate limited to %s KiB/s (%s KiB/s for "
+                         "each of %s hosts)" % (rate, per_host, self.hosts))
+        elif _saved_dl_limits:
+            # only undo our own limit, one of the apt configuration stays
+            for (option, value) in _saved_dl_limits.items():
+                if value:
+                    apt_pkg.config.set(option, value)
+                else:
+                    apt_pkg.config.clear(option)
+            _saved_dl_limits.clear()
+            logging.info("download rate no longer limited")
+        self.limit = rate * 1024
+        return self.limit
+
+
+# the Dl-Limit values of the apt configuration before RateLimit set them
+_saved_dl_limits = {}
+
+
+def apply_network_config(config, hosts=1, now=None):
+    """
+    set the apt download options from the [Network] section for a
+    download from hosts hosts, returns the RateLimit that was applied
+    """
+    depth = config.getWithDefault("Network", "PipelineDepth", -1)
+    if depth >= 0:
+        for method in ("http", "https"):
+            apt_pkg.config.set("Acquire::%s::Pipeline-Depth" % method,
+                               str(depth))
+    limit = RateLimit(config, hosts)
+    limit.apply(now)
+    return limit
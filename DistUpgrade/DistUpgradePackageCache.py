@@ -0,0 +1,254 @@
+# DistUpgradePackageCache.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import glob
+import hashlib
+import http.client
+import logging
+import os
+import shutil
+import tempfile
+
+from urllib.parse import quote
+
+from .DistUpgradeProbe import get_client
+
+
+def archive_name(version):
+    """ the name apt stores the .deb of version under in its archives """
+    return "%s_%s_%s.deb" % (
+        apt_pkg.quote_string(version.package.shortname, "_:"),
+        apt_pkg.quote_string(version.version, "_:"),
+        apt_pkg.quote_string(version.architecture, "_:."))
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PackageStore():
+    """
+    A store of .deb files shared between machines (a local or NFS
+    directory, or a http(s) url that serves one)
+
+    The files are named like in apt's archives directory. Before the
+    download the ones the upgrade needs are linked (or copied) into
+    the archives directory if their SHA256 sum matches, afterwards the
+    newly downloaded ones can be published back to a directory store.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.remote = location.startswith(("http://", "https://"))
+
+    def _local_path(self, version):
+        return os.path.join(self.location, archive_name(version))
+
+    def _fetch(self, name, dest):
+        """ download name from a remote store to dest """
+        # the "%" of the file name needs to be quoted in the url
+        uri = "%s/%s" % (self.location.rstrip("/"), quote(name))
+        with get_client().open("GET", uri) as reply:
+            if reply.status != 200:
+                return False
+            with open(dest, "wb") as f:
+                for chunk in iter(lambda: reply.read(64 * 1024), b""):
+                    f.write(chunk)
+        return True
+
+    def seed(self, versions, archivedir):
+        """
+        put the .debs of versions that are in the store into archivedir,
+        returns the number of bytes that do not need to be downloaded
+        """
+        seeded = 0
+        partialdir = os.path.join(archivedir, "partial")
+        for version in versions:
+            if not version.sha256:
+                continue
+            name = archive_name(version)
+            target = os.path.join(archivedir, name)
+            if os.path.exists(target):
+                continue
+            tmp = None
+            try:
+                if self.remote:
+                    (fd, tmp) = tempfile.mkstemp(dir=partialdir)
+                    os.close(fd)
+                    if not self._fetch(name, tmp):
+                        continue
+                    source = tmp
+                else:
+                    source = self._local_path(version)
+                    if not os.path.exists(source):
+                        continue
+                if (os.path.getsize(source) != version.size or
+                        _sha256(source) != version.sha256):
+                    logging.warning("package cache: '%s' does not match, "
+                                    "ignoring it" % name)
+                    continue
+                if tmp:
+                    os.rename(tmp, target)
+                    tmp = None
+                else:
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        shutil.copy(source, target)
+            except (OSError, http.client.HTTPException) as e:
+                logging.warning("package cache: getting '%s' failed: %s" %
+                                (name, e))
+                continue
+            finally:
+                if tmp:
+                    os.unlink(tmp)
+            seeded += version.size
+        logging.info("package cache: took %s from '%s'" % (
+            apt_pkg.size_to_str(seeded), self.location))
+        return seeded
+
+    def publish(self, versions, archivedir):
+        """
+        copy the .debs of versions from archivedir to the store (if it
+        is a directory), returns the number of files published
+        """
+        if self.remote:
+            logging.debug("package cache: can not publish to '%s'" %
+                          self.location)
+            return 0
+        published = 0
+        for version in versions:
+            name = archive_name(version)
+            source = os.path.join(archivedir, name)
+            target = self._local_path(version)
+            if not os.path.exists(source) or os.path.exists(target):
+                continue
+            tmp = None
+            try:
+                (fd, tmp) = tempfile.mkstemp(dir=self.location,
+                                             prefix=".publish-")
+                os.close(fd)
+                shutil.copy(source, tmp)
+                os.chmod(tmp, 0o644)
+                os.rename(tmp, target)
+                tmp = None
+            except OSError as e:
+                logging.warning("package cache: publishing '%s' failed: "
+                                "%s" % (name, e))
+                continue
+            finally:
+                if tmp:
+                    os.unlink(tmp)
+            published += 1
+        logging.info("package cache: published %s packages to '%s'" % (
+            published, self.location))
+        return published
+
+
+class ArchiveStore(PackageStore):
+    """
+    A local store of .deb files keyed by their SHA256 sum that keeps the
+    archives of past upgrades (for a rollback, a retried upgrade or
+    other containers on the same host)
+
+    When the store grows over max_size bytes the archives that were
+    used (retained or seeded) least recently are removed.
+    """
+
+    def __init__(self, location, max_size):
+        super(ArchiveStore, self).__init__(location)
+        self.max_size = max_size
+
+    def _hash_path(self, sha256):
+        return os.path.join(self.location, sha256[:2], sha256)
+
+    def _local_path(self, version):
+        return self._hash_path(version.sha256)
+
+    def seed(self, versions, archivedir):
+        for version in versions:
+            if version.sha256:
+                try:
+                    # the modification time is the last use
+                    os.utime(self._local_path(version))
+                except OSError:
+                    pass
+        return super(ArchiveStore, self).seed(versions, archivedir)
+
+    def retain(self, path):
+        """
+        move the archive at path into the store, returns False if that
+        failed (path is left alone then)
+        """
+        try:
+            sha256 = _sha256(path)
+            target = self._hash_path(sha256)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target):
+                os.unlink(path)
+            else:
+                try:
+                    os.rename(path, target)
+                except OSError:
+                    # another file system
+                    shutil.copy(path, target + ".tmp")
+                    os.rename(target + ".tmp", target)
+                    os.unlink(path)
+            os.utime(target)
+        except OSError as e:
+            logging.warning("archive store: keeping '%s' failed: %s" %
+                            (path, e))
+            return False
+        return True
+
+    def evict(self):
+        """
+        remove the least recently used archives until the store is not
+        bigger than max_size, returns the number of bytes removed
+        """
+        archives = []
+        for path in glob.glob(os.path.join(self.location, "??", "*")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            archives.append((st.st_mtime, st.st_size, path))
+        archives.sort()
+        size = sum(size for (mtime, size, path) in archives)
+        removed = 0
+        for (mtime, archive_size, path) in archives:
+            if size - removed <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logging.warning("archive store: removing '%s' failed: %s" %
+                                (path, e))
+                continue
+            removed += archive_size
+        logging.info("archive store: %s in '%s' (removed %s)" % (
+            apt_pkg.size_to_str(size - removed), self.location,
+            apt_pkg.size_to_str(removed)))
+        return removed
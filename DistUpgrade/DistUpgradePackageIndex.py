@@ -0,0 +1,123 @@
+# DistUpgradePackageIndex.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import re
+
+# the inst_state of packages that need to be reinstalled
+REINSTREQ = (apt_pkg.INSTSTATE_REINSTREQ, apt_pkg.INSTSTATE_HOLD_REINSTREQ)
+# everything that looks like a kernel image (not the metapackages)
+KERNEL_IMAGE = re.compile("^linux-(image|image-debug)-[0-9.]*-.*")
+
+
+def kernel_flavour(name):
+    """
+    the flavour of a linux-image-$version-$flavour (or headers) package
+    name, None for other packages
+    """
+    match = re.match(r"^linux-(?:image|image-debug|headers)-[0-9.]+-[0-9]+-"
+                     r"(.+)$", name)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+class PackageIndex():
+    """
+    The facts about the packages of a cache that do not depend on what is
+    marked in the depcache, collected in a single pass over the apt_pkg
+    packages (without apt.Package objects)
+
+    It is only valid for the apt_pkg.Cache (and its candidate versions)
+    it was built from, MyCache builds a new one when the cache is
+    opened again.
+    """
+
+    def __init__(self, cache, depcache):
+        self.cache = cache
+        # name -> apt_pkg.Package of the installed packages
+        self.installed = {}
+        # packages whose candidate is downloadable
+        self.downloadable = set()
+        # installed packages without any downloadable version
+        self.obsolete = set()
+        # packages in reinstreq state that can not be downloaded
+        self.reqreinst = set()
+        # priority (or section) of the downloadable candidate -> names
+        self.priority = {}
+        self.section = {}
+        # packages whose candidate has no priority
+        self.no_priority = set()
+        # installed packages with a downloadable candidate -> the
+        # (origin, archive) pairs of the candidate
+        self.origins = {}
+        # kernel image packages -> their flavour
+        self.kernels = {}
+        # installed linux-headers-* packages
+        self.headers_installed = set()
+        for pkg in cache.packages:
+            if not pkg.has_versions:
+                continue
+            name = pkg.get_fullname(True)
+            candidate = depcache.get_candidate_ver(pkg)
+            downloadable = candidate is not None and candidate.downloadable
+            if pkg.current_ver is not None:
+                self.installed[name] = pkg
+                if not any(ver.downloadable for ver in pkg.version_list):
+                    self.obsolete.add(name)
+                if name.startswith("linux-headers-"):
+                    self.headers_installed.add(name)
+            if not downloadable and pkg.inst_state in REINSTREQ:
+                self.reqreinst.add(name)
+            if KERNEL_IMAGE.match(name):
+                self.kernels[name] = kernel_flavour(name)
+            if candidate is None:
+                continue
+            if candidate.priority == 0:
+                self.no_priority.add(name)
+            if not downloadable:
+                continue
+            self.downloadable.add(name)
+            self.priority.setdefault(candidate.priority_str, set()).add(name)
+            self.section.setdefault(candidate.section, set()).add(name)
+            if pkg.current_ver is not None:
+                self.origins[name] = [
+                    (pkgfile.origin, pkgfile.archive)
+                    for (pkgfile, i) in candidate.file_list]
+
+    def foreign(self, allowed_origin, from_dist, to_dist):
+        """
+        the installed packages whose downloadable candidate is not from
+        allowed_origin in the from_dist or to_dist archives
+        """
+        foreign = set()
+        for (name, origins) in self.origins.items():
+            for (origin, archive) in origins:
+                if origin == allowed_origin and (from_dist in archive or
+                                                 to_dist in archive):
+                    break
+            else:
+                foreign.add(name)
+        return foreign
+
+    def garbage(self, depcache):
+        """ the installed packages that are garbage in depcache """
+        return set(name for (name, pkg) in self.installed.items()
+                   if depcache.is_garbage(pkg))
@@ -0,0 +1,299 @@
+# DistUpgradePipeline.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt
+import apt_pkg
+import logging
+import os
+import threading
+
+from .DistUpgradePackageCache import archive_name
+
+
+def order_batches(deps, batch_size, first=()):
+    """
+    split the packages of deps (a dict of package name to the names it
+    needs installed first or together with it) into batches of at least
+    batch_size packages, every batch only needs itself and the batches
+    before it
+
+    Packages that need each other (a cycle) are always in the same
+    batch. The packages of first and what they need are not batched
+    with anything else (like libc6, that is upgraded before everything
+    else).
+    """
+    # Tarjan's algorithm (without recursion, the graph of a release
+    # upgrade is deep), it emits a cycle after everything it needs
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    groups = []
+    first = [name for name in first if name in deps]
+    # the number of groups the packages of first need
+    head = 0
+    for (i, root) in enumerate(first + sorted(deps)):
+        if i == len(first):
+            head = len(groups)
+        if root in index:
+            continue
+        work = [(root, iter(sorted(deps[root])))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            (name, edges) = work[-1]
+            for dep in edges:
+                if dep not in deps:
+                    continue
+                if dep not in index:
+                    index[dep] = lowlink[dep] = len(index)
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(sorted(deps[dep]))))
+                    break
+                if dep in on_stack:
+                    lowlink[name] = min(lowlink[name], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        group.append(member)
+                        if member == name:
+                            break
+                    groups.append(sorted(group))
+    batches = []
+    batch = []
+    for (i, group) in enumerate(groups):
+        batch += group
+        if len(batch) >= batch_size or i + 1 == head:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _satisfies(version, dep):
+    """ True if version satisfies the versioned dependency dep """
+    if not dep.relation_deb:
+        return True
+    return apt_pkg.check_dep(version.version, dep.relation_deb, dep.version)
+
+
+def install_deps(cache):
+    """
+    the dependencies between the packages that are marked for install
+    or upgrade in cache, for order_batches()
+
+    A package needs the marked packages its new version depends on, the
+    ones whose old version it breaks and the ones whose old version
+    depends on an older version of it.
+    """
+    changed = dict((pkg.name, pkg) for pkg in cache.get_changes()
+                   if not pkg.marked_delete and pkg.candidate)
+    deps = dict((name, set()) for name in changed)
+    for (name, pkg) in changed.items():
+        candidate = pkg.candidate
+        for dep in candidate.get_dependencies("PreDepends", "Depends"):
+            for base in dep.or_dependencies:
+                if base.name in changed and base.name != name:
+                    deps[name].add(base.name)
+        for dep in candidate.get_dependencies("Breaks", "Conflicts"):
+            for base in dep.or_dependencies:
+                other = changed.get(base.name)
+                if (other is not None and other.installed and
+                        base.name != name and
+                        _satisfies(other.installed, base)):
+                    deps[name].add(base.name)
+        if pkg.installed is None:
+            continue
+        for dep in pkg.installed.get_dependencies("PreDepends", "Depends"):
+            for base in dep.or_dependencies:
+                target = changed.get(base.name)
+                if (target is not None and base.name != name and
+                        not _satisfies(target.candidate, base)):
+                    deps[base.name].add(name)
+    return deps
+
+
+class _CancelableProgress(apt.progress.base.AcquireProgress):
+
+    def __init__(self, fetcher):
+        super(_CancelableProgress, self).__init__()
+        self._pipelined = fetcher
+
+    def pulse(self, owner):
+        self._pipelined._park()
+        return not self._pipelined._cancelled
+
+
+class PipelinedFetcher():
+    """
+    Download the archives of install batches in order in a background
+    thread, so that the first batches can be installed while the later
+    ones are still downloaded
+
+    The archives are downloaded to the partial dir and only moved to the
+    archives dir once their hash was checked. The thread does not touch
+    the cache, everything it needs is taken from the versions in
+    __init__(). With nice the thread (and the apt methods it starts)
+    runs at a lower priority.
+
+    Installing a batch (cache.commit()) while the thread downloads is
+    safe: the archives of the batch are all there, so the fetcher of the
+    commit does not download any file the thread does, the error stack
+    of apt is per thread and the child that runs dpkg only has the main
+    thread. What is not safe is changing the apt configuration or
+    opening the cache while the thread runs apt code, pause() the
+    thread around that.
+    """
+
+    def __init__(self, batches, archivedir, nice=0):
+        self.archivedir = archivedir
+        self.nice = nice
+        self._batches = []
+        for versions in batches:
+            items = []
+            for version in versions:
+                if not version.uris or not version.sha256:
+                    continue
+                items.append((version.uris[0], version.sha256, version.size,
+                              version.package.name, archive_name(version)))
+            self._batches.append(items)
+        self._results = [None] * len(self._batches)
+        self._cond = threading.Condition()
+        self._cancelled = False
+        self._paused = False
+        # the thread runs apt code (and is not waiting in _park())
+        self._busy = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _fetch_batch(self, items):
+        """ download the items of a batch, returns True on success """
+        partialdir = os.path.join(self.archivedir, "partial")
+        fetcher = apt_pkg.Acquire(_CancelableProgress(self))
+        # the items are removed from the fetcher when they are freed
+        queued = []
+        for (uri, sha256, size, pkgname, name) in items:
+            if os.path.exists(os.path.join(self.archivedir, name)):
+                continue
+            queued.append(apt_pkg.AcquireFile(
+                fetcher, uri, "SHA256:%s" % sha256, size, pkgname,
+                destfile=os.path.join(partialdir, name)))
+        if not queued:
+            return True
+        res = fetcher.run()
+        ok = res == fetcher.RESULT_CONTINUE
+        for item in fetcher.items:
+            if item.status != item.STAT_DONE:
+                logging.warning("pipelined fetch of '%s' failed: %s" % (
+                    item.desc_uri, item.error_text))
+                ok = False
+                continue
+            os.rename(item.destfile, os.path.join(
+                self.archivedir, os.path.basename(item.destfile)))
+        return ok
+
+    def _park(self):
+        """ wait in the thread while the fetcher is paused """
+        with self._cond:
+            if not self._paused:
+                return
+            self._busy = False
+            self._cond.notify_all()
+            while self._paused and not self._cancelled:
+                self._cond.wait()
+            self._busy = True
+
+    def _run(self):
+        if self.nice:
+            try:
+                # the nice value of a thread is its own on linux
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(),
+                               self.nice)
+            except OSError as e:
+                logging.debug("can not lower the priority: %s" % e)
+        for (i, items) in enumerate(self._batches):
+            with self._cond:
+                while self._paused and not self._cancelled:
+                    self._cond.wait()
+                self._busy = True
+            try:
+                ok = not self._cancelled and self._fetch_batch(items)
+            except (OSError, SystemError) as e:
+                logging.warning("pipelined fetch failed: %s" % e)
+                ok = False
+            logging.debug("pipelined fetch of batch %s/%s done (%s)" % (
+                i + 1, len(self._batches), ok))
+            with self._cond:
+                self._busy = False
+                self._results[i] = ok
+                if not ok or self._cancelled:
+                    # the rest is left to the normal download
+                    for j in range(i + 1, len(self._results)):
+                        self._results[j] = False
+                self._cond.notify_all()
+                if not ok or self._cancelled:
+                    return
+
+    def wait(self, i):
+        """ wait for batch i, returns True if it was downloaded """
+        with self._cond:
+            while self._results[i] is None:
+                self._cond.wait()
+            return self._results[i]
+
+    def pause(self):
+        """
+        stop the download until resume(), returns once the thread does
+        not run apt code anymore (this takes up to a progress pulse)
+        """
+        with self._cond:
+            self._paused = True
+            while self._busy:
+                self._cond.wait()
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def cancel(self):
+        """ stop the download (the finished batches are kept) """
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+        self.join()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,189 @@
+# DistUpgradePrefetch.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+def release_hashes(path):
+    """
+    return a dict of the SHA256 sums and sizes in a (In)Release file,
+    keyed by the path of the index file
+    """
+    fd = apt_pkg.open_maybe_clear_signed_file(path)
+    with os.fdopen(fd) as f:
+        tagfile = apt_pkg.TagFile(f)
+        if not tagfile.step():
+            return {}
+        hashes = {}
+        for line in tagfile.section.get("SHA256", "").splitlines():
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            (sha256, size, name) = fields
+            hashes[name] = (sha256, int(size))
+        return hashes
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def adopt_lists(staged_lists, listdir, verify=None):
+    """
+    copy the Release files in staged_lists and the index files whose
+    SHA256 sum matches them to listdir, returns the number of bytes
+    adopted
+
+    A target is only adopted if listdir does not have a Release file for
+    it yet and verify(release_file, prefix) (if given) returns True,
+    prefix is the start of the names of its list files.
+    """
+    adopted = 0
+    for release in sorted(glob.glob(os.path.join(staged_lists,
+                                                 "*Release"))):
+        name = os.path.basename(release)
+        if name.endswith("_InRelease"):
+            prefix = name[:-len("InRelease")]
+        elif name.endswith("_Release"):
+            prefix = name[:-len("Release")]
+        else:
+            continue
+        if (os.path.exists(os.path.join(listdir, prefix + "InRelease")) or
+                os.path.exists(os.path.join(listdir, prefix + "Release"))):
+            logging.debug("not adopting '%s', already fetched" % prefix)
+            continue
+        if verify is not None and not verify(release, prefix):
+            logging.warning("not adopting '%s', '%s' can not be "
+                            "verified" % (prefix, name))
+            continue
+        try:
+            hashes = release_hashes(release)
+        except SystemError as e:
+            logging.debug("can not read '%s': %s" % (release, e))
+            continue
+        wanted = dict((path.replace("/", "_"), value)
+                      for (path, value) in hashes.items())
+        files = [release]
+        for path in glob.glob(os.path.join(staged_lists,
+                                           glob.escape(prefix) + "*")):
+            index = os.path.basename(path)[len(prefix):]
+            if path == release or index.endswith("Release.gpg"):
+                continue
+            if (index not in wanted or
+                    os.path.getsize(path) != wanted[index][1] or
+                    _sha256(path) != wanted[index][0]):
+                logging.debug("not adopting '%s', hash mismatch" % path)
+                continue
+            files.append(path)
+        gpg = os.path.join(staged_lists, prefix + "Release.gpg")
+        if name.endswith("_Release") and os.path.exists(gpg):
+            files.append(gpg)
+        for path in files:
+            adopted += os.path.getsize(path)
+            # keep the mtime, apt uses it for If-Modified-Since
+            shutil.copy2(path, listdir)
+    return adopted
+
+
+class IndexPrefetcher():
+    """
+    Download the indexes of the sources.list the upgrade is expected to
+    end up with into a staging lists dir
+
+    This runs "apt-get update" in the background (e.g. while the user
+    answers the questions before the sources.list is rewritten), the
+    real update later adopts the files that still match the hashes of
+    their Release file.
+    """
+
+    def __init__(self, lines, aptget="apt-get"):
+        self.lines = lines
+        self.aptget = aptget
+        self.stagedir = None
+        self._proc = None
+
+    def start(self):
+        """ start the download, returns False if it could not be started """
+        self.stagedir = tempfile.mkdtemp(prefix="upgrade-prefetch-")
+        os.makedirs(os.path.join(self.stagedir, "lists", "partial"))
+        sources_list = os.path.join(self.stagedir, "sources.list")
+        with open(sources_list, "w") as f:
+            for line in self.lines:
+                f.write("%s\n" % line)
+        cmd = ["nice", "-n", "10", self.aptget, "update", "-q",
+               "-o", "Dir::Etc::sourcelist=%s" % sources_list,
+               "-o", "Dir::Etc::sourceparts=-",
+               "-o", "Dir::State::lists=%s" % os.path.join(self.stagedir,
+                                                           "lists"),
+               "-o", "Dir::Cache::pkgcache=",
+               "-o", "Dir::Cache::srcpkgcache=",
+               "-o", "APT::Get::List-Cleanup=false",
+               "-o", "APT::Sandbox::User=root",
+               "-o", "Debug::NoLocking=true"]
+        logging.debug("prefetching indexes: '%s'" % " ".join(cmd))
+        try:
+            self._proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.DEVNULL)
+        except OSError as e:
+            logging.warning("prefetching indexes failed: %s" % e)
+            self.cancel()
+            return False
+        return True
+
+    def cancel(self):
+        """ stop the download and remove the staging dir """
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            self._proc.wait()
+        self._proc = None
+        if self.stagedir:
+            shutil.rmtree(self.stagedir, ignore_errors=True)
+            self.stagedir = None
+
+    def adopt(self, listdir):
+        """
+        wait for the download and move the staged indexes to listdir,
+        returns the number of bytes adopted
+
+        A target is only adopted if listdir does not have a Release
+        file for it yet and only the index files whose SHA256 sum
+        matches its Release file are taken.
+        """
+        if self.stagedir is None:
+            return 0
+        if self._proc is not None:
+            res = self._proc.wait()
+            logging.debug("prefetching indexes finished with %s" % res)
+        adopted = adopt_lists(os.path.join(self.stagedir, "lists"), listdir)
+        logging.info("adopted %s of prefetched indexes" %
+                     apt_pkg.size_to_str(adopted))
+        self.cancel()
+        return adopted
@@ -0,0 +1,584 @@
+# DistUpgradeProbe.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import atexit
+import base64
+import http.client
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+
+PROBE_CACHE_FILE = "/var/lib/ubuntu-release-upgrader/probe-cache.json"
+
+# how long (in seconds) a probe result is trusted without asking again
+POSITIVE_TTL = 6 * 60 * 60
+NEGATIVE_TTL = 30 * 60
+
+PROBE_CACHE_MODES = ("use", "bypass", "flush")
+
+# seconds to wait for a mirror when probing it
+PROBE_TIMEOUT = 10
+
+# replies to a GET probe that are read (instead of dropping the
+# connection) so that the connection can be used again
+MAX_DRAIN = 64 * 1024
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+def get_client():
+    """Return a singleton ProbeClient instance."""
+    if ProbeClient._client is None:
+        ProbeClient._client = ProbeClient()
+    return ProbeClient._client
+
+
+class ProbeReply(object):
+    """
+    Reply of a ProbeClient request, close() it (or use it as a
+    context manager) to give the connection back to the client
+    """
+
+    def __init__(self, client, key, conn, response, connect, first_byte,
+                 slot):
+        self._client = client
+        self._key = key
+        self._conn = conn
+        # the per host semaphore the request holds
+        self._slot = slot
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+        self.connect = connect
+        self.first_byte = first_byte
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def read1(self, amt=-1):
+        """ read what is available (up to amt bytes) """
+        return self.response.read1(amt)
+
+    def close(self):
+        if self._conn is not None:
+            self._client._release(self._key, self._conn, self.response,
+                                  self._slot)
+            self._conn = None
+
+    def abort(self):
+        """ close the connection without reading the rest of the reply """
+        if self._conn is not None:
+            self._client._release(self._key, self._conn, self.response,
+                                  self._slot, reuse=False)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ProbeClient(object):
+    """
+    http(s) client for availability probes
+
+    Connections are kept open per host (and proxy) so that probing a
+    lot of uris on one mirror needs a single connection and TLS
+    handshake. The proxies come from the environment (as set up by
+    init_proxy()) and the number of parallel requests to a single host
+    is capped.
+    """
+
+    _client = None
+
+    def __init__(self, timeout=PROBE_TIMEOUT, max_per_host=4):
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self._no_head = set()
+
+    def set_max_per_host(self, max_per_host):
+        """
+        Set the number of parallel requests per host, requests that are
+        running keep (and release) the slot of the old limit
+        """
+        with self._lock:
+            self.max_per_host = max(1, max_per_host)
+            self._slots = {}
+
+    def _route(self, uri):
+        """
+        Return (key, target, extra headers) for uri, the key identifies
+        the connections that can be used for it
+        """
+        parts = urlsplit(uri)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise http.client.InvalidURL("unsupported uri '%s'" % uri)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        headers = {}
+        proxy = getproxies().get(parts.scheme)
+        if not proxy or proxy_bypass(parts.hostname):
+            return ((parts.scheme, parts.hostname, parts.port, None),
+                    target, headers)
+        proxy = urlsplit(proxy)
+        if proxy.username:
+            auth = "%s:%s" % (unquote(proxy.username),
+                              unquote(proxy.password or ""))
+            headers["Proxy-Authorization"] = "Basic %s" % (
+                base64.b64encode(auth.encode("utf-8")).decode("ascii"))
+        if parts.scheme == "http":
+            target = uri
+        return ((parts.scheme, parts.hostname, parts.port,
+                 (proxy.hostname, proxy.port or 80)), target, headers)
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self._slots[key]
+
+    def _idle_connection(self, key):
+        """Return an idle connection for key or None"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _drop_idle(self, key):
+        """Close the idle connections for key, they may all be stale"""
+        with self._lock:
+            idle = self._idle.pop(key, [])
+        for conn in idle:
+            conn.close()
+
+    def _new_connection(self, key, headers):
+        """Return a new (not yet connected) connection for key"""
+        (scheme, host, port, proxy) = key
+        if scheme == "https":
+            conn_class = http.client.HTTPSConnection
+        else:
+            conn_class = http.client.HTTPConnection
+        if proxy is None:
+            return conn_class(host, port, timeout=self.timeout)
+        conn = conn_class(proxy[0], proxy[1], timeout=self.timeout)
+        if scheme == "https":
+            conn.set_tunnel(host, port, headers=headers)
+        return conn
+
+    def _release(self, key, conn, response, slot, reuse=True):
+        reusable = reuse and not response.will_close
+        if reusable and not response.isclosed():
+            # drain small replies, drop the connection for large ones
+            if (response.length is not None and
+                    response.length <= MAX_DRAIN):
+                try:
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    reusable = False
+            else:
+                reusable = False
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(key, []).append(conn)
+        else:
+            conn.close()
+        slot.release()
+
+    def _request(self, method, uri, headers):
+        """
+        Send a single request on an idle connection or a new one. If the
+        idle connection died, the other idle ones for the host are
+        dropped as well and the request is sent on a new connection.
+        """
+        (key, target, extra_headers) = self._route(uri)
+        request_headers = dict(headers or {})
+        if key[0] == "http":
+            request_headers.update(extra_headers)
+        slot = self._slot(key)
+        slot.acquire()
+        start = time.time()
+        try:
+            conn = self._idle_connection(key)
+            if conn is not None:
+                try:
+                    conn.request(method, target, headers=request_headers)
+                    response = conn.getresponse()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    self._drop_idle(key)
+                else:
+                    return ProbeReply(self, key, conn, response, 0.0,
+                                      time.time() - start, slot)
+            conn = self._new_connection(key, extra_headers)
+            try:
+                conn.connect()
+                connect = time.time() - start
+                conn.request(method, target, headers=request_headers)
+                response = conn.getresponse()
+            except BaseException:
+                conn.close()
+                raise
+            return ProbeReply(self, key, conn, response, connect,
+                              time.time() - start, slot)
+        except BaseException:
+            slot.release()
+            raise
+
+    def open(self, method, uri, headers=None, max_redirects=5):
+        """
+        Send a request for uri and follow redirects. Returns a
+        ProbeReply, raises OSError or http.client.HTTPException if the
+        server can not be reached.
+        """
+        start = time.time()
+        connect = None
+        for i in range(max_redirects + 1):
+            reply = self._request(method, uri, headers)
+            if connect is None:
+                connect = reply.connect
+            location = reply.headers.get("Location")
+            if reply.status not in REDIRECTS or not location:
+                break
+            reply.close()
+            uri = urljoin(uri, location)
+        reply.connect = connect
+        reply.first_byte = time.time() - start
+        return reply
+
+    def probe(self, uri, headers=None):
+        """
+        Check uri with a HEAD request (or GET if the server does not
+        support HEAD) and return the ProbeReply, which is closed
+        already.
+        """
+        host = urlsplit(uri).hostname
+        method = "GET" if host in self._no_head else "HEAD"
+        reply = self.open(method, uri, headers)
+        reply.close()
+        if method == "HEAD" and reply.status in (405, 501):
+            logging.debug("'%s' does not support HEAD, using GET" % host)
+            self._no_head.add(host)
+            reply = self.open("GET", uri, headers)
+            reply.close()
+        return reply
+
+
+def timed_probe(uri):
+    """
+    Probe uri (http or https) and return a (downloadable, connect,
+    first_byte, headers) tuple with the seconds it took to connect
+    and to get the first byte of the reply. Raises OSError or
+    http.client.HTTPException if the server can not be reached.
+    """
+    reply = get_client().probe(uri)
+    return (reply.status == 200, reply.connect, reply.first_byte,
+            reply.headers)
+
+
+def measure_throughput(uri, nbytes, max_time=None):
+    """
+    Download (up to) the first nbytes of uri (for at most max_time
+    seconds) and return the download rate in bytes per second, 0 if
+    uri can not be downloaded
+    """
+    start = time.time()
+    received = 0
+    with get_client().open(
+            "GET", uri, {"Range": "bytes=0-%i" % (nbytes - 1)}) as reply:
+        if reply.status not in (200, 206):
+            return 0
+        while received < nbytes:
+            if max_time is not None and time.time() - start > max_time:
+                reply.abort()
+                break
+            chunk = reply.read1(min(64 * 1024, nbytes - received))
+            if not chunk:
+                break
+            received += len(chunk)
+    return received / max(time.time() - start, 0.001)
+
+
+def benchmark_mirrors(mirrors, path, nbytes, max_workers=8):
+    """
+    Download the first nbytes of path from all mirrors at the same
+    time and return a list of (mirror, rate) tuples, fastest first.
+    Mirrors where path can not be downloaded are left out.
+    """
+    if not mirrors:
+        return []
+
+    def benchmark(mirror):
+        uri = "%s/%s" % (mirror.rstrip("/"), path)
+        try:
+            rate = measure_throughput(uri, nbytes)
+        except (OSError, http.client.HTTPException) as e:
+            logging.debug("benchmark of '%s' failed: %s" % (uri, e))
+            return 0
+        logging.debug("benchmark of '%s': %.0f bytes/s" % (uri, rate))
+        return rate
+
+    workers = max(1, min(max_workers, len(mirrors)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rates = list(executor.map(benchmark, mirrors))
+    ranked = sorted(((-rate, i, mirror)
+                     for (i, (mirror, rate)) in enumerate(zip(mirrors, rates))
+                     if rate > 0))
+    return [(mirror, -rate) for (rate, i, mirror) in ranked]
+
+
+def get():
+    """Return a singleton _ProbeCache instance."""
+    if _ProbeCache._probe_cache is None:
+        _ProbeCache._probe_cache = _ProbeCache()
+        # the results of probes that were not followed by a save()
+        atexit.register(_ProbeCache._probe_cache.save)
+    return _ProbeCache._probe_cache
+
+
+class _ProbeCache():
+    """
+    On-disk cache of "is this url downloadable" probes
+
+    Positive and negative results are kept with the time of the probe
+    and, for http(s), the ETag/Last-Modified of the reply. Expired
+    positive results with a validator are revalidated with a
+    conditional request instead of being probed from scratch.
+
+    Results are only kept in memory until save() writes them, callers
+    run it after a batch of probes (rank() does that itself).
+    """
+
+    _probe_cache = None
+
+    def __init__(self, path=PROBE_CACHE_FILE):
+        self._path = path
+        self._mode = "use"
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.positive_ttl = POSITIVE_TTL
+        self.negative_ttl = NEGATIVE_TTL
+
+    def set_mode(self, mode):
+        """
+        Set how the cache is used: "use" it, "bypass" it (neither read
+        nor write it) or "flush" it and then use it
+        """
+        if mode not in PROBE_CACHE_MODES:
+            raise ValueError("unknown probe cache mode '%s'" % mode)
+        if mode == "flush":
+            self.flush()
+            mode = "use"
+        self._mode = mode
+
+    def set_ttls(self, positive_ttl, negative_ttl):
+        """Set the time (in seconds) positive/negative results are kept"""
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+
+    def flush(self):
+        """Forget all cached results"""
+        with self._lock:
+            self._entries = {}
+            self._dirty = False
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning("Failed to flush probe cache: %s" % e)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            with open(self._path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring probe cache '%s': %s" % (self._path, e))
+            return
+        if isinstance(entries, dict):
+            self._entries = entries
+
+    def _save(self):
+        target_dir = os.path.dirname(self._path)
+        if not os.path.isdir(target_dir):
+            return
+        try:
+            with tempfile.NamedTemporaryFile(
+                    "w", dir=target_dir, prefix=".probe-cache",
+                    delete=False) as f:
+                json.dump(self._entries, f)
+            os.rename(f.name, self._path)
+        except OSError as e:
+            logging.debug("Failed to save probe cache: %s" % e)
+
+    def save(self):
+        """Write the results of the probes since the last save()"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._save()
+            self._dirty = False
+
+    def lookup(self, uri):
+        """
+        Return the cached entry for uri as a dict with "result",
+        "time", "etag" and "last_modified" keys or None
+        """
+        if self._mode == "bypass":
+            return None
+        with self._lock:
+            self._load()
+            entry = self._entries.get(uri)
+        if not isinstance(entry, dict):
+            return None
+        return entry
+
+    def is_fresh(self, entry, now=None):
+        """Check if a cached entry is still within its ttl"""
+        if now is None:
+            now = time.time()
+        ttl = self.positive_ttl if entry.get("result") else self.negative_ttl
+        return 0 <= now - entry.get("time", 0) < ttl
+
+    def store(self, uri, result, etag=None, last_modified=None,
+              connect=None, first_byte=None):
+        """Record the result (and latency) of a probe for uri"""
+        if self._mode == "bypass":
+            return
+        with self._lock:
+            self._load()
+            self._entries[uri] = {"result": bool(result),
+                                  "time": time.time(),
+                                  "etag": etag,
+                                  "last_modified": last_modified,
+                                  "connect": connect,
+                                  "first_byte": first_byte,
+                                  }
+            self._dirty = True
+
+    def url_downloadable(self, uri, debug_func, fallback):
+        """
+        Check if uri is downloadable, using the cache when possible.
+        http(s) uris are probed here so the validators can be kept,
+        everything else is checked with fallback(uri, debug_func)
+        """
+        entry = self.lookup(uri)
+        if entry is not None and self.is_fresh(entry):
+            debug_func("using cached probe result for '%s': %s" % (
+                uri, entry["result"]))
+            return entry["result"]
+        if urlsplit(uri).scheme not in ("http", "https"):
+            res = fallback(uri, debug_func)
+            # a failure here may be temporary, only keep successes
+            if res:
+                self.store(uri, res)
+            return res
+        headers = {}
+        if entry is not None and entry.get("result"):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            reply = get_client().probe(uri, headers)
+        except (OSError, http.client.HTTPException) as e:
+            # no answer from the server, do not remember that
+            debug_func("error probing '%s': '%s'" % (uri, e))
+            return False
+        if reply.status == 304 and headers:
+            debug_func("'%s' not modified since last probe" % uri)
+            res = True
+            etag = entry.get("etag")
+            last_modified = entry.get("last_modified")
+        else:
+            debug_func("probed '%s': %s" % (uri, reply.status))
+            res = reply.status == 200
+            etag = reply.headers.get("ETag")
+            last_modified = reply.headers.get("Last-Modified")
+        self.store(uri, res, etag, last_modified)
+        return res
+
+    def _timed_downloadable(self, uri, debug_func, fallback):
+        """
+        Return a (downloadable, first_byte) tuple for uri, using the
+        cache if it knows the latency of uri already
+        """
+        entry = self.lookup(uri)
+        if (entry is not None and self.is_fresh(entry) and
+                (not entry["result"] or entry.get("first_byte") is not None)):
+            debug_func("using cached probe result for '%s': %s" % (
+                uri, entry["result"]))
+            return (entry["result"], entry.get("first_byte"))
+        if urlsplit(uri).scheme not in ("http", "https"):
+            start = time.time()
+            res = fallback(uri, debug_func)
+            first_byte = time.time() - start
+            if res:
+                self.store(uri, res, first_byte=first_byte)
+            return (res, first_byte)
+        try:
+            (res, connect, first_byte, headers) = timed_probe(uri)
+        except (OSError, http.client.HTTPException) as e:
+            debug_func("error probing '%s': '%s'" % (uri, e))
+            return (False, None)
+        debug_func("probed '%s': %s (connect %.3fs, first byte %.3fs)" % (
+            uri, res, connect, first_byte))
+        self.store(uri, res, headers.get("ETag"),
+                   headers.get("Last-Modified"), connect, first_byte)
+        return (res, first_byte)
+
+    def rank(self, uris, debug_func, fallback, max_workers=8):
+        """
+        Probe uris concurrently and return the downloadable ones,
+        fastest (time to the first byte of the reply) first
+        """
+        if not uris:
+            return []
+        workers = max(1, min(max_workers, len(uris)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda uri: self._timed_downloadable(uri, debug_func,
+                                                     fallback),
+                uris))
+        self.save()
+        ranked = sorted((first_byte, i, uri)
+                        for (i, (uri, (res, first_byte)))
+                        in enumerate(zip(uris, results)) if res)
+        return [uri for (first_byte, i, uri) in ranked]
@@ -0,0 +1,86 @@
+# DistUpgradeRemoval.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+# the dependencies the resolver fixes by removing the package
+REMOVAL_DEPS = ("PreDepends", "Depends")
+
+
+def _installed_rdepends(pkg, cache):
+    """
+    the installed packages whose installed version depends on the
+    apt_pkg.Package pkg (or on something its installed version provides)
+    """
+    targets = [pkg]
+    for (name, provver, provides) in pkg.current_ver.provides_list:
+        try:
+            targets.append(cache[name])
+        except KeyError:
+            continue
+    rdepends = []
+    for target in targets:
+        for dep in target.rev_depends_list:
+            if dep.dep_type_untranslated not in REMOVAL_DEPS:
+                continue
+            parent = dep.parent_pkg
+            if (parent.current_ver is not None and
+                    parent.current_ver.id == dep.parent_ver.id):
+                rdepends.append(parent)
+    return rdepends
+
+
+def group_by_closure(cache, names):
+    """
+    split names (installed packages of the apt_pkg.Cache cache) into
+    groups whose removals can not affect each other: two packages are in
+    the same group if something installed depends (directly or not) on
+    both of them
+
+    The groups and the names in them keep the order of names.
+    """
+    parent = dict((name, name) for name in names)
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    # package id -> the name whose reverse dependencies reached it, the
+    # reverse dependencies of a package that was reached before are
+    # already part of the group of that name
+    owner = {}
+    for name in names:
+        try:
+            pkg = cache[name]
+        except KeyError:
+            continue
+        todo = [pkg]
+        while todo:
+            pkg = todo.pop()
+            if pkg.id in owner:
+                parent[find(owner[pkg.id])] = find(name)
+                continue
+            owner[pkg.id] = name
+            if pkg.current_ver is not None:
+                todo += _installed_rdepends(pkg, cache)
+    groups = {}
+    for name in names:
+        groups.setdefault(find(name), []).append(name)
+    return list(groups.values())
@@ -0,0 +1,161 @@
+# DistUpgradeSources.py
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+#
+#  Copyright (c) 2022 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307
+#  USA
+
+import apt_pkg
+import copy
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+from aptsources.sourceslist import SourcesList
+from urllib.parse import urlsplit
+
+
+def get():
+    """Return a singleton _SourcesModel instance."""
+    if _SourcesModel._model is None:
+        _SourcesModel._model = _SourcesModel()
+    return _SourcesModel._model
+
+
+def sanitize_uri(uri):
+    """ return uri without a trailing "/" and without user:password """
+    raw_uri = uri.rstrip("/")
+    scheme, netloc, path, query, fragment = urlsplit(raw_uri)
+    if "@" in netloc:
+        netloc = netloc.split("@")[1]
+    return "%s://%s%s" % (scheme, netloc, path)
+
+
+def clone_sources(sources):
+    """
+    return a copy of a SourcesList whose entries can be modified
+    without touching the original
+    """
+    clone = copy.copy(sources)
+    clone.list = []
+    for entry in sources.list:
+        entry = copy.copy(entry)
+        for (key, value) in vars(entry).items():
+            if isinstance(value, list):
+                setattr(entry, key, list(value))
+        clone.list.append(entry)
+    return clone
+
+
+class _SourcesModel():
+    """
+    The sources.list of the system, parsed once per process
+
+    The parsed files are kept until their content changes, callers get a
+    copy they are free to modify (and save). Data derived from the
+    uris of the entries (e.g. the mirror class or the probe result) is
+    kept independent of that.
+    """
+
+    _model = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parsed = {}
+        self._derived = {}
+        self._valid = {}
+
+    def _stamp(self):
+        """ identify the current state of the sources.list files """
+        files = [apt_pkg.config.find_file("Dir::Etc::sourcelist")]
+        parts = apt_pkg.config.find_dir("Dir::Etc::sourceparts")
+        files += sorted(glob.glob(os.path.join(parts, "*.list")))
+        stamp = []
+        for path in files:
+            # the mtime can stay the same for a rewrite of the same size,
+            # reading the files is still cheap compared to parsing them
+            try:
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                continue
+            stamp.append((path, digest))
+        return tuple(stamp)
+
+    def sources(self, matcherPath=None, withMatcher=True):
+        """
+        return a SourcesList for the current sources.list files, it
+        is only parsed again if the files changed
+        """
+        key = (matcherPath, withMatcher)
+        stamp = self._stamp()
+        with self._lock:
+            (parsed_stamp, parsed) = self._parsed.get(key, (None, None))
+            if parsed is None or parsed_stamp != stamp:
+                logging.debug("parsing sources.list")
+                if matcherPath is None:
+                    parsed = SourcesList(withMatcher=withMatcher)
+                else:
+                    parsed = SourcesList(withMatcher=withMatcher,
+                                         matcherPath=matcherPath)
+                self._parsed[key] = (stamp, parsed)
+            return clone_sources(parsed)
+
+    def derived(self, kind, uri, func):
+        """
+        return func(uri) and remember the result for kind/uri, results
+        that are None are not kept
+        """
+        key = (kind, uri)
+        with self._lock:
+            if key in self._derived:
+                return self._derived[key]
+        res = func(uri)
+        if res is not None:
+            with self._lock:
+                self._derived[key] = res
+        return res
+
+    def forget(self, kind):
+        """ drop the data derived for kind (e.g. after a config change) """
+        with self._lock:
+            for key in [k for k in self._derived if k[0] == kind]:
+                del self._derived[key]
+
+    def sanitized_uri(self, uri):
+        """ the uri without user:password (see sanitize_uri()) """
+        return self.derived("sanitized", uri, sanitize_uri)
+
+    def apt_valid(self):
+        """
+        check if apt can read the current sources.list, the result is
+        kept until the files change
+        """
+        stamp = self._stamp()
+        with self._lock:
+            if stamp in self._valid:
+                return self._valid[stamp]
+        try:
+            apt_pkg.SourceList().read_main_list()
+            valid = True
+        except SystemError as e:
+            logging.error("sources.list can not be read: %s" % e)
+            valid = False
+        with self._lock:
+            self._valid[stamp] = valid
+        return valid
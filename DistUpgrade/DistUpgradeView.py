@@ -31,6 +31,7 @@ import locale
 import logging
 import signal
 import select
+import time
 
 from .DistUpgradeApport import apport_pkgfailure
 
@@ -129,12 +130,43 @@ class AcquireProgress(apt.progress.base.AcquireProgress):
   def __init__(self):
     super(AcquireProgress, self).__init__()
     self.est_speed = 0.0
+    # the RateLimit of the download (None for no limit)
+    self.rate_limit = None
+    self._throughput_logged = 0.0
+    self._rate_checked = 0.0
+    # the download was stopped because the scheduled limit changed
+    self.rate_changed = False
   def start(self):
     super(AcquireProgress, self).start()
     self.est_speed = 0.0
     self.eta = 0.0
     self.percent = 0.0
     self.release_file_download_error = False
+    # uri -> error text of the items that failed
+    self.failed_items = {}
+    # uri -> seconds spent on the item
+    self.item_times = {}
+    self._item_started = {}
+    self.rate_changed = False
+  def fetch(self, item):
+    super(AcquireProgress, self).fetch(item)
+    self._item_started.setdefault(item.uri, time.time())
+  def done(self, item):
+    super(AcquireProgress, self).done(item)
+    self._item_finished(item)
+  def ims_hit(self, item):
+    super(AcquireProgress, self).ims_hit(item)
+    self._item_finished(item)
+  def fail(self, item):
+    super(AcquireProgress, self).fail(item)
+    self._item_finished(item)
+    # failures of optional items are reported as done (ignored)
+    if item.owner.status != item.owner.STAT_DONE:
+      self.failed_items[item.uri] = item.owner.error_text
+  def _item_finished(self, item):
+    started = self._item_started.pop(item.uri, None)
+    if started is not None:
+      self.item_times[item.uri] = time.time() - started
   def update_status(self, uri, descr, shortDescr, status):
     super(AcquireProgress, self).update_status(uri, descr, shortDescr, status)
     # FIXME: workaround issue in libapt/python-apt that does not 
@@ -161,7 +193,30 @@ class AcquireProgress(apt.progress.base.AcquireProgress):
     if self.current_cps > 0:
       self.eta = ((self.total_bytes - self.current_bytes) /
                   float(self.current_cps))
+    if self.rate_limit is None:
+      return True
+    if (self.rate_limit.limit and
+        time.time() - self._throughput_logged > 30):
+      self._throughput_logged = time.time()
+      logging.info("download throughput: %s" % self.throughputStatus())
+    # the methods only read the limit when they start, so stop the
+    # download to have it started again with the scheduled limit
+    if time.time() - self._rate_checked > 60:
+      self._rate_checked = time.time()
+      if self.rate_limit.changed():
+        logging.info("the scheduled download limit changed, restarting "
+                     "the download")
+        self.rate_changed = True
+        return False
     return True
+  def throughputStatus(self):
+    """ the current download speed (and the limit if there is one) """
+    s = "%sB/s" % apt_pkg.size_to_str(int(self.current_cps))
+    if self.rate_limit is not None and self.rate_limit.limit:
+      limit = self.rate_limit.limit
+      s += " of %sB/s (%.0f%%)" % (apt_pkg.size_to_str(limit),
+                                    100.0 * self.current_cps / limit)
+    return s
   def isDownloadSpeedEstimated(self):
     return (self.est_speed != 0)
   def estimatedDownloadTime(self, required_download):
@@ -146,7 +146,8 @@ class GtkAcquireProgressAdapter(AcquireProgress):
         self.status.set_text(_("Fetching is complete"))
         self.button_cancel.hide()
     def pulse(self, owner):
-        super(GtkAcquireProgressAdapter, self).pulse(owner)
+        if not super(GtkAcquireProgressAdapter, self).pulse(owner):
+            return False
         # only update if there is a noticable change
         if abs(self.percent-self.progress.get_fraction()*100.0) > 0.1:
             self.progress.set_fraction(self.percent/100.0)
@@ -317,7 +317,8 @@ class KDEAcquireProgressAdapter(AcquireProgress):
         """ we don't have a mainloop in this application, we just call processEvents here and elsewhere"""
         # FIXME: move the status_str and progress_str into python-apt
         # (python-apt need i18n first for this)
-        AcquireProgress.pulse(self, owner)
+        if not AcquireProgress.pulse(self, owner):
+            return False
         self.progress.setValue(self.percent)
         current_item = self.current_items + 1
         if current_item > self.total_items:
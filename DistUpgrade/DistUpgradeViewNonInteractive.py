@@ -45,8 +45,8 @@ class NonInteractiveAcquireProgress(AcquireProgress):
         AcquireProgress.update_status(self, uri, descr, shortDescr, status)
         #logging.debug("Fetch: updateStatus %s %s" % (uri, status))
         if status == apt_pkg.STAT_DONE:
-            print("fetched %s (%.2f/100) at %sb/s" % (
-                uri, self.percent, apt_pkg.size_to_str(int(self.current_cps))))
+            print("fetched %s (%.2f/100) at %s" % (
+                uri, self.percent, self.throughputStatus()))
             if sys.stdout.isatty():
                 sys.stdout.flush()
         
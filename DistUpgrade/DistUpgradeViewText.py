@@ -66,8 +66,7 @@ class TextAcquireProgress(AcquireProgress, apt.progress.text.AcquireProgress):
         AcquireProgress.__init__(self)
     def pulse(self, owner):
         apt.progress.text.AcquireProgress.pulse(self, owner)
-        AcquireProgress.pulse(self, owner)
-        return True
+        return AcquireProgress.pulse(self, owner)
 
 
 class TextInstallProgress(InstallProgress):
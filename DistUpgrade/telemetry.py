@@ -79,6 +79,11 @@ class _Telemetry():
         """Record if the user had third party sources"""
         self._metrics['ThirdPartySources'] = using
 
+    def set_third_party_probe(self, kept, disabled):
+        """Record how many third party sources were kept or disabled"""
+        self._metrics['ThirdPartyProbe'] = {'Kept': kept,
+                                            'Disabled': disabled}
+
     def done(self):
         """Close telemetry collection
 
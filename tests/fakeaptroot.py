@@ -0,0 +1,71 @@
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import apt_pkg
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeCache import MyCache
+from DistUpgrade.DistUpgradeConfigParser import DistUpgradeConfig
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+PREFIX = "archive.ubuntu.com_ubuntu_dists_jammy_"
+
+
+class FakeAptRootTestCase(unittest.TestCase):
+    """
+    Test case with an apt.Cache of a temporary root dir, the dpkg status
+    is STATUS and with PACKAGES the root has a jammy main index of those
+    (no sources at all without)
+    """
+
+    STATUS = ""
+    PACKAGES = None
+
+    def setUp(self):
+        self.orig = dict((key, apt_pkg.config.find(key))
+                         for key in apt_pkg.config.keys("Dir"))
+        self.rootdir = tempfile.mkdtemp()
+        for d in ["var/lib/dpkg", "var/lib/apt/lists",
+                  "etc/apt/preferences.d"]:
+            os.makedirs(os.path.join(self.rootdir, d))
+        files = {"var/lib/dpkg/status": self.STATUS,
+                 "etc/apt/sources.list": ""}
+        if self.PACKAGES is not None:
+            files.update({
+                "etc/apt/sources.list": "deb http://archive.ubuntu.com/"
+                                        "ubuntu jammy main\n",
+                "var/lib/apt/lists/" + PREFIX + "main_binary-amd64_"
+                "Packages": self.PACKAGES,
+                "var/lib/apt/lists/" + PREFIX + "Release":
+                "Origin: Ubuntu\nSuite: jammy\nCodename: jammy\n"})
+        for (path, content) in files.items():
+            with open(os.path.join(self.rootdir, path), "w") as f:
+                f.write(content)
+        self.cache = apt.Cache(rootdir=self.rootdir)
+
+    def tearDown(self):
+        apt_pkg.config.clear("Dir")
+        for (key, value) in self.orig.items():
+            apt_pkg.config.set(key, value)
+        shutil.rmtree(self.rootdir)
+
+
+class MyCacheTestCase(FakeAptRootTestCase):
+    """
+    FakeAptRootTestCase with a MyCache of the root as cache, its apt.log
+    is in the root dir
+    """
+
+    def setUp(self):
+        super(MyCacheTestCase, self).setUp()
+        self.addCleanup(apt_pkg.config.clear, "Debug")
+        self.config = DistUpgradeConfig(CURDIR + "/data-sources-list-test/")
+        self.config.set("Files", "LogDir", self.rootdir)
+        quirks = mock.Mock()
+        quirks._get_linux_metapackage.return_value = "linux-generic"
+        self.cache = MyCache(self.config, mock.Mock(), quirks, lock=False)
+        self.addCleanup(os.close, self.cache.logfd)
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import apt_pkg
+import hashlib
+import io
+import mock
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeArchives import (
+    FetchEngine,
+    mirror_of,
+    verify_archive,
+    verify_archives,
+)
+
+MIRROR = "http://archive.ubuntu.com/ubuntu/"
+OTHER = "http://de.archive.ubuntu.com/ubuntu/"
+DEB = "pool/main/h/hello/hello_2.10-2_amd64.deb"
+
+
+def _item(uri, status, destfile=None):
+    return mock.Mock(desc_uri=uri, status=status, error_text="timeout",
+                     destfile=destfile or "/var/cache/apt/archives/x.deb",
+                     STAT_DONE=apt_pkg.AcquireItem.STAT_DONE)
+
+
+class TestFetchEngine(unittest.TestCase):
+
+    def setUp(self):
+        version = mock.Mock(uris=[MIRROR + DEB, OTHER + DEB],
+                            sha256="abc", size=10)
+        version.package.name = "hello"
+        pkg = mock.Mock(marked_delete=False, candidate=version)
+        self.cache = mock.Mock()
+        self.cache.get_changes.return_value = [pkg]
+
+    def test_mirror_of(self):
+        self.assertEqual(mirror_of(MIRROR + DEB), MIRROR)
+        self.assertEqual(mirror_of("http://localhost:9977/x.deb"),
+                         "http://localhost:9977/")
+
+    @mock.patch("apt_pkg.AcquireFile")
+    @mock.patch("apt_pkg.Acquire")
+    @mock.patch("apt_pkg.PackageManager")
+    def test_retry_failed_only(self, mock_pm, mock_acquire,
+                               mock_acquire_file):
+        first = mock.Mock(items=[
+            _item(MIRROR + "pool/main/a/a.deb", apt_pkg.AcquireItem.STAT_DONE),
+            _item(MIRROR + DEB, apt_pkg.AcquireItem.STAT_ERROR)])
+        second = mock.Mock(items=[
+            _item(OTHER + DEB, apt_pkg.AcquireItem.STAT_DONE)])
+        mock_acquire.side_effect = [first, second]
+        self.cache._fetch_archives.side_effect = (
+            apt.cache.FetchFailedException("failed"))
+        engine = FetchEngine(self.cache, None, mirror_retries=1)
+        self.assertTrue(engine.run())
+        self.assertEqual(engine.fetcher, first)
+        # only the failed item is queued again, from the other mirror
+        self.assertEqual(mock_acquire_file.call_count, 1)
+        self.assertEqual(mock_acquire_file.call_args[0][:2],
+                         (second, OTHER + DEB))
+
+    @mock.patch("apt_pkg.AcquireFile")
+    @mock.patch("apt_pkg.Acquire")
+    @mock.patch("apt_pkg.PackageManager")
+    def test_item_budget(self, mock_pm, mock_acquire, mock_acquire_file):
+        failing = mock.Mock(items=[
+            _item(MIRROR + DEB, apt_pkg.AcquireItem.STAT_ERROR)])
+        mock_acquire.return_value = failing
+        self.cache._fetch_archives.side_effect = (
+            apt.cache.FetchFailedException("failed"))
+        engine = FetchEngine(self.cache, None, item_retries=2)
+        with self.assertRaises(apt.cache.FetchFailedException):
+            engine.run()
+        self.assertEqual(mock_acquire_file.call_count, 2)
+
+
+def _tar(name, data):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _deb():
+    """ a minimal .deb """
+    members = [("debian-binary", b"2.0\n"),
+               ("control.tar.gz", _tar("./control", b"Package: hello\n")),
+               ("data.tar.gz", _tar("./hello", b"hello"))]
+    deb = b"!<arch>\n"
+    for (name, data) in members:
+        deb += ("%-16s%-12s%-6s%-6s%-8s%-10s`\n" % (
+            name, 0, 0, 0, 100644, len(data))).encode()
+        deb += data + (b"\n" if len(data) % 2 else b"")
+    return deb
+
+
+class TestVerifyArchives(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versions = []
+        for (name, data) in [("good", _deb()), ("truncated", _deb()),
+                             ("mismatch", _deb())]:
+            v = mock.Mock(version="1.0", architecture="amd64",
+                          size=len(data),
+                          sha256=hashlib.sha256(data).hexdigest())
+            v.package.shortname = name
+            if name == "truncated":
+                data = data[:-20]
+                v.size = len(data)
+                v.sha256 = hashlib.sha256(data).hexdigest()
+            elif name == "mismatch":
+                data = data.replace(b"2.0", b"3.0")
+            with open(os.path.join(self.tmpdir, "%s_1.0_amd64.deb" % name),
+                      "wb") as f:
+                f.write(data)
+            self.versions.append(v)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_verify_archive(self):
+        (good, truncated, mismatch) = self.versions
+        path = os.path.join(self.tmpdir, "good_1.0_amd64.deb")
+        self.assertIsNone(verify_archive(path, good.sha256, good.size))
+        self.assertEqual(verify_archive(path, good.sha256, 1),
+                         "size mismatch")
+
+    def test_verify_archives(self):
+        missing = mock.Mock(version="1.0", architecture="amd64", size=1,
+                            sha256="abc")
+        missing.package.shortname = "missing"
+        bad = verify_archives(self.versions + [missing], self.tmpdir,
+                              workers=2)
+        self.assertEqual([v.package.shortname for (v, problem) in bad],
+                         ["truncated", "mismatch"])
+        self.assertEqual(bad[1][1], "hash sum mismatch")
+
+
+if __name__ == "__main__":
+    unittest.main()
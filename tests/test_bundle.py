@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import hashlib
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeBundle import (
+    Bundle,
+    check_release,
+    export_bundle,
+)
+from DistUpgrade.DistUpgradePackageCache import archive_name
+
+PREFIX = "archive.ubuntu.com_ubuntu_dists_gutsy_"
+
+
+def _version(name, version, data):
+    v = mock.Mock(version=version, architecture="amd64", size=len(data),
+                  sha256=hashlib.sha256(data).hexdigest())
+    v.package.shortname = name
+    return v
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for d in ["lists", "archives", "data", "bundle", "target"]:
+            os.mkdir(os.path.join(self.tmpdir, d))
+        data = b"Package: hello\n"
+        self.lists = [os.path.join(self.tmpdir, "lists", name)
+                      for name in [PREFIX + "InRelease",
+                                   PREFIX + "main_binary-amd64_Packages"]]
+        with open(self.lists[0], "w") as f:
+            f.write("Suite: gutsy\nSHA256:\n %s %s main/binary-amd64/"
+                    "Packages\n" % (hashlib.sha256(data).hexdigest(),
+                                    len(data)))
+        with open(self.lists[1], "wb") as f:
+            f.write(data)
+        self.hello = _version("hello", "1:2.10-2", b"hello")
+        with open(os.path.join(self.tmpdir, "archives",
+                               archive_name(self.hello)), "wb") as f:
+            f.write(b"hello")
+        for name in ["gutsy.tar.gz", "gutsy.tar.gz.gpg"]:
+            with open(os.path.join(self.tmpdir, "data", name), "w"):
+                pass
+        self.bundledir = os.path.join(self.tmpdir, "bundle")
+        export_bundle(self.bundledir, self.lists, [self.hello],
+                      os.path.join(self.tmpdir, "archives"),
+                      os.path.join(self.tmpdir, "data"), "feisty", "gutsy")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_export(self):
+        self.assertEqual(sorted(os.listdir(self.bundledir)),
+                         ["debs", "gutsy.tar.gz", "gutsy.tar.gz.gpg",
+                          "lists", "manifest.json"])
+        with open(os.path.join(self.bundledir, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["From"], "feisty")
+        self.assertEqual(manifest["To"], "gutsy")
+        self.assertEqual(manifest["Lists"],
+                         sorted(os.path.basename(p) for p in self.lists))
+        self.assertEqual(manifest["Packages"][0]["File"],
+                         "hello_1%3a2.10-2_amd64.deb")
+        self.assertEqual(manifest["Packages"][0]["SHA256"],
+                         self.hello.sha256)
+
+    def test_consume(self):
+        bundle = Bundle(self.bundledir)
+        target = os.path.join(self.tmpdir, "target")
+        with mock.patch("DistUpgrade.DistUpgradeBundle.verify_release",
+                        return_value=False):
+            self.assertEqual(bundle.adopt_lists(target), 0)
+        self.assertEqual(os.listdir(target), [])
+        with mock.patch("DistUpgrade.DistUpgradeBundle.verify_release",
+                        return_value=True):
+            self.assertTrue(bundle.adopt_lists(target) > 0)
+        self.assertEqual(sorted(os.listdir(target)),
+                         sorted(os.path.basename(p) for p in self.lists))
+        archives = os.path.join(self.tmpdir, "target-archives")
+        os.makedirs(os.path.join(archives, "partial"))
+        self.assertEqual(bundle.package_store().seed([self.hello], archives),
+                         len(b"hello"))
+
+    def test_other_mirrors(self):
+        bundle = Bundle(self.bundledir)
+        target = os.path.join(self.tmpdir, "target")
+        with mock.patch("DistUpgrade.DistUpgradeBundle.verify_release",
+                        return_value=True):
+            self.assertEqual(bundle.adopt_lists(
+                target, {"mirror.example.com_ubuntu_dists_gutsy_"}), 0)
+            self.assertEqual(os.listdir(target), [])
+            self.assertTrue(bundle.adopt_lists(target, {PREFIX}) > 0)
+
+    def test_check_release(self):
+        release = os.path.join(self.tmpdir, "Release")
+        with open(release, "w") as f:
+            f.write("Suite: gutsy-updates\nCodename: gutsy\n"
+                    "Valid-Until: Mon, 01 Jan 2007 00:00:00 UTC\n")
+        self.assertIsNone(check_release(release, PREFIX, now=1))
+        self.assertIsNone(check_release(
+            release, "archive.ubuntu.com_ubuntu_dists_gutsy-updates_",
+            now=1))
+        self.assertIsNone(check_release(
+            release, "security.ubuntu.com_ubuntu_dists_gutsy_updates_",
+            now=1))
+        self.assertIsNone(check_release(
+            release, "ppa.example.com_hello_", now=1))
+        self.assertIn("not for 'hardy'", check_release(
+            release, "archive.ubuntu.com_ubuntu_dists_hardy_", now=1))
+        self.assertIn("expired", check_release(release, PREFIX))
+        with open(release, "w") as f:
+            f.write("Codename: gutsy\nValid-Until: soon\n")
+        self.assertIn("invalid", check_release(release, PREFIX))
+
+
+if __name__ == "__main__":
+    unittest.main()
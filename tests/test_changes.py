@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import unittest
+
+from DistUpgrade.DistUpgradeChanges import (
+    AUTO,
+    DELETE,
+    INSTALL,
+    KEEP,
+    PURGE,
+    ChangeTracker,
+    MarkSnapshot,
+)
+
+from fakeaptroot import FakeAptRootTestCase
+
+STATUS = """Package: libfoo1
+Status: install ok installed
+Priority: optional
+Section: libs
+Architecture: amd64
+Version: 1.0
+
+Package: app
+Status: install ok installed
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1.0
+Depends: libfoo1
+
+Package: tool
+Status: install ok installed
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1.0
+Depends: app
+
+Package: hello
+Status: install ok installed
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1.0
+
+"""
+
+PACKAGES = """Package: hello
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 2.0
+Filename: pool/h/hello_2.0_amd64.deb
+Size: 10
+
+Package: newpkg
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1.0
+Depends: hello (>= 2.0)
+Filename: pool/n/newpkg_1.0_amd64.deb
+Size: 10
+
+"""
+
+
+class FakeCacheTestCase(FakeAptRootTestCase):
+
+    STATUS = STATUS
+    PACKAGES = PACKAGES
+
+    def setUp(self):
+        super(FakeCacheTestCase, self).setUp()
+        self.tracker = ChangeTracker(self.cache)
+
+    def assertMatchesScan(self):
+        self.assertEqual(
+            sorted(pkg.get_fullname(True) for pkg in self.tracker.changes()),
+            sorted(pkg.name for pkg in apt.Cache.get_changes(self.cache)))
+
+
+class TestChangeTracker(FakeCacheTestCase):
+
+    def test_tracked_marks(self):
+        self.assertEqual(self.tracker.changes(), [])
+        self.assertEqual(self.tracker.scans, 1)
+        pkg = self.cache["libfoo1"]
+        with self.tracker.marking(pkg._pkg, delete=True):
+            pkg.mark_delete()
+        self.assertMatchesScan()
+        self.assertEqual(sorted(p.name for p in self.cache.get_changes()
+                                if p.marked_delete),
+                         ["app", "libfoo1", "tool"])
+        pkg = self.cache["newpkg"]
+        with self.tracker.marking(pkg._pkg):
+            pkg.mark_install()
+        self.assertMatchesScan()
+        self.assertTrue(self.cache["newpkg"].marked_install)
+        self.assertTrue(self.cache["hello"].marked_upgrade)
+        # no scan was needed for the marks
+        self.assertEqual(self.tracker.scans, 1)
+        self.assertEqual(self.tracker.updates, 2)
+
+    def test_untracked_marks(self):
+        self.tracker.changes()
+        # the counters of the depcache do not match anymore
+        self.cache._depcache.mark_install(self.cache["hello"]._pkg)
+        self.assertMatchesScan()
+        self.assertEqual(self.tracker.scans, 2)
+        self.tracker.invalidate()
+        self.assertMatchesScan()
+        self.assertEqual(self.tracker.scans, 3)
+
+    def test_cleared(self):
+        self.cache["hello"].mark_upgrade()
+        self.assertMatchesScan()
+        self.cache.clear()
+        self.tracker.cleared()
+        self.assertEqual(self.tracker.changes(), [])
+        self.assertEqual(self.tracker.scans, 1)
+
+    def test_limit(self):
+        self.tracker.limit = 1
+        self.tracker.changes()
+        pkg = self.cache["libfoo1"]
+        with self.tracker.marking(pkg._pkg, delete=True):
+            pkg.mark_delete()
+        self.assertMatchesScan()
+        self.assertEqual(self.tracker.scans, 2)
+
+
+class TestMarkSnapshot(FakeCacheTestCase):
+
+    def _state(self):
+        depcache = self.cache._depcache
+        return sorted((pkg.name, pkg.marked_delete, pkg.marked_install,
+                       pkg.marked_upgrade,
+                       depcache.is_auto_installed(pkg._pkg))
+                      for pkg in apt.Cache.get_changes(self.cache))
+
+    def test_restore(self):
+        self.cache["newpkg"].mark_install()
+        self.tracker.invalidate()
+        state = self._state()
+        snapshot = MarkSnapshot(self.tracker)
+        self.assertEqual(snapshot[self.cache["newpkg"]._pkg], INSTALL)
+        self.assertEqual(snapshot[self.cache["hello"]._pkg], INSTALL)
+        self.assertEqual(snapshot[self.cache["app"]._pkg], KEEP)
+        self.cache["libfoo1"].mark_delete()
+        self.cache["newpkg"].mark_keep()
+        self.tracker.invalidate()
+        self.assertNotEqual(self._state(), state)
+        self.assertTrue(snapshot.restore(self.tracker))
+        self.assertEqual(self._state(), state)
+        # the tracker knows the changes without a scan
+        scans = self.tracker.scans
+        self.assertMatchesScan()
+        self.assertEqual(self.tracker.scans, scans)
+
+    def test_nested(self):
+        empty = MarkSnapshot(self.tracker)
+        pkg = self.cache["libfoo1"]
+        self.cache._depcache.mark_delete(pkg._pkg, True)
+        self.tracker.invalidate()
+        outer = MarkSnapshot(self.tracker, purged={pkg._pkg.id})
+        self.assertEqual(outer[pkg._pkg], PURGE)
+        self.assertEqual(outer.purged, {pkg._pkg.id})
+        state = self._state()
+        self.cache["newpkg"].mark_install(auto_fix=False)
+        self.cache["hello"].mark_install(auto_fix=False)
+        self.cache._depcache.mark_auto(self.cache["hello"]._pkg, True)
+        self.tracker.invalidate()
+        inner = MarkSnapshot(self.tracker, purged=outer.purged)
+        self.assertEqual(inner[self.cache["hello"]._pkg], INSTALL | AUTO)
+        self.cache["tool"].mark_delete(auto_fix=False)
+        self.cache["hello"].mark_keep()
+        self.tracker.invalidate()
+        self.assertEqual(inner[self.cache["tool"]._pkg], KEEP)
+        self.assertTrue(inner.restore(self.tracker, outer.purged))
+        self.assertEqual(sorted(p.name for p in apt.Cache.get_changes(
+            self.cache)), ["hello", "libfoo1", "newpkg"])
+        self.assertTrue(self.cache._depcache.is_auto_installed(
+            self.cache["hello"]._pkg))
+        self.assertTrue(outer.restore(self.tracker, inner.purged))
+        self.assertEqual(self._state(), state)
+        self.assertTrue(empty.restore(self.tracker, outer.purged))
+        self.assertEqual(self.tracker.changes(), [])
+        self.assertEqual(empty[pkg._pkg], KEEP)
+        self.assertNotEqual(outer[pkg._pkg], DELETE)
+
+
+if __name__ == "__main__":
+    unittest.main()
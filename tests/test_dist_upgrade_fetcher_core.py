@@ -7,6 +7,7 @@ import apt
 import apt_pkg
 import atexit
 import logging
+import mock
 import os
 import shutil
 import tempfile
@@ -116,6 +117,75 @@ class TestDistUpgradeFetcherCoreTestCase(unittest.TestCase):
         self.assertTrue(progress.pulsed)
 
 
+class TestMirrorFromSourcesList(unittest.TestCase):
+    testdir = os.path.join(CURDIR, "data-sources-list-test/")
+
+    def setUp(self):
+        self.orig_etc = apt_pkg.config.get("Dir::Etc")
+        self.orig_sourcelist = apt_pkg.config.get("Dir::Etc::sourcelist")
+        apt_pkg.config.set("Dir::Etc", self.testdir)
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list.hardy")
+
+    def tearDown(self):
+        apt_pkg.config.set("Dir::Etc", self.orig_etc)
+        apt_pkg.config.set("Dir::Etc::sourcelist", self.orig_sourcelist)
+
+    @mock.patch("DistUpgrade.DistUpgradeFetcherCore.get_probe_cache")
+    def test_fastest_mirror_is_kept(self, mock_get_probe_cache):
+        default = "http://archive.ubuntu.com/ubuntu"
+        path = "/dists/intrepid/main/dist-upgrader-all/current/"
+        de_mirror = "http://de.archive.ubuntu.com/ubuntu/"
+        probe_cache = mock_get_probe_cache.return_value
+        probe_cache.rank.return_value = [de_mirror + path + "intrepid.tar.gz"]
+        probe_cache.url_downloadable.return_value = True
+        fetcher = TestDistUpgradeFetcherCore(None, None)
+        fetcher.current_dist_name = "hardy"
+        uri = fetcher.mirror_from_sources_list(
+            default + path + "intrepid.tar.gz", default)
+        self.assertEqual(uri, de_mirror + path + "intrepid.tar.gz")
+        # all candidates are probed at once
+        self.assertEqual(probe_cache.rank.call_count, 1)
+        candidates = probe_cache.rank.call_args[0][0]
+        self.assertIn(de_mirror + path + "intrepid.tar.gz", candidates)
+        self.assertIn("ftp://uk.archive.ubuntu.com/ubuntu/" + path +
+                      "intrepid.tar.gz", candidates)
+        # the signature comes from the same mirror without a new ranking
+        uri = fetcher.mirror_from_sources_list(
+            default + path + "intrepid.tar.gz.gpg", default)
+        self.assertEqual(uri, de_mirror + path + "intrepid.tar.gz.gpg")
+        self.assertEqual(probe_cache.rank.call_count, 1)
+
+    @mock.patch("DistUpgrade.DistUpgradeFetcherCore.country_mirror")
+    @mock.patch("DistUpgrade.DistUpgradeFetcherCore.get_probe_cache")
+    def test_country_mirror_ranked_together(self, mock_get_probe_cache,
+                                            mock_country_mirror):
+        mock_country_mirror.return_value = "de."
+        path = "/ubuntu/dists/intrepid/main/dist-upgrader-all/current/"
+        probe_cache = mock_get_probe_cache.return_value
+        probe_cache.rank.return_value = []
+        fetcher = TestDistUpgradeFetcherCore(None, None)
+        fetcher.current_dist_name = "hardy"
+        uri = fetcher._expandUri("http://${countrymirror}archive.ubuntu.com" +
+                                 path + "intrepid.tar.gz")
+        # nothing answers, the main server is used
+        self.assertEqual(uri, "http://archive.ubuntu.com" + path +
+                         "intrepid.tar.gz")
+        self.assertEqual(probe_cache.rank.call_args[0][0], [
+            "http://de.archive.ubuntu.com" + path + "intrepid.tar.gz",
+            "http://archive.ubuntu.com" + path + "intrepid.tar.gz"])
+        # the mirrors of the sources.list are ranked in the same call
+        probe_cache.rank.return_value = [
+            "http://archive.ubuntu.com" + path + "intrepid.tar.gz"]
+        uri = fetcher._expandUri("http://archive.ubuntu.com" + path +
+                                 "intrepid.tar.gz")
+        self.assertEqual(uri, "http://archive.ubuntu.com" + path +
+                         "intrepid.tar.gz")
+        self.assertEqual(probe_cache.rank.call_count, 2)
+        self.assertIn("ftp://uk.archive.ubuntu.com/ubuntu//" + path[8:] +
+                      "intrepid.tar.gz", probe_cache.rank.call_args[0][0])
+        self.assertFalse(probe_cache.url_downloadable.called)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import unittest
+
+from DistUpgrade.DistUpgradeMirrors import MirrorIndex
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_mirror(master_uri, compare_uri):
+    """ the matching rules of aptsources.sourceslist.is_mirror() """
+    compare_uri = compare_uri.rstrip("/ ")
+    master_uri = master_uri.rstrip("/ ")
+    if compare_uri == master_uri:
+        return True
+    try:
+        compare_srv = compare_uri.split("//")[1]
+        master_srv = master_uri.split("//")[1]
+    except IndexError:
+        return False
+    if ("." in compare_srv and
+            compare_srv[compare_srv.index(".") + 1:] == master_srv):
+        return True
+    return False
+
+
+class TestMirrorIndex(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(CURDIR, "..", "data", "mirrors.cfg")) as f:
+            self.mirrors = [line.strip() for line in f
+                            if line.strip() and not line.startswith("#")]
+
+    def test_official_mirrors(self):
+        index = MirrorIndex(self.mirrors)
+        for uri in ["http://archive.ubuntu.com/ubuntu",
+                    "http://archive.ubuntu.com/ubuntu/",
+                    "http://de.archive.ubuntu.com/ubuntu",
+                    "http://security.ubuntu.com/ubuntu",
+                    "ftp://archive.ubuntu.com/ubuntu"]:
+            self.assertTrue(index.is_mirror(uri), uri)
+        for uri in ["http://archive.ubuntu.com/ubuntu-ports",
+                    "http://de.archive.ubuntu.com/debian",
+                    "http://ppa.launchpad.net/mvo/ubuntu",
+                    "http://example.com/archive.ubuntu.com/ubuntu",
+                    "archive.ubuntu.com/ubuntu",
+                    ""]:
+            self.assertFalse(index.is_mirror(uri), uri)
+
+    def test_same_answers_as_is_mirror(self):
+        index = MirrorIndex(self.mirrors)
+        uris = set(self.mirrors)
+        for mirror in self.mirrors[:100]:
+            srv = mirror.split("//")[1]
+            uris.add("http://xx.%s" % srv)
+            uris.add("http://%s" % srv.replace("/", "", 1))
+            uris.add(mirror.rstrip("/") + "-ports")
+        for uri in uris:
+            expected = any(_is_mirror(m, uri) for m in self.mirrors)
+            self.assertEqual(index.is_mirror(uri), expected, uri)
+
+    def test_apt_cacher_suffix(self):
+        index = MirrorIndex(["http://security.ubuntu.com/ubuntu/"],
+                            match_suffix=True)
+        self.assertTrue(index.has_suffix(
+            "http://localhost:9977/security.ubuntu.com/ubuntu"))
+        self.assertFalse(index.has_suffix(
+            "http://localhost:9977/security.ubuntu.com/debian"))
+        # suffix matching is opt-in
+        index = MirrorIndex(["http://security.ubuntu.com/ubuntu/"])
+        self.assertFalse(index.has_suffix(
+            "http://localhost:9977/security.ubuntu.com/ubuntu"))
+
+
+if __name__ == "__main__":
+    unittest.main()
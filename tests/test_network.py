@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import os
+import time
+import unittest
+
+from DistUpgrade import DistUpgradeNetwork
+from DistUpgrade.DistUpgradeConfigParser import DistUpgradeConfig
+from DistUpgrade.DistUpgradeNetwork import (
+    RateLimit,
+    apply_network_config,
+    count_hosts,
+    parse_schedule,
+    scheduled_rate,
+)
+from DistUpgrade.DistUpgradeView import AcquireProgress
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _at(hour, minute=0):
+    return time.struct_time((2022, 4, 12, hour, minute, 0, 1, 102, -1))
+
+
+class TestNetworkConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.config = DistUpgradeConfig(CURDIR + "/data-sources-list-test/")
+        self.options = ["Acquire::http::Pipeline-Depth",
+                        "Acquire::https::Pipeline-Depth",
+                        "Acquire::http::Dl-Limit",
+                        "Acquire::https::Dl-Limit"]
+        self.orig = dict((o, apt_pkg.config.get(o)) for o in self.options)
+
+    def tearDown(self):
+        DistUpgradeNetwork._saved_dl_limits.clear()
+        for (option, value) in self.orig.items():
+            if value:
+                apt_pkg.config.set(option, value)
+            else:
+                apt_pkg.config.clear(option)
+
+    def test_schedule(self):
+        schedule = parse_schedule("08:00-18:00=512, 18:00-08:00=0, foo")
+        self.assertEqual(schedule, [(480, 1080, 512), (1080, 480, 0)])
+        self.assertEqual(scheduled_rate(schedule, _at(9), 100), 512)
+        self.assertEqual(scheduled_rate(schedule, _at(23, 30), 100), 0)
+        self.assertEqual(scheduled_rate(schedule, _at(3), 100), 0)
+        self.assertEqual(scheduled_rate([], _at(3), 100), 100)
+
+    def test_count_hosts(self):
+        self.assertEqual(count_hosts([
+            "http://archive.ubuntu.com/ubuntu/pool/main/a/a.deb",
+            "http://archive.ubuntu.com/ubuntu/pool/main/b/b.deb",
+            "https://esm.ubuntu.com/apps/ubuntu/pool/c.deb",
+            "file:///var/cache/d.deb"]), 2)
+        self.assertEqual(count_hosts([]), 1)
+
+    def test_apply(self):
+        self.assertEqual(apply_network_config(self.config).limit, 0)
+        self.assertEqual(apt_pkg.config.get("Acquire::http::Dl-Limit"),
+                         self.orig["Acquire::http::Dl-Limit"])
+        self.config.set("Network", "PipelineDepth", "0")
+        self.config.set("Network", "MaxRate", "100")
+        self.config.set("Network", "RateSchedule", "08:00-18:00=512")
+        limit = apply_network_config(self.config, 2, _at(9))
+        self.assertEqual(limit.limit, 512 * 1024)
+        self.assertEqual(
+            apt_pkg.config.get("Acquire::https::Pipeline-Depth"), "0")
+        # split across the hosts
+        self.assertEqual(apt_pkg.config.get("Acquire::http::Dl-Limit"),
+                         "256")
+        self.assertFalse(limit.changed(_at(17, 59)))
+        self.assertTrue(limit.changed(_at(18)))
+        self.assertEqual(limit.apply(_at(18)), 100 * 1024)
+        self.assertEqual(apt_pkg.config.get("Acquire::https::Dl-Limit"),
+                         "50")
+
+    def test_keep_apt_limit(self):
+        apt_pkg.config.set("Acquire::http::Dl-Limit", "64")
+        apt_pkg.config.clear("Acquire::https::Dl-Limit")
+        self.config.set("Network", "RateSchedule", "08:00-18:00=512")
+        limit = apply_network_config(self.config, 1, _at(20))
+        # no limit of our own, the one of the apt configuration stays
+        self.assertEqual(limit.limit, 0)
+        self.assertEqual(apt_pkg.config.get("Acquire::http::Dl-Limit"),
+                         "64")
+        limit.apply(_at(9))
+        self.assertEqual(apt_pkg.config.get("Acquire::http::Dl-Limit"),
+                         "512")
+        # and is restored when ours ends
+        limit.apply(_at(20))
+        self.assertEqual(apt_pkg.config.get("Acquire::http::Dl-Limit"),
+                         "64")
+        self.assertEqual(apt_pkg.config.get("Acquire::https::Dl-Limit"), "")
+
+
+class TestRateProgress(unittest.TestCase):
+
+    def test_pulse_stops_for_new_limit(self):
+        config = DistUpgradeConfig(CURDIR + "/data-sources-list-test/")
+        config.set("Network", "MaxRate", "100")
+        progress = AcquireProgress()
+        progress.start()
+        progress.rate_limit = RateLimit(config)
+        progress.rate_limit.limit = 100 * 1024
+        progress.total_bytes = progress.total_items = 1
+        self.assertTrue(progress.pulse())
+        self.assertFalse(progress.rate_changed)
+        self.assertIn("of 102 kB/s", progress.throughputStatus())
+        progress.rate_limit.limit = 0
+        progress._rate_checked = 0.0
+        self.assertFalse(progress.pulse())
+        self.assertTrue(progress.rate_changed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import functools
+import hashlib
+import http.server
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from DistUpgrade.DistUpgradePackageCache import (
+    ArchiveStore,
+    PackageStore,
+    archive_name,
+)
+
+
+def _version(name, version, data):
+    v = mock.Mock(version=version, architecture="amd64", size=len(data),
+                  sha256=hashlib.sha256(data).hexdigest())
+    v.package.shortname = name
+    return v
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPackageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmpdir, "store")
+        self.archives = os.path.join(self.tmpdir, "archives")
+        os.makedirs(self.store)
+        os.makedirs(os.path.join(self.archives, "partial"))
+        self.hello = _version("hello", "1:2.10-2", b"hello")
+        self.bye = _version("bye", "1.0", b"bye")
+        for (version, data) in [(self.hello, b"hello"),
+                                (self.bye, b"tampered")]:
+            with open(os.path.join(self.store, archive_name(version)),
+                      "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_archive_name(self):
+        self.assertEqual(archive_name(self.hello),
+                         "hello_1%3a2.10-2_amd64.deb")
+
+    def _check_seeded(self, store):
+        self.assertEqual(store.seed([self.hello, self.bye], self.archives),
+                         len(b"hello"))
+        self.assertEqual(sorted(os.listdir(self.archives)),
+                         ["hello_1%3a2.10-2_amd64.deb", "partial"])
+        self.assertEqual(os.listdir(os.path.join(self.archives, "partial")),
+                         [])
+
+    def test_seed_directory(self):
+        self._check_seeded(PackageStore(self.store))
+
+    def test_seed_http(self):
+        handler = functools.partial(QuietHandler, directory=self.store)
+        server = http.server.HTTPServer(("localhost", 0), handler)
+        threading.Thread(target=server.serve_forever).start()
+        try:
+            self._check_seeded(PackageStore(
+                "http://localhost:%s/" % server.server_port))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_publish(self):
+        new = _version("new", "1.0", b"new")
+        with open(os.path.join(self.archives, archive_name(new)), "wb") as f:
+            f.write(b"new")
+        store = PackageStore(self.store)
+        self.assertEqual(store.publish([self.hello, new], self.archives), 1)
+        with open(os.path.join(self.store, archive_name(new)), "rb") as f:
+            self.assertEqual(f.read(), b"new")
+        # remote stores are read-only
+        self.assertEqual(PackageStore("http://localhost/").publish(
+            [new], self.archives), 0)
+
+
+class TestArchiveStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archives = os.path.join(self.tmpdir, "archives")
+        os.makedirs(os.path.join(self.archives, "partial"))
+        self.store = ArchiveStore(os.path.join(self.tmpdir, "store"), 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _retain(self, version, data, mtime):
+        path = os.path.join(self.archives, archive_name(version))
+        with open(path, "wb") as f:
+            f.write(data)
+        self.assertTrue(self.store.retain(path))
+        self.assertFalse(os.path.exists(path))
+        os.utime(self.store._local_path(version), (mtime, mtime))
+
+    def test_retain_and_seed(self):
+        hello = _version("hello", "1.0", b"hello")
+        bye = _version("bye", "1.0", b"bye")
+        self._retain(hello, b"hello", 1000)
+        self.assertTrue(self.store._local_path(hello).endswith(
+            os.path.join(hello.sha256[:2], hello.sha256)))
+        self.assertEqual(self.store.seed([hello, bye], self.archives),
+                         len(b"hello"))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.archives, archive_name(hello))))
+        # seeding counts as a use
+        self.assertTrue(
+            os.path.getmtime(self.store._local_path(hello)) > 1000)
+
+    def test_evict_lru(self):
+        old = _version("old", "1.0", b"old-data")
+        new = _version("new", "1.0", b"new-data")
+        self._retain(old, b"old-data", 1000)
+        self._retain(new, b"new-data", 2000)
+        self.assertEqual(self.store.evict(), len(b"old-data"))
+        self.assertFalse(os.path.exists(self.store._local_path(old)))
+        self.assertTrue(os.path.exists(self.store._local_path(new)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import unittest
+
+from DistUpgrade.DistUpgradePackageIndex import PackageIndex, kernel_flavour
+
+from fakeaptroot import FakeAptRootTestCase
+
+STATUS = """Package: hello
+Status: install ok installed
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1.0
+
+Package: oldie
+Status: install ok installed
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 1.0
+
+Package: linux-headers-5.15.0-25-generic
+Status: install ok installed
+Priority: optional
+Section: kernel
+Architecture: amd64
+Version: 5.15.0-25.25
+
+"""
+
+PACKAGES = """Package: hello
+Priority: optional
+Section: misc
+Architecture: amd64
+Version: 2.0
+Filename: pool/h/hello_2.0_amd64.deb
+Size: 10
+
+Package: base-files
+Priority: required
+Section: admin
+Architecture: amd64
+Version: 2.0
+Filename: pool/b/base-files_2.0_amd64.deb
+Size: 10
+
+Package: linux-image-5.15.0-25-generic
+Priority: optional
+Section: kernel
+Architecture: amd64
+Version: 5.15.0-25.25
+Filename: pool/l/linux-image-5.15.0-25-generic_5.15.0-25.25_amd64.deb
+Size: 10
+
+"""
+
+
+class TestPackageIndex(FakeAptRootTestCase):
+
+    STATUS = STATUS
+    PACKAGES = PACKAGES
+
+    def setUp(self):
+        super(TestPackageIndex, self).setUp()
+        self.index = PackageIndex(self.cache._cache, self.cache._depcache)
+
+    def test_kernel_flavour(self):
+        self.assertEqual(kernel_flavour("linux-image-5.15.0-25-generic"),
+                         "generic")
+        self.assertEqual(kernel_flavour("linux-headers-5.15.0-25-lowlatency"),
+                         "lowlatency")
+        self.assertIsNone(kernel_flavour("linux-image-generic"))
+
+    def test_classification(self):
+        index = self.index
+        self.assertEqual(sorted(index.installed),
+                         ["hello", "linux-headers-5.15.0-25-generic",
+                          "oldie"])
+        self.assertEqual(index.obsolete,
+                         {"linux-headers-5.15.0-25-generic", "oldie"})
+        self.assertEqual(index.reqreinst, set())
+        self.assertEqual(index.priority["required"], {"base-files"})
+        self.assertEqual(index.section["kernel"],
+                         {"linux-image-5.15.0-25-generic"})
+        self.assertEqual(index.kernels,
+                         {"linux-image-5.15.0-25-generic": "generic"})
+        self.assertEqual(index.headers_installed,
+                         {"linux-headers-5.15.0-25-generic"})
+        self.assertEqual(index.garbage(self.cache._depcache), set())
+
+    def test_matches_packages(self):
+        """ the index agrees with the apt.Package based checks """
+        for pkg in self.cache:
+            self.assertEqual(pkg.name in self.index.downloadable,
+                             bool(pkg.candidate and
+                                  pkg.candidate.downloadable))
+            self.assertEqual(pkg.name in self.index.installed,
+                             pkg.is_installed)
+
+    def test_foreign(self):
+        self.assertEqual(self.index.foreign("Ubuntu", "impish", "jammy"),
+                         set())
+        self.assertEqual(self.index.foreign("Ubuntu", "focal", "impish"),
+                         {"hello"})
+        self.assertEqual(self.index.foreign("Debian", "impish", "jammy"),
+                         {"hello"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import hashlib
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from DistUpgrade.DistUpgradePipeline import (
+    PipelinedFetcher,
+    install_deps,
+    order_batches,
+)
+
+
+def _version(tmpdir, name, data, corrupt=False):
+    path = os.path.join(tmpdir, "%s.deb" % name)
+    with open(path, "wb") as f:
+        f.write(data + (b"x" if corrupt else b""))
+    v = mock.Mock(version="1.0", architecture="amd64", size=len(data),
+                  sha256=hashlib.sha256(data).hexdigest(),
+                  uris=["file://%s" % path])
+    v.package.name = name
+    v.package.shortname = name
+    return v
+
+
+def _dep(name, relation="", version=""):
+    base = mock.Mock(relation_deb=relation, version=version)
+    base.name = name
+    return mock.Mock(or_dependencies=[base])
+
+
+def _pkg(name, installed, candidate, deps=None, old_deps=None,
+         breaks=None):
+    pkg = mock.Mock(marked_delete=False)
+    pkg.name = name
+    pkg.candidate = mock.Mock(version=candidate)
+    pkg.candidate.get_dependencies.side_effect = lambda *types: (
+        (breaks or []) if "Breaks" in types else (deps or []))
+    if installed is None:
+        pkg.installed = None
+    else:
+        pkg.installed = mock.Mock(version=installed)
+        pkg.installed.get_dependencies.return_value = old_deps or []
+    return pkg
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_install_deps(self):
+        cache = mock.Mock()
+        cache.get_changes.return_value = [
+            _pkg("libfoo", "1.0", "2.0", breaks=[_dep("bar", "<<", "2.0")]),
+            _pkg("bar", "1.0", "2.0", deps=[_dep("libfoo")]),
+            _pkg("baz", "1.0", "2.0",
+                 old_deps=[_dep("libfoo", "<<", "1.1")]),
+            _pkg("new", None, "1.0", deps=[_dep("libc6")]),
+        ]
+        self.assertEqual(install_deps(cache),
+                         {"libfoo": {"bar", "baz"},
+                          "bar": {"libfoo"},
+                          "baz": set(),
+                          "new": set()})
+
+    def test_order_batches(self):
+        deps = {"app": {"libfoo", "libc6"},
+                "libfoo": {"libc6", "libfoo-data"},
+                "libfoo-data": {"libfoo"},
+                "libc6": {"not-changed"},
+                "tool": set()}
+        self.assertEqual(order_batches(deps, 1),
+                         [["libc6"], ["libfoo", "libfoo-data"], ["app"],
+                          ["tool"]])
+        # a cycle is never split, batches are filled up
+        self.assertEqual(order_batches(deps, 2),
+                         [["libc6", "libfoo", "libfoo-data"],
+                          ["app", "tool"]])
+        self.assertEqual(order_batches({}, 10), [])
+        # libc6 (and what it needs) comes first and on its own
+        self.assertEqual(order_batches(deps, 10, first=["libc6"]),
+                         [["libc6"], ["libfoo", "libfoo-data", "app",
+                                      "tool"]])
+        self.assertEqual(order_batches(deps, 10, first=["libfoo"]),
+                         [["libc6", "libfoo", "libfoo-data"],
+                          ["app", "tool"]])
+        self.assertEqual(order_batches(deps, 10, first=["not-there"]),
+                         [["libc6", "libfoo", "libfoo-data", "app",
+                           "tool"]])
+
+    def test_order_deep(self):
+        deps = dict(("p%s" % i, {"p%s" % (i + 1)}) for i in range(5000))
+        batches = order_batches(deps, 1000)
+        self.assertEqual(batches[0][0], "p4999")
+        self.assertEqual(sum(len(b) for b in batches), 5000)
+
+
+class TestPipelinedFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archivedir = os.path.join(self.tmpdir, "archives")
+        os.makedirs(os.path.join(self.archivedir, "partial"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_batches_in_order(self):
+        batches = [[_version(self.tmpdir, "a", b"a"),
+                    _version(self.tmpdir, "b", b"b")],
+                   [_version(self.tmpdir, "c", b"c", corrupt=True)],
+                   [_version(self.tmpdir, "d", b"d")]]
+        fetcher = PipelinedFetcher(batches, self.archivedir)
+        fetcher.start()
+        self.assertTrue(fetcher.wait(0))
+        # a failed batch stops the pipeline, the rest is left to the
+        # normal download
+        self.assertFalse(fetcher.wait(1))
+        self.assertFalse(fetcher.wait(2))
+        fetcher.join()
+        self.assertEqual(sorted(os.listdir(self.archivedir)),
+                         ["a_1.0_amd64.deb", "b_1.0_amd64.deb", "partial"])
+
+    def test_nice_and_cancel(self):
+        batches = [[_version(self.tmpdir, "a", b"a")]]
+        fetcher = PipelinedFetcher(batches, self.archivedir, nice=5)
+        fetcher.start()
+        self.assertTrue(fetcher.wait(0))
+        fetcher.cancel()
+        self.assertIn("a_1.0_amd64.deb", os.listdir(self.archivedir))
+        # nothing is downloaded once cancelled
+        batches = [[_version(self.tmpdir, "b", b"b")]]
+        fetcher = PipelinedFetcher(batches, self.archivedir)
+        fetcher.cancel()
+        fetcher.start()
+        self.assertFalse(fetcher.wait(0))
+        fetcher.join()
+        self.assertNotIn("b_1.0_amd64.deb", os.listdir(self.archivedir))
+
+    def test_pause(self):
+        batches = [[_version(self.tmpdir, "a", b"a")]]
+        fetcher = PipelinedFetcher(batches, self.archivedir)
+        fetcher.pause()
+        fetcher.start()
+        time.sleep(0.2)
+        self.assertEqual(os.listdir(self.archivedir), ["partial"])
+        fetcher.resume()
+        self.assertTrue(fetcher.wait(0))
+        fetcher.join()
+        self.assertIn("a_1.0_amd64.deb", os.listdir(self.archivedir))
+        # a paused fetcher can be cancelled
+        fetcher = PipelinedFetcher(batches, self.archivedir)
+        fetcher.pause()
+        fetcher.start()
+        fetcher.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()
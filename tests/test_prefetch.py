@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradePrefetch import IndexPrefetcher
+
+PREFIX = "archive.ubuntu.com_ubuntu_dists_gutsy_"
+
+
+class TestIndexPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.listdir = os.path.join(self.tmpdir, "lists")
+        os.mkdir(self.listdir)
+        self.prefetcher = IndexPrefetcher([])
+        self.prefetcher.stagedir = os.path.join(self.tmpdir, "stage")
+        self.staged = os.path.join(self.prefetcher.stagedir, "lists")
+        os.makedirs(self.staged)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _stage(self, prefix, indexes, corrupt=()):
+        """ stage a Release file for prefix and the given indexes """
+        lines = []
+        for (path, content) in indexes.items():
+            data = content.encode()
+            lines.append(" %s %s %s" % (hashlib.sha256(data).hexdigest(),
+                                        len(data), path))
+            if path in corrupt:
+                data += b"x"
+            with open(os.path.join(self.staged, prefix +
+                                   path.replace("/", "_")), "wb") as f:
+                f.write(data)
+        with open(os.path.join(self.staged, prefix + "InRelease"), "w") as f:
+            f.write("Suite: gutsy\nSHA256:\n%s\n" % "\n".join(lines))
+
+    def test_adopt_matching(self):
+        self._stage(PREFIX, {"main/binary-amd64/Packages": "Package: a\n",
+                             "main/i18n/Translation-en": "Package: a\n"},
+                    corrupt=["main/i18n/Translation-en"])
+        self.assertTrue(self.prefetcher.adopt(self.listdir) > 0)
+        self.assertEqual(sorted(os.listdir(self.listdir)),
+                         [PREFIX + "InRelease",
+                          PREFIX + "main_binary-amd64_Packages"])
+        # the staging dir is gone
+        self.assertFalse(os.path.exists(self.staged))
+
+    def test_keep_fetched(self):
+        self._stage(PREFIX, {"main/binary-amd64/Packages": "Package: a\n"})
+        with open(os.path.join(self.listdir, PREFIX + "InRelease"), "w"):
+            pass
+        self.assertEqual(self.prefetcher.adopt(self.listdir), 0)
+        self.assertEqual(os.listdir(self.listdir), [PREFIX + "InRelease"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,367 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import http.server
+import logging
+import mock
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from DistUpgrade.DistUpgradeProbe import (
+    _ProbeCache,
+    ProbeClient,
+    benchmark_mirrors,
+    measure_throughput,
+)
+
+
+class ReleaseHandler(http.server.BaseHTTPRequestHandler):
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path != "/ubuntu/dists/jammy/Release":
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == '"jammy"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"jammy"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SlowReleaseHandler(ReleaseHandler):
+
+    def do_GET(self):
+        time.sleep(0.5)
+        ReleaseHandler.do_GET(self)
+
+
+class PackagesHandler(http.server.BaseHTTPRequestHandler):
+    """ serve 64k of Packages.gz in 4k chunks with an injected delay """
+
+    delay = 0.0
+
+    def do_GET(self):
+        if not self.path.endswith("/Packages.gz"):
+            self.send_error(404)
+            return
+        self.send_response(206)
+        self.send_header("Content-Length", str(64 * 1024))
+        self.end_headers()
+        for i in range(16):
+            time.sleep(self.delay)
+            self.wfile.write(b"x" * 4096)
+
+    def log_message(self, *args):
+        pass
+
+
+class SlowPackagesHandler(PackagesHandler):
+
+    delay = 0.02
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    """ HTTP/1.1 server that records connections and parallel requests """
+
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    lock = threading.Lock()
+    clients = set()
+    paths = []
+    active = 0
+    max_active = 0
+
+    def do_HEAD(self):
+        cls = KeepAliveHandler
+        with cls.lock:
+            cls.clients.add(self.client_address)
+            cls.paths.append(self.path)
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(self.delay)
+        with cls.lock:
+            cls.active -= 1
+        self.send_response(200 if self.path.endswith("/Release") else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SlowKeepAliveHandler(KeepAliveHandler):
+
+    delay = 0.1
+
+
+class TestProbeClient(unittest.TestCase):
+
+    def setUp(self):
+        KeepAliveHandler.clients = set()
+        KeepAliveHandler.paths = []
+        KeepAliveHandler.active = KeepAliveHandler.max_active = 0
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def _server(self, handler):
+        server = http.server.ThreadingHTTPServer(("localhost", 0), handler)
+        threading.Thread(target=server.serve_forever).start()
+        self.servers.append(server)
+        return "http://localhost:%s" % server.server_port
+
+    def test_keep_alive(self):
+        base = self._server(KeepAliveHandler)
+        client = ProbeClient()
+        for dist in ["bionic", "focal", "jammy"]:
+            reply = client.probe("%s/ubuntu/dists/%s/Release" % (base, dist))
+            self.assertEqual(reply.status, 200)
+        reply = client.probe("%s/ubuntu/dists/jammy/Foo" % base)
+        self.assertEqual(reply.status, 404)
+        self.assertEqual(len(KeepAliveHandler.paths), 4)
+        self.assertEqual(len(KeepAliveHandler.clients), 1)
+
+    def test_max_per_host(self):
+        base = self._server(SlowKeepAliveHandler)
+        client = ProbeClient(max_per_host=2)
+        uris = ["%s/ubuntu/dists/d%s/Release" % (base, i) for i in range(6)]
+        threads = [threading.Thread(target=client.probe, args=(uri,))
+                   for uri in uris]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(KeepAliveHandler.paths), 6)
+        self.assertEqual(KeepAliveHandler.max_active, 2)
+
+    def test_stale_idle_connections(self):
+        base = self._server(KeepAliveHandler)
+        client = ProbeClient(max_per_host=1)
+        uri = "%s/ubuntu/dists/jammy/Release" % base
+        key = client._route(uri)[0]
+        stale = []
+        for i in range(2):
+            conn = client._new_connection(key, {})
+            conn.connect()
+            conn.sock.close()
+            stale.append(conn)
+        client._idle[key] = list(stale)
+        self.assertEqual(client.probe(uri).status, 200)
+        self.assertEqual(len(client._idle[key]), 1)
+        self.assertNotIn(client._idle[key][0], stale)
+        # the slot was released
+        self.assertEqual(client.probe(uri).status, 200)
+
+    def test_resize_while_running(self):
+        base = self._server(KeepAliveHandler)
+        client = ProbeClient(max_per_host=1)
+        uri = "%s/ubuntu/dists/jammy/Release" % base
+        reply = client.open("GET", uri)
+        client.set_max_per_host(2)
+        # releases the slot of the old limit
+        reply.close()
+        replies = [client.open("GET", uri) for i in range(2)]
+        for reply in replies:
+            reply.close()
+        self.assertEqual(client.probe(uri).status, 200)
+
+    def test_slot_released_on_error(self):
+        # nothing listens on the port anymore
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = ProbeClient(max_per_host=1, timeout=1)
+        uri = "http://localhost:%s/ubuntu/dists/jammy/Release" % port
+        errors = []
+
+        def probe():
+            for i in range(2):
+                try:
+                    client.probe(uri)
+                except OSError as e:
+                    errors.append(e)
+        t = threading.Thread(target=probe)
+        t.start()
+        t.join(10)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(len(errors), 2)
+
+    def test_get_fallback(self):
+        base = self._server(ReleaseHandler)
+        ReleaseHandler.requests = []
+        client = ProbeClient()
+        reply = client.probe("%s/ubuntu/dists/jammy/Release" % base)
+        self.assertEqual(reply.status, 200)
+        self.assertEqual(len(ReleaseHandler.requests), 1)
+
+    def test_proxy(self):
+        proxy = self._server(KeepAliveHandler)
+        client = ProbeClient()
+        with mock.patch.dict(os.environ, {"http_proxy": proxy,
+                                          "no_proxy": ""}):
+            reply = client.probe(
+                "http://archive.example.com/ubuntu/dists/jammy/Release")
+        self.assertEqual(reply.status, 200)
+        self.assertEqual(KeepAliveHandler.paths, [
+            "http://archive.example.com/ubuntu/dists/jammy/Release"])
+
+
+class TestBenchmarkMirrors(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def _mirror(self, handler):
+        server = http.server.HTTPServer(("localhost", 0), handler)
+        threading.Thread(target=server.serve_forever).start()
+        self.servers.append(server)
+        return "http://localhost:%s/ubuntu/" % server.server_port
+
+    def test_fastest_first(self):
+        slow = self._mirror(SlowPackagesHandler)
+        fast = self._mirror(PackagesHandler)
+        broken = self._mirror(ReleaseHandler)
+        ranked = benchmark_mirrors(
+            [slow, broken, fast],
+            "dists/jammy/main/binary-amd64/Packages.gz", 32 * 1024)
+        self.assertEqual([mirror for (mirror, rate) in ranked],
+                         [fast, slow])
+        self.assertTrue(ranked[0][1] > ranked[1][1])
+
+    def test_measure_bounded(self):
+        slow = self._mirror(SlowPackagesHandler)
+        uri = slow + "dists/jammy/main/binary-amd64/Packages.gz"
+        start = time.time()
+        rate = measure_throughput(uri, 64 * 1024, max_time=0.05)
+        self.assertTrue(time.time() - start < 0.25)
+        self.assertTrue(rate > 0)
+
+
+class TestProbeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "probe-cache.json")
+        ReleaseHandler.requests = []
+        self.server = http.server.HTTPServer(("localhost", 0), ReleaseHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.base = "http://localhost:%s/ubuntu/dists" % (
+            self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _fallback(self, uri, debug_func):
+        self.fail("fallback called for '%s'" % uri)
+
+    def _downloadable(self, cache, uri):
+        return cache.url_downloadable(uri, logging.debug, self._fallback)
+
+    def test_cached_across_instances(self):
+        cache = _ProbeCache(self.path)
+        good = self.base + "/jammy/Release"
+        bad = self.base + "/kinetic/Release"
+        self.assertTrue(self._downloadable(cache, good))
+        self.assertFalse(self._downloadable(cache, bad))
+        self.assertEqual(len(ReleaseHandler.requests), 2)
+        # the results are written once for the whole batch
+        self.assertFalse(os.path.exists(self.path))
+        cache.save()
+        self.assertTrue(os.path.exists(self.path))
+        # a new run uses the results on disk
+        cache = _ProbeCache(self.path)
+        self.assertTrue(self._downloadable(cache, good))
+        self.assertFalse(self._downloadable(cache, bad))
+        self.assertEqual(len(ReleaseHandler.requests), 2)
+
+    def test_revalidate_expired(self):
+        cache = _ProbeCache(self.path)
+        good = self.base + "/jammy/Release"
+        self.assertTrue(self._downloadable(cache, good))
+        cache.set_ttls(0, 0)
+        self.assertTrue(self._downloadable(cache, good))
+        self.assertEqual(ReleaseHandler.requests[-1],
+                         ("/ubuntu/dists/jammy/Release", '"jammy"'))
+        # the 304 refreshed the entry
+        self.assertTrue(time.time() - cache.lookup(good)["time"] < 60)
+
+    def test_bypass_and_flush(self):
+        cache = _ProbeCache(self.path)
+        good = self.base + "/jammy/Release"
+        self._downloadable(cache, good)
+        cache.set_mode("bypass")
+        self.assertIsNone(cache.lookup(good))
+        self._downloadable(cache, good)
+        self.assertEqual(len(ReleaseHandler.requests), 2)
+        cache.set_mode("flush")
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(cache.lookup(good))
+        with self.assertRaises(ValueError):
+            cache.set_mode("unknown")
+
+    def test_fallback_for_other_schemes(self):
+        cache = _ProbeCache(self.path)
+        calls = []
+
+        def fallback(uri, debug_func):
+            calls.append(uri)
+            return True
+        uri = "ftp://localhost/ubuntu/dists/jammy/Release"
+        self.assertTrue(cache.url_downloadable(uri, logging.debug, fallback))
+        self.assertTrue(cache.url_downloadable(uri, logging.debug, fallback))
+        self.assertEqual(calls, [uri])
+
+    def test_rank_by_latency(self):
+        slow_server = http.server.HTTPServer(("localhost", 0),
+                                             SlowReleaseHandler)
+        threading.Thread(target=slow_server.serve_forever).start()
+        try:
+            cache = _ProbeCache(self.path)
+            slow = "http://localhost:%s/ubuntu/dists/jammy/Release" % (
+                slow_server.server_port)
+            fast = self.base + "/jammy/Release"
+            missing = self.base + "/kinetic/Release"
+            ranked = cache.rank([slow, missing, fast], logging.debug,
+                                self._fallback)
+            self.assertEqual(ranked, [fast, slow])
+            self.assertIsNotNone(cache.lookup(slow)["first_byte"])
+            # a ranking saves its results
+            self.assertIsNotNone(
+                _ProbeCache(self.path).lookup(slow)["first_byte"])
+            # the latency is cached as well
+            requests = len(ReleaseHandler.requests)
+            self.assertEqual(cache.rank([slow, fast], logging.debug,
+                                        self._fallback), [fast, slow])
+            self.assertEqual(len(ReleaseHandler.requests), requests)
+        finally:
+            slow_server.shutdown()
+            slow_server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import unittest
+
+from DistUpgrade.DistUpgradeRemoval import group_by_closure
+
+from fakeaptroot import FakeAptRootTestCase, MyCacheTestCase
+
+STATUS = """Package: libfoo1
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+
+Package: libbar1
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+
+Package: app
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Depends: libfoo1, libbar1
+
+Package: tool
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Depends: app
+
+Package: hello
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Recommends: libfoo1
+
+Package: postfix
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Provides: mail-transport-agent
+
+Package: mailer
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Depends: mail-transport-agent
+
+"""
+
+
+class TestGroupByClosure(FakeAptRootTestCase):
+
+    STATUS = STATUS
+
+    def test_groups(self):
+        names = ["hello", "libfoo1", "mailer", "libbar1", "postfix", "tool",
+                 "not-there"]
+        self.assertEqual(group_by_closure(self.cache._cache, names),
+                         [["hello"], ["libfoo1", "libbar1", "tool"],
+                          ["mailer", "postfix"], ["not-there"]])
+
+    def test_independent(self):
+        self.assertEqual(group_by_closure(self.cache._cache,
+                                          ["tool", "hello"]),
+                         [["tool"], ["hello"]])
+        self.assertEqual(group_by_closure(self.cache._cache, []), [])
+
+
+class TestMarkObsoletes(MyCacheTestCase):
+    """ the grouped pass gives the result of the tryMarkObsoleteForRemoval()
+        loop it replaces """
+
+    STATUS = STATUS
+
+    def setUp(self):
+        super(TestMarkObsoletes, self).setUp()
+        self.config.set("Distro", "PurgeObsoletes", "yes")
+
+    def _marks(self):
+        return (sorted(pkg.name for pkg in self.cache.get_changes()),
+                sorted(self.cache.create_snapshot().purged))
+
+    def assertSameAsSequential(self, names, candidates, forced=()):
+        rejected = self.cache.markObsoletesForRemoval(
+            names, candidates, forced, set())
+        marks = self._marks()
+        self.cache.clear()
+        self.assertEqual(self._marks(), ([], []))
+        sequential = [name for name in names
+                      if not self.cache.tryMarkObsoleteForRemoval(
+                          name, candidates, forced, set())]
+        self.assertEqual(sorted(rejected), sorted(sequential))
+        self.assertEqual(marks, self._marks())
+        return (rejected, marks[0])
+
+    def test_groups(self):
+        names = ["hello", "mailer", "postfix"]
+        self.assertEqual(self.assertSameAsSequential(names, set(names)),
+                         ([], ["hello", "mailer", "postfix"]))
+
+    def test_conflicting_group(self):
+        # the removal of libbar1 takes app with it, the group of tool and
+        # libbar1 is checked one by one
+        names = ["tool", "libbar1", "hello"]
+        self.assertEqual(self.assertSameAsSequential(names, set(names)),
+                         (["libbar1"], ["hello", "tool"]))
+
+    def test_forced_obsolete(self):
+        # the forced removal of libbar1 leaves app behind as an unwanted
+        # removal, so hello is rejected after it
+        names = ["tool", "libbar1", "hello"]
+        self.assertEqual(
+            self.assertSameAsSequential(names, set(names), {"libbar1"}),
+            (["hello"], ["app", "libbar1", "tool"]))
+
+    def test_skipped(self):
+        names = ["linux-generic", "hello", "not-there"]
+        self.assertEqual(self.assertSameAsSequential(names, set(names)),
+                         (["linux-generic"], ["hello"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
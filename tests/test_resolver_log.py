@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import mock
+import os
+import tempfile
+import unittest
+
+from fakeaptroot import MyCacheTestCase
+
+
+class TestResolverLog(MyCacheTestCase):
+
+    def setUp(self):
+        super(TestResolverLog, self).setUp()
+        self.logfile = os.path.join(self.rootdir, "apt.log")
+        # stdout and stderr of the test go to self.terminal
+        self.terminal = tempfile.TemporaryFile()
+        self.addCleanup(self.terminal.close)
+        saved = [os.dup(1), os.dup(2)]
+        for (fd, orig) in enumerate(saved, 1):
+            self.addCleanup(os.close, orig)
+            self.addCleanup(os.dup2, orig, fd)
+            os.dup2(self.terminal.fileno(), fd)
+
+    def _write(self, text):
+        os.write(1, ("%s\n" % text).encode())
+        os.write(2, ("%s (stderr)\n" % text).encode())
+
+    def _terminal(self):
+        self.terminal.seek(0)
+        return self.terminal.read().decode()
+
+    def _log(self):
+        with open(self.logfile) as f:
+            return f.read()
+
+    def test_redirect(self):
+        self._write("before")
+        with self.cache.resolverLog():
+            self._write("resolver")
+        self._write("after")
+        self.assertIn("resolver\nresolver (stderr)\n", self._log())
+        self.assertEqual(self._terminal(),
+                         "before\nbefore (stderr)\nafter\nafter (stderr)\n")
+
+    def test_nested(self):
+        with self.cache.resolverLog():
+            with self.cache.resolverLog():
+                self._write("inner")
+            # still redirected after the inner block
+            self._write("outer")
+            with self.cache._outsideResolverLog():
+                self._write("progress")
+            self._write("outer again")
+        self.assertIsNone(self.cache.old_stdout)
+        self.assertIn("inner\ninner (stderr)\nouter\nouter (stderr)\n"
+                      "outer again\n", self._log())
+        self.assertEqual(self._terminal(),
+                         "progress\nprogress (stderr)\n")
+
+    def test_single_sync(self):
+        with mock.patch("os.fsync") as fsync:
+            with self.cache.resolverLog():
+                with self.cache.resolverLog():
+                    pass
+                for i in range(3):
+                    with self.cache._outsideResolverLog():
+                        pass
+            fsync.assert_called_once_with(self.cache.logfd)
+
+    def test_restore_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.cache.resolverLog():
+                with self.cache.resolverLog():
+                    raise ValueError("resolver failed")
+        self.assertIsNone(self.cache.old_stdout)
+        self.assertIsNone(self.cache.old_stderr)
+        self._write("after")
+        self.assertEqual(self._terminal(), "after\nafter (stderr)\n")
+        # and the next block is redirected again
+        with self.cache.resolverLog():
+            self._write("again")
+        self.assertIn("again\n", self._log())
+
+
+if __name__ == "__main__":
+    unittest.main()
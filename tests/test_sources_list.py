@@ -8,6 +8,7 @@ import distro_info
 import os
 import shutil
 import subprocess
+import tempfile
 import unittest
 from DistUpgrade.DistUpgradeController import (
     DistUpgradeController,
@@ -194,6 +195,185 @@ deb http://ports.ubuntu.com/ubuntu-ports/ gutsy-security universe
 # deb http://ports.ubuntu.com/ubuntu-ports/ feisty-security universe
 """)
 
+    @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController._sourcesListEntryDownloadable")
+    @mock.patch("DistUpgrade.DistUpgradeController.get_distro")
+    def test_sources_list_rewrite_probes_each_uri_once(self, mock_get_distro, mock_sourcesListEntryDownloadable):
+        """
+        test that the Release file of every uri is only checked once
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.in"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d.config.set("Distro", "BaseMetaPkgs", "ubuntu-minimal")
+        d.config.set("Network", "ProbeWorkers", "4")
+        mock_get_distro.return_value = UbuntuDistribution("Ubuntu", "feisty",
+                                                          "Ubuntu Feisty Fawn",
+                                                          "7.04")
+        d.openCache(lock=False)
+        mock_sourcesListEntryDownloadable.return_value = True
+        res = d.updateSourcesList()
+        self.assertTrue(res)
+        probed = [(c[0][0].uri, c[0][0].dist)
+                  for c in mock_sourcesListEntryDownloadable.call_args_list]
+        self.assertEqual(len(probed), len(set(probed)))
+        self.assertIn(("http://archive.ubuntu.com/ubuntu", "gutsy"), probed)
+        self.assertIn(("http://security.ubuntu.com/ubuntu/", "gutsy"),
+                      probed)
+        for (uri, dist) in probed:
+            self.assertEqual(dist, "gutsy")
+
+    @unittest.skipUnless(ARCH in ('amd64', 'i386'), "ports are not mirrored")
+    @mock.patch("DistUpgrade.DistUpgradeController.benchmark_mirrors")
+    @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController._sourcesListEntryDownloadable")
+    @mock.patch("DistUpgrade.DistUpgradeController.get_distro")
+    def test_sources_list_rewrite_fastest_mirror(self, mock_get_distro, mock_sourcesListEntryDownloadable, mock_benchmark_mirrors):
+        """
+        test that the archive entries are moved to the fastest mirror
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.in"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d.config.set("Distro", "BaseMetaPkgs", "ubuntu-minimal")
+        d.config.set("Network", "BenchmarkMirrors", "yes")
+        mock_get_distro.return_value = UbuntuDistribution("Ubuntu", "feisty",
+                                                          "Ubuntu Feisty Fawn",
+                                                          "7.04")
+        d.openCache(lock=False)
+        mock_sourcesListEntryDownloadable.return_value = True
+        mock_benchmark_mirrors.return_value = [
+            ("http://de.archive.ubuntu.com/ubuntu/", 4 * 1024 * 1024),
+            ("http://archive.ubuntu.com/ubuntu/", 1024 * 1024)]
+        res = d.updateSourcesList()
+        self.assertTrue(res)
+        self.assertTrue(mock_benchmark_mirrors.called)
+        self._verifySources("""
+# main repo
+deb http://de.archive.ubuntu.com/ubuntu/ gutsy main restricted multiverse universe
+deb-src http://de.archive.ubuntu.com/ubuntu/ gutsy main restricted multiverse
+deb http://security.ubuntu.com/ubuntu/ gutsy-security main restricted
+""")
+
+    def test_update_only_changed(self):
+        """
+        test that the second update only fetches the changed entries
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.in"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        listdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, listdir)
+        self.addCleanup(apt_pkg.config.set, "Dir::State::lists",
+                        apt_pkg.config.get("Dir::State::lists"))
+        apt_pkg.config.set("Dir::State::lists", listdir)
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d.config.set("Network", "RetryBackoff", "0")
+        d.openCache(lock=False)
+        fetched = []
+
+        def update(progress, sources_list=None):
+            if sources_list is None:
+                fetched.append(None)
+            else:
+                with open(sources_list) as f:
+                    fetched.append(f.read().splitlines())
+        d.cache.update = update
+        self.assertTrue(d.doUpdate(forceRetries=1))
+        # the lists of the first update
+        for uri in ["http://archive.ubuntu.com/ubuntu/dists/feisty/",
+                    "http://security.ubuntu.com/ubuntu/dists/"
+                    "feisty-security/"]:
+            name = apt_pkg.uri_to_filename(uri + "InRelease")
+            with open(os.path.join(listdir, name), "w") as f:
+                f.write("x" * 1024)
+        with open(os.path.join(self.testdir, "sources.list"), "a") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu gutsy main\n")
+        self.assertTrue(d.doUpdate(onlyChanged=True))
+        self.assertEqual(fetched, [
+            None, ["deb http://archive.ubuntu.com/ubuntu gutsy main"]])
+        name = apt_pkg.uri_to_filename(
+            "http://archive.ubuntu.com/ubuntu/dists/gutsy/InRelease")
+        with open(os.path.join(listdir, name), "w") as f:
+            f.write("x")
+        # nothing changed, nothing to fetch
+        self.assertTrue(d.doUpdate(onlyChanged=True))
+        self.assertEqual(len(fetched), 2)
+        # a failing partial update falls back to a full one
+        with open(os.path.join(self.testdir, "sources.list"), "a") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu gutsy universe\n")
+
+        def failing_update(progress, sources_list=None):
+            fetched.append(sources_list)
+            if sources_list is not None:
+                raise IOError("failed")
+        d.cache.update = failing_update
+        self.assertTrue(d.doUpdate(onlyChanged=True))
+        self.assertEqual(fetched[-1], None)
+        self.assertFalse(os.path.exists(fetched[-2]))
+
+    def test_update_retry_failed(self):
+        """
+        test that a retry only fetches the targets of the failed items
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.in"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d.config.set("Network", "RetryBackoff", "0")
+        d.openCache(lock=False)
+        fetched = []
+
+        def update(progress, sources_list=None):
+            if sources_list is None:
+                fetched.append(None)
+                progress.failed_items = {
+                    "http://security.ubuntu.com/ubuntu/dists/"
+                    "feisty-security/main/binary-i386/Packages.xz":
+                    "Connection timed out"}
+                raise IOError("failed")
+            with open(sources_list) as f:
+                fetched.append(f.read().splitlines())
+        d.cache.update = update
+        self.assertTrue(d.doUpdate())
+        self.assertEqual(fetched, [None, [
+            "deb http://security.ubuntu.com/ubuntu/ feisty-security main "
+            "restricted",
+            "deb http://security.ubuntu.com/ubuntu/ feisty-security "
+            "universe"]])
+
+    @mock.patch("DistUpgrade.DistUpgradeController.IndexPrefetcher")
+    def test_prefetch_indexes(self, mock_prefetcher):
+        """
+        test that the indexes of the new release are prefetched
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.in"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d._startIndexPrefetch()
+        self.assertFalse(mock_prefetcher.called)
+        d.config.set("Network", "PrefetchIndexes", "yes")
+        d._startIndexPrefetch()
+        self.assertEqual(mock_prefetcher.call_args[0][0], [
+            "deb http://archive.ubuntu.com/ubuntu gutsy main restricted "
+            "multiverse universe",
+            "deb http://archive.ubuntu.com/ubuntu/ gutsy main restricted "
+            "multiverse",
+            "deb-src http://archive.ubuntu.com/ubuntu gutsy main restricted "
+            "multiverse",
+            "deb http://security.ubuntu.com/ubuntu/ gutsy-security main "
+            "restricted",
+            "deb http://security.ubuntu.com/ubuntu/ gutsy-security "
+            "universe"])
+        d._adoptPrefetchedIndexes()
+        self.assertTrue(mock_prefetcher.return_value.adopt.called)
+
     @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController.abort")
     @mock.patch("DistUpgrade.DistUpgradeController.get_distro")
     def test_double_check_source_distribution_reject(self, mock_abort, mock_get_distro):
@@ -759,6 +939,37 @@ deb http://ports.ubuntu.com/ubuntu-ports/ gutsy-security main restricted
 deb http://ports.ubuntu.com/ubuntu-ports/ gutsy-backports main restricted universe multiverse
 """)
 
+    @unittest.skipUnless(ARCH in ('amd64', 'i386'), "ports are not mirrored")
+    @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController._sourcesListEntryDownloadable")
+    def test_probe_third_party(self, mock_sourcesListEntryDownloadable):
+        """
+        test that third party sources with a Release file for the new
+        release are kept when probing them is enabled
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.third-party"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d.config.set("Sources", "ProbeThirdParty", "yes")
+        d.openCache(lock=False)
+        mock_sourcesListEntryDownloadable.side_effect = \
+            lambda entry: "/gone/" not in entry.uri
+        res = d.updateSourcesList()
+        self.assertTrue(res)
+        self._verifySources("""
+deb http://archive.ubuntu.com/ubuntu gutsy main restricted
+deb http://ppa.example.com/good/ubuntu gutsy main
+deb http://repo.example.com/apt stable main
+""")
+        sources_file = apt_pkg.config.find_file("Dir::Etc::sourcelist")
+        with open(sources_file) as f:
+            for line in f:
+                self.assertFalse(line.startswith("deb http://ppa.example.com/gone"))
+        self.assertEqual(d.third_party_kept, 2)
+        self.assertEqual(d.third_party_disabled, 1)
+        self.assertTrue(d.sources_disabled)
+
     @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController._sourcesListEntryDownloadable")
     def test_disable_proposed(self, mock_sourcesListEntryDownloadable):
         """
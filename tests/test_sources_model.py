@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from aptsources.sourceslist import SourcesList
+from DistUpgrade.DistUpgradeSources import _SourcesModel, sanitize_uri
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestSourcesModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, "sources.list.d"))
+        shutil.copy(os.path.join(CURDIR, "data-sources-list-test",
+                                 "sources.list.in"),
+                    os.path.join(self.tmpdir, "sources.list"))
+        self.orig_etc = apt_pkg.config.get("Dir::Etc")
+        self.orig_sourcelist = apt_pkg.config.get("Dir::Etc::sourcelist")
+        self.orig_sourceparts = apt_pkg.config.get("Dir::Etc::sourceparts")
+        apt_pkg.config.set("Dir::Etc", self.tmpdir)
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        apt_pkg.config.set("Dir::Etc::sourceparts", "sources.list.d")
+
+    def tearDown(self):
+        apt_pkg.config.set("Dir::Etc", self.orig_etc)
+        apt_pkg.config.set("Dir::Etc::sourcelist", self.orig_sourcelist)
+        apt_pkg.config.set("Dir::Etc::sourceparts", self.orig_sourceparts)
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch("DistUpgrade.DistUpgradeSources.SourcesList",
+                wraps=SourcesList)
+    def test_parsed_once(self, mock_sources_list):
+        model = _SourcesModel()
+        first = model.sources(withMatcher=False)
+        second = model.sources(withMatcher=False)
+        self.assertEqual(mock_sources_list.call_count, 1)
+        # the copies are independent
+        (a, b) = [i for (i, e) in enumerate(first.list) if e.uri][:2]
+        first.list[a].uri = "http://example.com/ubuntu"
+        first.list[b].comps.append("foo")
+        self.assertNotEqual(second.list[a].uri, first.list[a].uri)
+        self.assertNotIn("foo", second.list[b].comps)
+        self.assertEqual([str(e) for e in second.list],
+                         [str(e) for e in model.sources(
+                             withMatcher=False).list])
+        # saving a copy changes the files and they are parsed again
+        first.save()
+        third = model.sources(withMatcher=False)
+        self.assertEqual(mock_sources_list.call_count, 2)
+        self.assertEqual(third.list[a].uri, "http://example.com/ubuntu")
+
+    @mock.patch("DistUpgrade.DistUpgradeSources.SourcesList",
+                wraps=SourcesList)
+    def test_same_size_rewrite(self, mock_sources_list):
+        path = os.path.join(self.tmpdir, "sources.list")
+        with open(path, "w") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu jammy main\n")
+        st = os.stat(path)
+        model = _SourcesModel()
+        self.assertEqual(model.sources(withMatcher=False).list[0].dist,
+                         "jammy")
+        with open(path, "w") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu lunar main\n")
+        # within the mtime granularity
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(model.sources(withMatcher=False).list[0].dist,
+                         "lunar")
+        self.assertEqual(mock_sources_list.call_count, 2)
+
+    def test_derived(self):
+        model = _SourcesModel()
+        calls = []
+
+        def classify(uri):
+            calls.append(uri)
+            return uri.startswith("http://archive")
+        uri = "http://archive.ubuntu.com/ubuntu"
+        self.assertTrue(model.derived("mirror", uri, classify))
+        self.assertTrue(model.derived("mirror", uri, classify))
+        self.assertEqual(len(calls), 1)
+        model.forget("mirror")
+        self.assertTrue(model.derived("mirror", uri, classify))
+        self.assertEqual(len(calls), 2)
+        # None is not kept
+        model.derived("probe", uri, lambda uri: calls.append(uri))
+        model.derived("probe", uri, lambda uri: calls.append(uri))
+        self.assertEqual(len(calls), 4)
+
+    def test_sanitize_uri(self):
+        self.assertEqual(
+            sanitize_uri("http://user:pw@archive.ubuntu.com/ubuntu/"),
+            "http://archive.ubuntu.com/ubuntu")
+
+    def test_apt_valid(self):
+        model = _SourcesModel()
+        self.assertTrue(model.apt_valid())
+        with open(os.path.join(self.tmpdir, "sources.list"), "a") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu\n")
+        self.assertFalse(model.apt_valid())
+
+
+if __name__ == "__main__":
+    unittest.main()